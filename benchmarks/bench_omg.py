@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# benchmarks/bench_omg.py
+#
+# Reproducible throughput benchmarks for compiling, loading and matching.
+# Dictionaries and haystacks are generated from a seed, so two runs with the
+# same arguments measure the same work. Results are written as JSON.
+#
+#   python benchmarks/bench_omg.py --patterns 10000,1000000 --output run.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from omg.omg import Compiler, Matcher, get_version  # noqa: E402
+
+ALPHABET = b"abcdefghijklmnopqrstuvwxyz "
+WORD_ALPHABET = ALPHABET[:-1]
+
+
+def peak_rss_bytes() -> Optional[int]:
+    # Process-wide high-water mark; it never decreases between phases
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def random_text(rng: random.Random, size: int, alphabet: bytes) -> bytes:
+    if size <= 0:
+        return b""
+    raw = rng.getrandbits(8 * size).to_bytes(size, "little")
+    table = bytes(alphabet[i % len(alphabet)] for i in range(256))
+    return raw.translate(table)
+
+
+def generate_patterns(
+    rng: random.Random,
+    count: int,
+    short_fraction: float,
+    min_len: int,
+    max_len: int,
+) -> List[bytes]:
+    # Short patterns (2-3 bytes; 1-byte patterns are rejected by the
+    # compiler) are drawn with probability short_fraction, the rest have a
+    # uniform length in [min_len, max_len]
+    lengths = [
+        (
+            rng.randint(2, 3)
+            if rng.random() < short_fraction
+            else rng.randint(min_len, max_len)
+        )
+        for _ in range(count)
+    ]
+    text = random_text(rng, sum(lengths), WORD_ALPHABET)
+    patterns = []
+    pos = 0
+    for length in lengths:
+        patterns.append(text[pos : pos + length])
+        pos += length
+    return patterns
+
+
+def generate_haystack(
+    rng: random.Random, size: int, patterns: List[bytes], hit_density: float
+) -> bytes:
+    # hit_density is the fraction of haystack bytes covered by planted
+    # pattern occurrences; random text produces additional incidental hits
+    haystack = bytearray(random_text(rng, size, ALPHABET))
+    if patterns and hit_density > 0:
+        planted = 0
+        target = int(size * hit_density)
+        while planted < target:
+            pattern = patterns[rng.randrange(len(patterns))]
+            if len(pattern) >= size:
+                break
+            pos = rng.randrange(size - len(pattern))
+            haystack[pos : pos + len(pattern)] = pattern
+            planted += len(pattern)
+    return bytes(haystack)
+
+
+def best_of(repeat: int, func: Callable[[], Any]) -> Tuple[float, Any]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def rate(amount: float, seconds: float) -> Optional[float]:
+    return amount / seconds if seconds > 0 else None
+
+
+def bench_dictionary(
+    args: argparse.Namespace, count: int, workdir: str
+) -> List[Dict[str, Any]]:
+    rng = random.Random(args.seed + count)
+    patterns = generate_patterns(
+        rng, count, args.short_fraction, args.min_len, args.max_len
+    )
+    patterns_buf = b"\n".join(patterns)
+    pattern_mb = len(patterns_buf) / 1e6
+    compiled_file = os.path.join(workdir, f"bench-{count}.omg")
+    common = {"patterns": count, "pattern_bytes": len(patterns_buf)}
+    results: List[Dict[str, Any]] = []
+
+    seconds, stats = best_of(
+        args.repeat,
+        lambda: Compiler.compile_from_buffer(compiled_file, patterns_buf),
+    )
+    results.append(
+        dict(
+            common,
+            benchmark="compile_from_buffer",
+            seconds=seconds,
+            mb_per_s=rate(pattern_mb, seconds),
+            patterns_per_s=rate(count, seconds),
+            stored_pattern_count=stats.stored_pattern_count,
+            short_pattern_count=stats.short_pattern_count,
+            duplicate_patterns=stats.duplicate_patterns,
+            peak_rss_bytes=peak_rss_bytes(),
+        )
+    )
+
+    def add_pattern_loop() -> None:
+        with Compiler(os.path.join(workdir, "add-pattern.omg")) as compiler:
+            for pattern in patterns:
+                compiler.add_pattern(pattern)
+
+    def add_patterns() -> None:
+        with Compiler(os.path.join(workdir, "add-pattern.omg")) as compiler:
+            compiler.add_patterns(patterns)
+
+    def add_patterns_buffer() -> None:
+        with Compiler(os.path.join(workdir, "add-pattern.omg")) as compiler:
+            compiler.add_patterns_buffer(patterns_buf)
+
+    for name, func in (
+        ("add_pattern_loop", add_pattern_loop),
+        ("add_patterns", add_patterns),
+        ("add_patterns_buffer", add_patterns_buffer),
+    ):
+        seconds, _ = best_of(args.repeat, func)
+        results.append(
+            dict(
+                common,
+                benchmark=name,
+                seconds=seconds,
+                mb_per_s=rate(pattern_mb, seconds),
+                patterns_per_s=rate(count, seconds),
+                peak_rss_bytes=peak_rss_bytes(),
+            )
+        )
+
+    def load() -> None:
+        Matcher(compiled_file).destroy()
+
+    seconds, _ = best_of(args.repeat, load)
+    results.append(
+        dict(
+            common,
+            benchmark="matcher_load",
+            seconds=seconds,
+            compiled_bytes=os.path.getsize(compiled_file),
+            peak_rss_bytes=peak_rss_bytes(),
+        )
+    )
+
+    for density in args.hit_density:
+        haystack = generate_haystack(
+            rng, int(args.haystack_mb * 1e6), patterns, density
+        )
+        with Matcher(compiled_file) as matcher:
+            for threads in args.threads:
+                for chunk_size in args.chunk_sizes:
+                    matcher.set_threads(threads)
+                    matcher.set_chunk_size(chunk_size)
+                    # match builds MatchResult objects, match_arrays does not;
+                    # the difference is the Python-side conversion cost
+                    for name, func in (
+                        ("match", matcher.match),
+                        ("match_arrays", matcher.match_arrays),
+                    ):
+                        seconds, hits = best_of(args.repeat, lambda: func(haystack))
+                        results.append(
+                            dict(
+                                common,
+                                benchmark=name,
+                                haystack_bytes=len(haystack),
+                                hit_density=density,
+                                threads=matcher.get_threads(),
+                                chunk_size=matcher.get_chunk_size(),
+                                hits=len(hits),
+                                seconds=seconds,
+                                mb_per_s=rate(len(haystack) / 1e6, seconds),
+                                hits_per_s=rate(len(hits), seconds),
+                                peak_rss_bytes=peak_rss_bytes(),
+                            )
+                        )
+    return results
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def float_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="omg throughput benchmarks")
+    parser.add_argument(
+        "--patterns",
+        type=int_list,
+        default=[10_000, 100_000],
+        help="Comma-separated dictionary sizes (default: 10000,100000)",
+    )
+    parser.add_argument(
+        "--short-fraction",
+        type=float,
+        default=0.1,
+        help="Fraction of 2-3 byte patterns (default: 0.1)",
+    )
+    parser.add_argument("--min-len", type=int, default=4, help="Min pattern length")
+    parser.add_argument("--max-len", type=int, default=24, help="Max pattern length")
+    parser.add_argument(
+        "--haystack-mb", type=float, default=64, help="Haystack size in MB"
+    )
+    parser.add_argument(
+        "--hit-density",
+        type=float_list,
+        default=[0.001, 0.1],
+        help="Comma-separated fractions of haystack bytes covered by hits",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int_list,
+        default=[1, os.cpu_count() or 1],
+        help="Comma-separated thread counts to match with",
+    )
+    parser.add_argument(
+        "--chunk-sizes",
+        type=int_list,
+        default=[4096, 65536],
+        help="Comma-separated OpenMP chunk sizes to match with",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement")
+    parser.add_argument("--seed", type=int, default=1234, help="Random seed")
+    parser.add_argument("--workdir", help="Directory for compiled dictionaries")
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "omg_version": get_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for count in args.patterns:
+            print(f"Benchmarking {count} patterns...", file=sys.stderr)
+            report["results"].extend(bench_dictionary(args, count, workdir))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
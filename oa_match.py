@@ -3,13 +3,31 @@
 # oa_match.py
 
 import argparse
+import base64
+import glob
 import io
+import json
 import os
+import struct
 import sys
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 
 import argcomplete
 
-from omg.omg import Compiler, Matcher
+from omg.compression import DECOMPRESSION_ERRORS, detect_compression
+from omg.omg import (
+    Compiler,
+    MappedHaystack,
+    Matcher,
+    ShardedMatcher,
+    is_shard_manifest,
+)
 
 # Force stdout to use Unix-style line endings explicitly on Windows
 if os.name == "nt":
@@ -25,15 +43,27 @@ def compile_mode(
     ignore_punctuation,
     elide_whitespace,
     verbose,
+    shards=0,
 ):
-    with Compiler(
-        output_file, case_insensitive, ignore_punctuation, elide_whitespace
-    ) as compiler, open(patterns_file, "rb") as f:
-        for line in f:
-            pattern = line.rstrip(b"\r\n")
-            if pattern:
-                compiler.add_pattern(pattern)
-        stats = compiler.get_stats()
+    if shards > 1:
+        stats = Compiler.compile_sharded(
+            patterns_file,
+            output_file,
+            shards,
+            case_insensitive,
+            ignore_punctuation,
+            elide_whitespace,
+        )
+    else:
+        # No per-line filtering is done here, so let the native compiler read
+        # and split the patterns file itself
+        stats = Compiler.compile_from_filename(
+            output_file,
+            patterns_file,
+            case_insensitive,
+            ignore_punctuation,
+            elide_whitespace,
+        )
 
     if verbose:
         print("Stored pattern count:", stats.stored_pattern_count, file=sys.stderr)
@@ -49,9 +79,206 @@ def compile_mode(
         print("Compile completed successfully", file=sys.stderr)
 
 
+OUTPUT_FORMATS = ("raw", "offsets", "tsv", "jsonl", "binary")
+# Errors reported per haystack; the other haystacks are still scanned
+SCAN_ERRORS = (OSError, RuntimeError, ValueError) + DECOMPRESSION_ERRORS
+# Size of the buffer hits are formatted into before being written to stdout
+OUTPUT_BUFFER_SIZE = 1 << 20
+# binary format: little-endian uint64 offset and uint32 length, followed by
+# the matched bytes
+BINARY_RECORD = struct.Struct("<QI")
+# Backslash first, so the escapes added after it are not escaped again
+TSV_ESCAPES = ((b"\\", b"\\\\"), (b"\t", b"\\t"), (b"\n", b"\\n"), (b"\r", b"\\r"))
+
+
+def open_output():
+    # Binary writer on the stdout file descriptor: no decode, no newline
+    # translation, and one write() per OUTPUT_BUFFER_SIZE bytes of output
+    sys.stdout.flush()
+    raw = io.FileIO(sys.stdout.fileno(), "wb", closefd=False)
+    return io.BufferedWriter(raw, buffer_size=OUTPUT_BUFFER_SIZE)
+
+
+# binary format with several files: each file's records are preceded by a
+# uint32 path length, the path, and the uint64 number of records
+BINARY_FILE_HEADER = struct.Struct("<I")
+BINARY_COUNT = struct.Struct("<Q")
+
+
+def tsv_escape(data):
+    for char, escape in TSV_ESCAPES:
+        data = data.replace(char, escape)
+    return data
+
+
+def json_bytes(record, key, data):
+    # Valid UTF-8 is stored as a string, anything else base64-encoded under
+    # <key>_base64
+    try:
+        record[key] = data.decode("utf-8")
+    except UnicodeDecodeError:
+        record[key + "_base64"] = base64.b64encode(data).decode("ascii")
+
+
+def iter_view_hits(view, offsets, lengths):
+    for off, length in zip(offsets, lengths):
+        yield off, length, view[off : off + length]
+
+
+def write_hits(out, output_format, hits, count, path=None):
+    # hits yields (offset, length, match) for count hits; path (bytes) tags
+    # every hit with the file it came from
+    write = out.write
+    if output_format == "raw":
+        prefix = b"" if path is None else path + b":"
+        for off, _, match in hits:
+            write(b"%b%d:%b\n" % (prefix, off, match))
+    elif output_format == "offsets":
+        prefix = b"" if path is None else tsv_escape(path) + b"\t"
+        for off, length, _ in hits:
+            write(b"%b%d\t%d\n" % (prefix, off, length))
+    elif output_format == "tsv":
+        prefix = b"" if path is None else tsv_escape(path) + b"\t"
+        for off, length, match in hits:
+            write(b"%b%d\t%d\t%b\n" % (prefix, off, length, tsv_escape(bytes(match))))
+    elif output_format == "jsonl":
+        tag = {} if path is None else {"path": os.fsdecode(path)}
+        for off, length, match in hits:
+            record = dict(tag, offset=off, length=length)
+            json_bytes(record, "match", bytes(match))
+            write(json.dumps(record).encode("utf-8") + b"\n")
+    elif output_format == "binary":
+        if path is not None:
+            write(BINARY_FILE_HEADER.pack(len(path)))
+            write(path)
+            write(BINARY_COUNT.pack(count))
+        pack = BINARY_RECORD.pack
+        for off, length, match in hits:
+            write(pack(off, length))
+            write(match)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+
+def write_record_hits(out, output_format, view, records, path=None):
+    # Hits located by 1-based line (record) and byte column
+    write = out.write
+    if output_format == "raw":
+        prefix = b"" if path is None else path + b":"
+        for r in records:
+            match = view[r.offset : r.offset + r.length]
+            write(b"%b%d:%d:%b\n" % (prefix, r.record + 1, r.column + 1, match))
+    elif output_format == "offsets":
+        prefix = b"" if path is None else tsv_escape(path) + b"\t"
+        for r in records:
+            write(b"%b%d\t%d\t%d\n" % (prefix, r.record + 1, r.column + 1, r.length))
+    elif output_format == "tsv":
+        prefix = b"" if path is None else tsv_escape(path) + b"\t"
+        for r in records:
+            match = tsv_escape(bytes(view[r.offset : r.offset + r.length]))
+            write(
+                b"%b%d\t%d\t%d\t%b\n"
+                % (prefix, r.record + 1, r.column + 1, r.length, match)
+            )
+    elif output_format == "jsonl":
+        tag = {} if path is None else {"path": os.fsdecode(path)}
+        for r in records:
+            record = dict(tag, line=r.record + 1, column=r.column + 1, length=r.length)
+            json_bytes(record, "match", bytes(view[r.offset : r.offset + r.length]))
+            write(json.dumps(record).encode("utf-8") + b"\n")
+    else:
+        raise ValueError(f"Unsupported output format for lines: {output_format}")
+
+
+def write_records(out, output_format, records, path=None):
+    # Matching records once each, with 1-based line numbers, like grep -n
+    write = out.write
+    if output_format == "raw":
+        prefix = b"" if path is None else path + b":"
+        for record, text in records:
+            write(b"%b%d:%b\n" % (prefix, record + 1, text))
+    elif output_format == "offsets":
+        prefix = b"" if path is None else tsv_escape(path) + b"\t"
+        for record, _ in records:
+            write(b"%b%d\n" % (prefix, record + 1))
+    elif output_format == "tsv":
+        prefix = b"" if path is None else tsv_escape(path) + b"\t"
+        for record, text in records:
+            write(b"%b%d\t%b\n" % (prefix, record + 1, tsv_escape(text)))
+    elif output_format == "jsonl":
+        tag = {} if path is None else {"path": os.fsdecode(path)}
+        for record, text in records:
+            entry = dict(tag, line=record + 1)
+            json_bytes(entry, "record", text)
+            write(json.dumps(entry).encode("utf-8") + b"\n")
+    else:
+        raise ValueError(f"Unsupported output format for records: {output_format}")
+
+
+def delimiter_arg(value):
+    # Accepts backslash escapes such as \n, \t or \x1e
+    try:
+        delimiter = value.encode("ascii").decode("unicode_escape").encode("latin-1")
+    except UnicodeError:
+        raise argparse.ArgumentTypeError(f"Invalid delimiter: {value!r}") from None
+    if not delimiter:
+        raise argparse.ArgumentTypeError("Delimiter must not be empty")
+    return delimiter
+
+
+def write_count(out, output_format, count, path=None):
+    # binary writes the file header (if any) and the count, but no records
+    if output_format == "binary":
+        if path is not None:
+            out.write(BINARY_FILE_HEADER.pack(len(path)))
+            out.write(path)
+        out.write(BINARY_COUNT.pack(count))
+    elif output_format == "jsonl":
+        record = {} if path is None else {"path": os.fsdecode(path)}
+        record["count"] = count
+        out.write(json.dumps(record).encode("utf-8") + b"\n")
+    elif output_format == "raw":
+        out.write(b"%d\n" % count if path is None else b"%b:%d\n" % (path, count))
+    else:
+        prefix = b"" if path is None else tsv_escape(path) + b"\t"
+        out.write(b"%b%d\n" % (prefix, count))
+
+
+def iter_haystack_paths(args):
+    # Expands directories (recursively, in sorted order), globs, and "-" (a
+    # list of paths on stdin, one per line); anything else is passed through
+    # so a missing file is reported when it is scanned
+    for arg in args:
+        if arg == "-":
+            for line in sys.stdin:
+                path = line.rstrip("\r\n")
+                if path:
+                    yield path
+        elif os.path.isdir(arg):
+            yield from iter_directory(arg)
+        elif not os.path.exists(arg) and any(c in arg for c in "*?["):
+            matches = sorted(glob.glob(arg, recursive=True))
+            for path in matches:
+                if os.path.isdir(path):
+                    yield from iter_directory(path)
+                else:
+                    yield path
+            if not matches:
+                yield arg
+        else:
+            yield arg
+
+
+def iter_directory(top):
+    for root, dirs, files in os.walk(top):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+
 def match_mode(
     compiled_file,
-    haystack_file,
+    haystack_files,
     case_insensitive,
     ignore_punctuation,
     elide_whitespace,
@@ -61,29 +288,179 @@ def match_mode(
     threads,
     chunk_size,
     verbose,
+    output_format="raw",
+    count_only=False,
+    jobs=0,
+    ordered=True,
+    with_filename=None,
+    lines=False,
+    records_only=False,
+    delimiter=b"\n",
+    drop_crossing=False,
+    decompress=False,
+    overlap=None,
 ):
-    with open(haystack_file, "rb") as f:
-        haystack = f.read()
-
-    with Matcher(
+    # Returns the exit status: 0, or 2 if some haystack could not be scanned
+    if isinstance(haystack_files, str):
+        haystack_files = [haystack_files]
+    if with_filename is None:
+        # Tag output with file names unless a single file is scanned; a pipe
+        # such as /dev/stdin or <(...) counts as a file
+        single = haystack_files[0] if len(haystack_files) == 1 else None
+        with_filename = (
+            single is None or os.path.isdir(single) or not os.path.exists(single)
+        )
+    jobs = jobs or os.cpu_count() or 1
+    matcher_type = ShardedMatcher if is_shard_manifest(compiled_file) else Matcher
+    with matcher_type(
         compiled_file, case_insensitive, ignore_punctuation, elide_whitespace
     ) as matcher:
         if threads:
             matcher.set_threads(threads)
+        elif jobs > 1 and with_filename:
+            # Files are already scanned in parallel; avoid oversubscription
+            matcher.set_threads(1)
         if chunk_size:
             matcher.set_chunk_size(chunk_size)
 
-        results = matcher.match(haystack, no_overlap, longest_only, word_boundary)
+        flags = (no_overlap, longest_only, word_boundary)
+
+        def scan(path):
+            # Sniffing a pipe would consume its head, so only regular files
+            # are checked for compression
+            if (
+                decompress
+                and os.path.isfile(path)
+                and detect_compression(path) is not None
+            ):
+                # Matched as it is decompressed; the hits carry their matches
+                if count_only:
+                    count = matcher.count_file(
+                        path, *flags, decompress=True, overlap=overlap
+                    )
+                    return None, count
+                hits = matcher.match_file(
+                    path, *flags, decompress=True, overlap=overlap
+                )
+                return None, hits
+            # The haystack is mapped instead of read onto the heap, and stays
+            # mapped until its hits are written
+            haystack = MappedHaystack(path)
+            try:
+                if records_only:
+                    records = matcher.matching_records(
+                        haystack, delimiter, drop_crossing, word_boundary
+                    )
+                    return haystack, len(records) if count_only else records
+                if lines:
+                    records = matcher.match_records(
+                        haystack, delimiter, drop_crossing, *flags
+                    )
+                    return haystack, len(records) if count_only else records
+                if count_only:
+                    return haystack, matcher.count(haystack, *flags)
+                # Columnar results, so no per-hit MatchResult objects are built
+                return haystack, matcher.match_arrays(haystack, *flags)
+            except BaseException:
+                haystack.close()
+                raise
+
+        status = 0
+
+        def emit(out, path, future):
+            nonlocal status
+            try:
+                haystack, result = future.result()
+            except SCAN_ERRORS as e:
+                out.flush()
+                print(f"{path}: {e}", file=sys.stderr)
+                status = 2
+                return
+            tag = os.fsencode(path) if with_filename else None
+            if haystack is None:
+                if count_only:
+                    write_count(out, output_format, result, tag)
+                else:
+                    hits = ((r.offset, r.length, r.match) for r in result)
+                    write_hits(out, output_format, hits, len(result), tag)
+                return
+            with haystack:
+                if count_only:
+                    write_count(out, output_format, result, tag)
+                elif records_only:
+                    write_records(out, output_format, result, tag)
+                elif lines:
+                    view = memoryview(haystack.buffer)
+                    write_record_hits(out, output_format, view, result, tag)
+                else:
+                    view = memoryview(haystack.buffer)
+                    hits = iter_view_hits(view, result.offsets, result.lengths)
+                    write_hits(out, output_format, hits, len(result), tag)
+
+        # Unix-style newlines on every platform
+        with open_output() as out, ThreadPoolExecutor(jobs) as pool:
+            # At most 2 * jobs files are mapped at once
+            pending = {}
+            order = deque()
+            for path in iter_haystack_paths(haystack_files):
+                future = pool.submit(scan, path)
+                pending[future] = path
+                if ordered:
+                    order.append(future)
+                while len(pending) >= 2 * jobs:
+                    if ordered:
+                        done = [order.popleft()]
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        emit(out, pending.pop(future), future)
+            remaining = order if ordered else as_completed(list(pending))
+            for future in remaining:
+                emit(out, pending.pop(future), future)
 
         if verbose:
             stats = matcher.get_match_stats()
             print("Match Stats:", stats, file=sys.stderr)
+    return status
 
-        for r in results:
-            # Always emit Unix-style newlines
-            sys.stdout.write(
-                f"{r.offset}:{r.match.decode('utf-8', errors='replace')}\n"
-            )
+
+def serve_mode(
+    compiled_file,
+    socket_path,
+    host,
+    port,
+    case_insensitive,
+    ignore_punctuation,
+    elide_whitespace,
+    threads,
+    chunk_size,
+    workers,
+    max_pending,
+    verbose,
+):
+    from omg.server import MatchServer
+
+    address = socket_path if socket_path else (host, port)
+    matcher_type = ShardedMatcher if is_shard_manifest(compiled_file) else Matcher
+    with matcher_type(
+        compiled_file, case_insensitive, ignore_punctuation, elide_whitespace
+    ) as matcher:
+        if threads:
+            matcher.set_threads(threads)
+        if chunk_size:
+            matcher.set_chunk_size(chunk_size)
+        with MatchServer(
+            matcher, address, workers or None, max_pending=max_pending
+        ) as server:
+            if verbose:
+                print(f"Serving on {server.server_address}", file=sys.stderr)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            if verbose:
+                stats = matcher.get_match_stats()
+                print("Match Stats:", stats, file=sys.stderr)
 
 
 def main():
@@ -111,11 +488,22 @@ def main():
     compile_parser.add_argument(
         "--elide-whitespace", action="store_true", help="Remove whitespace in patterns"
     )
+    compile_parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="Compile in parallel into this many shards (writes a shard manifest)",
+    )
 
     # Match mode parser
     match_parser = subparsers.add_parser("match", help="Match patterns")
     match_parser.add_argument("compiled", help="Input compiled file")
-    match_parser.add_argument("haystack", help="Input haystack file")
+    match_parser.add_argument(
+        "haystack",
+        nargs="+",
+        help="Input haystack files, directories (scanned recursively), glob "
+        "patterns, or - to read a list of paths from stdin",
+    )
     match_parser.add_argument(
         "--ignore-case", action="store_true", help="Ignore case during matching"
     )
@@ -144,6 +532,131 @@ def main():
     match_parser.add_argument(
         "--chunk-size", type=int, default=0, help="Chunk size for parallel processing"
     )
+    match_parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="raw",
+        help="Output format: raw (offset:match bytes, the default), offsets "
+        "(offset<TAB>length), tsv (offset, length and escaped match), jsonl, "
+        "or binary (uint64 offset, uint32 length, match bytes; little-endian)",
+    )
+    match_parser.add_argument(
+        "--count", action="store_true", help="Only print the number of matches"
+    )
+    match_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="Number of files to scan in parallel (default: CPU count); with "
+        "several files and no --threads, each scan is single-threaded",
+    )
+    match_parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="Write each file's matches as soon as it is scanned, instead of "
+        "in input order",
+    )
+    match_parser.add_argument(
+        "--lines",
+        action="store_true",
+        help="Report matches by 1-based line (record) number and column instead "
+        "of byte offset",
+    )
+    match_parser.add_argument(
+        "--records-only",
+        action="store_true",
+        help="Print each matching line (record) once with its line number, like "
+        "grep -n",
+    )
+    match_parser.add_argument(
+        "--delimiter",
+        type=delimiter_arg,
+        default=b"\n",
+        help="Record delimiter for --lines and --records-only; backslash "
+        "escapes are accepted (default: \\n)",
+    )
+    match_parser.add_argument(
+        "--drop-crossing",
+        action="store_true",
+        help="With --lines or --records-only, drop matches that span a delimiter",
+    )
+    match_parser.add_argument(
+        "-z",
+        "--decompress",
+        action="store_true",
+        help="Match gzip, bz2, xz and zstd (needs the zstandard package) files "
+        "as they are decompressed; offsets are in the decompressed data",
+    )
+    match_parser.add_argument(
+        "--overlap",
+        type=int,
+        help="With --decompress, bytes carried across decompressed blocks "
+        "(default: the longest pattern); required when the dictionary ignores "
+        "punctuation or elides whitespace, or its .ids sidecar is missing",
+    )
+    filename_group = match_parser.add_mutually_exclusive_group()
+    filename_group.add_argument(
+        "-H",
+        "--with-filename",
+        dest="with_filename",
+        action="store_const",
+        const=True,
+        help="Tag matches with the file name (default unless a single file is "
+        "given); binary output prefixes each file's records with a uint32 path "
+        "length, the path, and a uint64 record count",
+    )
+    filename_group.add_argument(
+        "--no-filename",
+        dest="with_filename",
+        action="store_const",
+        const=False,
+        help="Never tag matches with the file name",
+    )
+
+    # Serve mode parser
+    serve_parser = subparsers.add_parser(
+        "serve", help="Serve a resident matcher over a local socket"
+    )
+    serve_parser.add_argument("compiled", help="Input compiled file")
+    address_group = serve_parser.add_mutually_exclusive_group(required=True)
+    address_group.add_argument("--socket", help="Unix domain socket path")
+    address_group.add_argument("--port", type=int, help="TCP port")
+    serve_parser.add_argument(
+        "--host", default="127.0.0.1", help="TCP address to bind (default: 127.0.0.1)"
+    )
+    serve_parser.add_argument(
+        "--ignore-case", action="store_true", help="Ignore case during matching"
+    )
+    serve_parser.add_argument(
+        "--ignore-punctuation",
+        action="store_true",
+        help="Ignore punctuation during matching",
+    )
+    serve_parser.add_argument(
+        "--elide-whitespace",
+        action="store_true",
+        help="Remove whitespace during matching",
+    )
+    serve_parser.add_argument(
+        "--threads", type=int, default=0, help="Number of threads per scan"
+    )
+    serve_parser.add_argument(
+        "--chunk-size", type=int, default=0, help="Chunk size for parallel processing"
+    )
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of requests scanned at once (default: Python's thread pool "
+        "default)",
+    )
+    serve_parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=64,
+        help="Pipelined requests in flight per connection (default: 64)",
+    )
 
     argcomplete.autocomplete(parser)
 
@@ -158,6 +671,20 @@ def main():
                 sys.argv = [sys.argv[0], mode, "-h"]
 
     args = parser.parse_args()
+    if (
+        args.mode == "match"
+        and (args.lines or args.records_only)
+        and args.format == "binary"
+        and not args.count
+    ):
+        parser.error("--lines and --records-only do not support --format binary")
+    if args.mode == "match" and args.decompress and (args.lines or args.records_only):
+        parser.error("--decompress does not support --lines or --records-only")
+    if args.mode == "match" and args.overlap is not None:
+        if not args.decompress:
+            parser.error("--overlap requires --decompress")
+        if args.overlap <= 0:
+            parser.error("--overlap must be positive")
 
     if args.verbose:
         print(f"Running in {args.mode} mode with arguments: {args}")
@@ -170,9 +697,10 @@ def main():
             args.ignore_punctuation,
             args.elide_whitespace,
             args.verbose,
+            args.shards,
         )
     elif args.mode == "match":
-        match_mode(
+        status = match_mode(
             args.compiled,
             args.haystack,
             args.ignore_case,
@@ -184,6 +712,33 @@ def main():
             args.threads,
             args.chunk_size,
             args.verbose,
+            args.format,
+            args.count,
+            args.jobs,
+            not args.unordered,
+            args.with_filename,
+            args.lines,
+            args.records_only,
+            args.delimiter,
+            args.drop_crossing,
+            args.decompress,
+            args.overlap,
+        )
+        sys.exit(status)
+    elif args.mode == "serve":
+        serve_mode(
+            args.compiled,
+            args.socket,
+            args.host,
+            args.port,
+            args.ignore_case,
+            args.ignore_punctuation,
+            args.elide_whitespace,
+            args.threads,
+            args.chunk_size,
+            args.workers,
+            args.max_pending,
+            args.verbose,
         )
 
 
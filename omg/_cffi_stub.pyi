@@ -8,6 +8,7 @@ class CData:
 def string(value: Any) -> bytes: ...
 def new(ctype: str, *args: Any) -> Any: ...
 def buffer(cdata: Any, size: int) -> bytes: ...
+def from_buffer(cdecl: str, python_buffer: Any) -> Any: ...
 def dlopen(name: str) -> CData: ...
 
 NULL: Any
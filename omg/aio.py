@@ -0,0 +1,179 @@
+# aio.py
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, List, Optional, Sequence, TypeVar
+
+from .omg import (
+    HaystackType,
+    MatchArrays,
+    Matcher,
+    MatchResult,
+    StreamingMatcher,
+)
+
+T = TypeVar("T")
+
+
+class AsyncMatcher:
+    """asyncio front end for a ``Matcher``.
+
+    Scans run on a bounded thread pool (the native scan releases the GIL), so
+    the event loop keeps serving other tasks while a large document is being
+    matched. At most ``max_pending`` scans are queued or running at once;
+    further callers wait for a slot, which gives producers backpressure.
+    Results have the same shapes as the synchronous API.
+    """
+
+    def __init__(
+        self,
+        matcher: Matcher,
+        max_workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+    ) -> None:
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_pending is None:
+            max_pending = 2 * max_workers
+        if max_pending <= 0:
+            raise ValueError(f"Invalid max_pending: {max_pending}")
+        self._matcher = matcher
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="omg-aio")
+        self._max_pending = max_pending
+        # Created on first use so it belongs to the running loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    @property
+    def matcher(self) -> Matcher:
+        return self._matcher
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._max_pending)
+            self._loop = loop
+        async with self._semaphore:
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args)
+            )
+
+    async def match(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> List[MatchResult]:
+        return await self._run(
+            self._matcher.match,
+            haystack,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+        )
+
+    async def match_arrays(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> MatchArrays:
+        return await self._run(
+            self._matcher.match_arrays,
+            haystack,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+        )
+
+    async def match_many(
+        self,
+        docs: Sequence[HaystackType],
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> List[List[MatchResult]]:
+        return await self._run(
+            self._matcher.match_many,
+            docs,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+        )
+
+    async def match_file(
+        self,
+        path: str,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> List[MatchResult]:
+        return await self._run(
+            self._matcher.match_file,
+            path,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+        )
+
+    async def stream(
+        self,
+        reader: asyncio.StreamReader,
+        chunk_size: int = 1 << 20,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+        overlap: Optional[int] = None,
+    ) -> AsyncIterator[MatchResult]:
+        # Matches data read from the stream until EOF; see StreamingMatcher
+        streamer = StreamingMatcher(
+            self._matcher,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+            overlap=overlap,
+        )
+        while True:
+            chunk = await reader.read(chunk_size)
+            if not chunk:
+                break
+            for hit in await self._run(streamer.feed, chunk):
+                yield hit
+        for hit in await self._run(streamer.finish):
+            yield hit
+
+    async def aclose(self) -> None:
+        # Waits for running scans; the wrapped Matcher is left open
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self._executor.shutdown, wait=True)
+        )
@@ -0,0 +1,162 @@
+# cache.py
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+from .omg import Matcher
+
+# (realpath, case_insensitive, ignore_punctuation, elide_whitespace)
+_CacheKey = Tuple[str, bool, bool, bool]
+# (st_dev, st_ino, st_mtime_ns, st_size)
+_FileIdentity = Tuple[int, int, int, int]
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
+class _Entry:
+    # A cached matcher and the number of callers currently holding it
+    def __init__(self, identity: _FileIdentity, matcher: Matcher) -> None:
+        self.identity = identity
+        self.matcher = matcher
+        self.users = 0
+        self.retired = False
+
+
+class MatcherCache:
+    """Bounded LRU cache of loaded matchers.
+
+    Entries are keyed on the resolved path and the normalization flags, and
+    are only reused while the file's device, inode, mtime and size are
+    unchanged; a changed file is reloaded and the stale matcher evicted.
+    ``get()`` is a context manager that pins the matcher for the duration of
+    the ``with`` block; an evicted matcher is destroyed once the last caller
+    holding it has left its block, so it is never destroyed under a caller.
+    """
+
+    def __init__(self, maxsize: int = 8) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"Invalid cache size: {maxsize}")
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[_CacheKey, _Entry]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @contextmanager
+    def get(
+        self,
+        compiled_or_patterns_file: str,
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+    ) -> Iterator[Matcher]:
+        entry = self._acquire(
+            compiled_or_patterns_file,
+            case_insensitive,
+            ignore_punctuation,
+            elide_whitespace,
+        )
+        try:
+            yield entry.matcher
+        finally:
+            with self._lock:
+                entry.users -= 1
+                retire = entry.retired and entry.users == 0
+            if retire:
+                entry.matcher.destroy()
+
+    def _acquire(
+        self,
+        compiled_or_patterns_file: str,
+        case_insensitive: bool,
+        ignore_punctuation: bool,
+        elide_whitespace: bool,
+    ) -> _Entry:
+        path = os.path.realpath(compiled_or_patterns_file)
+        st = os.stat(path)
+        identity = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        key = (
+            path,
+            bool(case_insensitive),
+            bool(ignore_punctuation),
+            bool(elide_whitespace),
+        )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.identity == identity:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                entry.users += 1
+                return entry
+            self._misses += 1
+
+        # Load outside the lock so other lookups are not blocked
+        matcher = Matcher(path, case_insensitive, ignore_punctuation, elide_whitespace)
+        unused: List[Matcher] = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.identity == identity:
+                # Another thread loaded the same file meanwhile
+                unused.append(matcher)
+                self._entries.move_to_end(key)
+            else:
+                if entry is not None:
+                    unused.extend(self._retire(entry))
+                entry = self._entries[key] = _Entry(identity, matcher)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._maxsize:
+                    _, old = self._entries.popitem(last=False)
+                    unused.extend(self._retire(old))
+            entry.users += 1
+        for stale in unused:
+            stale.destroy()
+        return entry
+
+    def _retire(self, entry: _Entry) -> List[Matcher]:
+        # Called under the lock; returns the matcher if it can go right away
+        self._evictions += 1
+        entry.retired = True
+        return [entry.matcher] if entry.users == 0 else []
+
+    def get_stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                self._maxsize,
+            )
+
+    def clear(self) -> None:
+        # Matchers still held by callers are destroyed when released
+        unused: List[Matcher] = []
+        with self._lock:
+            for entry in self._entries.values():
+                entry.retired = True
+                if entry.users == 0:
+                    unused.append(entry.matcher)
+            self._entries.clear()
+        for matcher in unused:
+            matcher.destroy()
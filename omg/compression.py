@@ -0,0 +1,132 @@
+# compression.py
+
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+import zlib
+from typing import BinaryIO, Iterator, Optional, Tuple, Type
+
+# Magic numbers of the supported formats
+_MAGIC = (
+    ("gzip", b"\x1f\x8b"),
+    ("bz2", b"BZh"),
+    ("xz", b"\xfd7zXZ\x00"),
+    ("zstd", b"\x28\xb5\x2f\xfd"),
+)
+COMPRESSION_FORMATS = tuple(name for name, _ in _MAGIC)
+
+# Raised, besides OSError, while reading a truncated or corrupt compressed
+# file, or when the zstandard package is missing
+DECOMPRESSION_ERRORS: Tuple[Type[Exception], ...] = (
+    EOFError,
+    lzma.LZMAError,
+    zlib.error,
+    ImportError,
+)
+try:
+    from zstandard import ZstdError
+
+    DECOMPRESSION_ERRORS += (ZstdError,)
+except ImportError:
+    pass
+
+
+def detect_compression(path: str) -> Optional[str]:
+    # The compression format of the file, from its magic number, or None
+    with open(path, "rb") as f:
+        head = f.read(max(len(magic) for _, magic in _MAGIC))
+    for name, magic in _MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def open_decompressed(path: str, compression: Optional[str] = None) -> BinaryIO:
+    """Open a compressed file for reading its decompressed bytes.
+
+    The format is detected when ``compression`` is None; an uncompressed
+    file is opened as is. zstd needs the optional ``zstandard`` package.
+    """
+    if compression is None:
+        compression = detect_compression(path)
+    if compression is None:
+        return open(path, "rb")
+    if compression == "gzip":
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+    if compression == "bz2":
+        return bz2.open(path, "rb")  # type: ignore[return-value]
+    if compression == "xz":
+        return lzma.open(path, "rb")  # type: ignore[return-value]
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "zstd input requires the zstandard package "
+                "(pip install pyomgmatch[zstd])"
+            ) from None
+        return zstandard.open(path, "rb")
+    raise ValueError(f"Unknown compression format: {compression}")
+
+
+def iter_decompressed(
+    path: str,
+    chunk_size: int = 1 << 20,
+    max_pending: int = 4,
+    compression: Optional[str] = None,
+) -> Iterator[bytes]:
+    """Yield the decompressed contents of a file in chunks.
+
+    Decompression runs on a separate thread (zlib, bz2 and lzma release the
+    GIL), so it overlaps with whatever the consumer does with each chunk;
+    at most ``max_pending`` decompressed chunks are buffered between them.
+    Closing the iterator early stops the decompression thread.
+    """
+    if chunk_size <= 0:
+        raise ValueError(f"Invalid chunk size: {chunk_size}")
+    if max_pending <= 0:
+        raise ValueError(f"Invalid max_pending: {max_pending}")
+    f = open_decompressed(path, compression)
+    chunks: "queue.Queue[object]" = queue.Queue(max_pending)
+    stop = threading.Event()
+    done = object()
+
+    def put(item: object) -> bool:
+        # False once the consumer has gone away
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            with f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    if not put(chunk):
+                        return
+        except BaseException as e:
+            put(e)
+            return
+        put(done)
+
+    thread = threading.Thread(target=produce, name="omg-decompress", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item  # type: ignore[misc]
+    finally:
+        stop.set()
+        thread.join()
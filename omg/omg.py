@@ -1,12 +1,43 @@
 # omg.py
 
+import json
+import multiprocessing
+import os
 import platform
-from dataclasses import dataclass
+import stat
+import string
+import tempfile
+import threading
+import time
+import warnings
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import List, Literal, Optional
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
 
 from cffi import FFI
 
+from .compression import detect_compression, iter_decompressed
+
 ffi = FFI()
 ffi.cdef(
     """
@@ -175,6 +206,20 @@ const char *oa_matcher_version();
 # C library FFI handle
 C = None
 
+# array.array typecode matching the native size_t
+_SIZE_T_TYPECODE = "Q" if ffi.sizeof("size_t") == 8 else "I"
+
+# Bytes removed by ignore_punctuation / elide_whitespace (C locale)
+_PUNCTUATION = string.punctuation.encode("ascii")
+_WHITESPACE = b" \t\n\v\f\r"
+
+# "format" value of the manifest written by Compiler.compile_sharded()
+SHARD_MANIFEST_FORMAT = "omg-shards"
+
+# Anything exposing a contiguous buffer: bytes, bytearray, memoryview, mmap,
+# array.array, NumPy arrays, ...
+HaystackType = Union[bytes, bytearray, memoryview, Any]
+
 
 @dataclass
 class PatternStoreStats:
@@ -195,17 +240,86 @@ class MatchStats:
     total_attempts: int
     total_comparisons: int
 
+    def __add__(self, other: "MatchStats") -> "MatchStats":
+        return MatchStats(
+            **{
+                k: getattr(self, k) + getattr(other, k)
+                for k in MatchStats.__annotations__
+            }
+        )
+
 
 @dataclass
 class MatchResult:
     offset: int
     match: bytes
+    # Set when matching with with_ids=True
+    pattern_id: Optional[int] = None
 
     @property
     def length(self) -> int:
         return len(self.match)
 
 
+@dataclass
+class RecordMatch:
+    # 0-based record number, byte column within the record, hit length, and
+    # byte offset in the haystack
+    record: int
+    column: int
+    length: int
+    offset: int
+
+
+@dataclass
+class MatchArrays:
+    # Columnar match results: uint64 byte offsets and uint32 lengths. Both
+    # columns export the buffer protocol, so numpy.frombuffer() can view them
+    # without copying.
+    offsets: array
+    lengths: array
+    # uint32 pattern IDs, set when matching with with_ids=True
+    pattern_ids: Optional[array] = None
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+@dataclass
+class TuningResult:
+    threads: int
+    chunk_size: int
+    small_input_threshold: int
+    seconds: float
+
+
+# Suffix of the file Matcher.autotune(persist=True) writes next to the matcher
+TUNING_SUFFIX = ".tune.json"
+
+
+@dataclass
+class TaggedMatchResult:
+    offset: int
+    match: bytes
+    # Name of the MatcherSet dictionary that produced the hit
+    dictionary: str
+
+    @property
+    def length(self) -> int:
+        return len(self.match)
+
+
+# Suffix of the pattern ID and payload table written next to a compiled file
+PATTERN_IDS_SUFFIX = ".ids"
+PATTERN_IDS_FORMAT = "omg-ids"
+# Window size for scans that can stop early (contains, match with limit)
+_EARLY_EXIT_WINDOW = 1 << 20
+# Bound on the matched-bytes -> ID memo kept by each pattern table
+_PATTERN_MEMO_SIZE = 1 << 20
+# Bytes copied at a time to find line ends in a buffer without find()
+_LINE_BLOCK_SIZE = 1 << 20
+
+
 def _load_library() -> Optional[ffi.CData]:
     import os
     import sys
@@ -251,6 +365,335 @@ def _get_library() -> ffi.CData:
     return C
 
 
+def _as_haystack(haystack) -> Tuple[ffi.CData, int]:
+    # Wrap any contiguous buffer-protocol object without copying it
+    if isinstance(haystack, MappedHaystack):
+        return haystack._address(), len(haystack)
+    if isinstance(haystack, str):
+        raise TypeError("haystack must be a bytes-like object, not str")
+    try:
+        view = memoryview(haystack)
+    except TypeError:
+        raise TypeError("haystack must support the buffer protocol") from None
+    with view:
+        if not view.contiguous:
+            raise ValueError("haystack buffer must be contiguous")
+    buf = ffi.from_buffer("uint8_t[]", haystack)
+    return buf, len(buf)
+
+
+def _result_column(raw: memoryview, field: str, typecode: str) -> array:
+    # Pull one field out of the packed oa_match_result_t array in bulk
+    itemsize = array(typecode).itemsize
+    stride = ffi.sizeof("oa_match_result_t") // itemsize
+    start = ffi.offsetof("oa_match_result_t", field) // itemsize
+    column = array(typecode)
+    strided = raw.cast(typecode)[start::stride]  # type: ignore[call-overload]
+    column.frombytes(strided.tobytes())
+    return column
+
+
+def _result_arrays(res: ffi.CData) -> MatchArrays:
+    if res == ffi.NULL or res.count == 0:
+        return MatchArrays(array("Q"), array("I"))
+    raw = memoryview(ffi.buffer(res.matches, res.count * ffi.sizeof(res.matches[0])))
+    offsets = _result_column(raw, "offset", _SIZE_T_TYPECODE)
+    if offsets.typecode != "Q":
+        offsets = array("Q", offsets)
+    return MatchArrays(offsets, _result_column(raw, "len", "I"))
+
+
+def _resolve_overlaps(
+    hits: List[Tuple[int, int]], no_overlap: bool, longest_only: bool
+) -> List[Tuple[int, int]]:
+    # Apply longest_only / no_overlap (leftmost-longest) to offset-ordered
+    # (offset, length) hits
+    if not (no_overlap or longest_only) or not hits:
+        return hits
+    longest: List[Tuple[int, int]] = []
+    for off, length in hits:
+        if longest and longest[-1][0] == off:
+            if length > longest[-1][1]:
+                longest[-1] = (off, length)
+        else:
+            longest.append((off, length))
+    if not no_overlap:
+        return longest
+    selected: List[Tuple[int, int]] = []
+    end = 0
+    for off, length in longest:
+        if off >= end:
+            selected.append((off, length))
+            end = off + length
+    return selected
+
+
+class _RecordIndex:
+    # Record numbers and bounds of offsets in a delimited buffer, worked out
+    # only where they are asked for: delimiters are counted between
+    # consecutive offsets, a bounded block at a time, instead of indexing
+    # every record up front. Offsets must be located in increasing order.
+
+    def __init__(self, buf: ffi.CData, size: int, delimiter: bytes) -> None:
+        self._view = ffi.buffer(buf, size)
+        self._size = size
+        self._delimiter = delimiter
+        self._block_size = max(_LINE_BLOCK_SIZE, 2 * len(delimiter))
+        # Where the last occurrence ends is ambiguous for a delimiter that can
+        # overlap itself ("\n\n"), so its occurrences are walked instead
+        self._self_overlapping = any(
+            delimiter[:k] == delimiter[-k:] for k in range(1, len(delimiter))
+        )
+        self._ends: Dict[int, int] = {}
+        # Number and start offset of the record located last
+        self.record = 0
+        self.start = 0
+
+    def locate(self, off: int) -> None:
+        # Moves to the record containing off
+        view, delimiter, dlen = self._view, self._delimiter, len(self._delimiter)
+        pos = self.start
+        while pos < off:
+            stop = min(pos + self._block_size, off)
+            block = view[pos:stop]
+            count = block.count(delimiter)
+            if count:
+                self.record += count
+                if self._self_overlapping:
+                    end = 0
+                    for _ in range(count):
+                        end = block.find(delimiter, end) + dlen
+                else:
+                    end = block.rfind(delimiter) + dlen
+                self.start = pos + end
+            if stop >= off:
+                break
+            # An occurrence may straddle the block end
+            pos = max(self.start, stop - dlen + 1)
+
+    def end(self, start: int) -> int:
+        # Offset of the delimiter that ends the record starting at start, or
+        # the buffer size for the last record
+        end = self._ends.get(start)
+        if end is not None:
+            return end
+        view, delimiter, dlen = self._view, self._delimiter, len(self._delimiter)
+        end = self._size
+        pos = start
+        while pos < self._size:
+            stop = min(pos + self._block_size, self._size)
+            found = view[pos:stop].find(delimiter)
+            if found >= 0:
+                end = pos + found
+                break
+            if stop >= self._size:
+                break
+            pos = stop - dlen + 1
+        self._ends[start] = end
+        return end
+
+    def text(self, start: int) -> bytes:
+        # The record starting at start, without its delimiter
+        return self._view[start : self.end(start)]
+
+
+def _match_records(
+    matcher: "_MatchMixin",
+    haystack: HaystackType,
+    delimiter: bytes,
+    drop_crossing: bool,
+    no_overlap: bool,
+    longest_only: bool,
+    word_boundary: bool,
+    word_prefix: bool,
+    word_suffix: bool,
+) -> Tuple[List[Tuple[int, int, int, int]], _RecordIndex]:
+    # (record, record start, offset, length) for each hit, and the index
+    # they were located with
+    if not isinstance(delimiter, bytes) or not delimiter:
+        raise ValueError("Delimiter must be non-empty bytes")
+    buf, size = _as_haystack(haystack)
+    if drop_crossing:
+        # Resolved after dropping, so a crossing hit cannot shadow another
+        flags = (False, False, word_boundary, word_prefix, word_suffix)
+    else:
+        flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+    arrays = matcher._match_buffer_arrays(buf, size, *flags)
+    index = _RecordIndex(buf, size, delimiter)
+    located: List[Tuple[int, int, int, int]] = []
+    for off, length in zip(arrays.offsets, arrays.lengths):
+        index.locate(off)
+        if drop_crossing and off + length > index.end(index.start):
+            continue
+        located.append((index.record, index.start, off, length))
+
+    if drop_crossing and (no_overlap or longest_only):
+        kept = set(
+            _resolve_overlaps(
+                [(off, length) for _, _, off, length in located],
+                no_overlap,
+                longest_only,
+            )
+        )
+        located = [hit for hit in located if (hit[2], hit[3]) in kept]
+    return located, index
+
+
+def _matching_records(
+    located: List[Tuple[int, int, int, int]], index: _RecordIndex
+) -> List[Tuple[int, bytes]]:
+    # Each record with at least one hit, once, without its delimiter
+    out: List[Tuple[int, bytes]] = []
+    for record, start, _, _ in located:
+        if out and out[-1][0] == record:
+            continue
+        out.append((record, index.text(start)))
+    return out
+
+
+def _line_spans(data: Any, size: int) -> Iterator[Tuple[int, int]]:
+    # (start, end) of every non-empty line of a buffer, without the trailing
+    # carriage return. Objects with find() (bytes, bytearray, mmap) are
+    # searched in place; anything else is copied a block at a time.
+    searchable = hasattr(data, "find")
+    block_size = _LINE_BLOCK_SIZE
+    pos = 0
+    while pos < size:
+        if searchable:
+            block, base, limit = data, 0, size
+        else:
+            block, base = bytes(data[pos : pos + block_size]), pos
+            limit = pos + len(block)
+        start = pos - base
+        while True:
+            end = block.find(b"\n", start)
+            if end < 0 or base + end >= limit:
+                break
+            stop = end - 1 if end > start and block[end - 1] == 0x0D else end
+            if stop > start:
+                yield base + start, base + stop
+            start = end + 1
+        if limit >= size:
+            end = size - base
+            stop = end - 1 if end > start and block[end - 1] == 0x0D else end
+            if stop > start:
+                yield base + start, base + stop
+            return
+        if base + start == pos:
+            # No line end in the whole block
+            block_size *= 2
+        pos = base + start
+
+
+def _normalize_pattern(
+    pattern: bytes,
+    case_insensitive: bool,
+    ignore_punctuation: bool,
+    elide_whitespace: bool,
+) -> bytes:
+    # Python mirror of the normalization the native compiler applies
+    delete = (_PUNCTUATION if ignore_punctuation else b"") + (
+        _WHITESPACE if elide_whitespace else b""
+    )
+    if delete:
+        pattern = pattern.translate(None, delete)
+    if case_insensitive:
+        pattern = pattern.upper()
+    return pattern
+
+
+def _merge_pattern_store_stats(stats: List[PatternStoreStats]) -> PatternStoreStats:
+    populated = [s for s in stats if s.total_input_bytes]
+    return PatternStoreStats(
+        total_input_bytes=sum(s.total_input_bytes for s in stats),
+        total_stored_bytes=sum(s.total_stored_bytes for s in stats),
+        stored_pattern_count=sum(s.stored_pattern_count for s in stats),
+        short_pattern_count=sum(s.short_pattern_count for s in stats),
+        duplicate_patterns=sum(s.duplicate_patterns for s in stats),
+        smallest_pattern_length=min(
+            (s.smallest_pattern_length for s in populated), default=0
+        ),
+        largest_pattern_length=max(
+            (s.largest_pattern_length for s in populated), default=0
+        ),
+    )
+
+
+def _merge_hits(
+    columns: List[MatchArrays], no_overlap: bool, longest_only: bool
+) -> List[Tuple[int, int]]:
+    # Union of (offset, length) hits from several matchers, ordered by offset
+    # and then longest first
+    hits: Set[Tuple[int, int]] = set()
+    for arrays in columns:
+        hits.update(zip(arrays.offsets, arrays.lengths))
+    ordered = sorted(hits, key=lambda hit: (hit[0], -hit[1]))
+    return _resolve_overlaps(ordered, no_overlap, longest_only)
+
+
+def is_shard_manifest(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            head = f.read(64)
+    except OSError:
+        return False
+    return head.lstrip().startswith(b"{") and SHARD_MANIFEST_FORMAT.encode() in head
+
+
+def _compile_shard(job: Tuple[str, str, bool, bool, bool]) -> PatternStoreStats:
+    patterns_file, compiled_file, ci, ip, ew = job
+    return Compiler.compile_from_filename(compiled_file, patterns_file, ci, ip, ew)
+
+
+def _compressed_streamer(
+    matcher: "_MatchMixin",
+    path: str,
+    flags: Tuple[bool, bool, bool, bool, bool],
+    overlap: Optional[int],
+) -> "StreamingMatcher":
+    # Decompressed blocks are joined at the seams by a StreamingMatcher, so
+    # only a block and the carried-over overlap are held in memory at a time.
+    # Elided bytes can make a hit longer than any pattern, so such a
+    # dictionary needs an explicit overlap to find hits across a seam.
+    if overlap is None and matcher._may_elide():
+        raise ValueError(
+            f"{path}: the dictionary may ignore punctuation or elide whitespace, "
+            "so an overlap covering the longest hit is required"
+        )
+    return StreamingMatcher(matcher, *flags, overlap=overlap)
+
+
+def _match_compressed(
+    matcher: "_MatchMixin",
+    path: str,
+    compression: str,
+    flags: Tuple[bool, bool, bool, bool, bool],
+    overlap: Optional[int] = None,
+) -> List[MatchResult]:
+    # Decompression runs on its own thread while the previous block is being
+    # matched
+    streamer = _compressed_streamer(matcher, path, flags, overlap)
+    hits: List[MatchResult] = []
+    for chunk in iter_decompressed(path, compression=compression):
+        hits.extend(streamer.feed(chunk))
+    hits.extend(streamer.finish())
+    return hits
+
+
+def _count_compressed(
+    matcher: "_MatchMixin",
+    path: str,
+    compression: str,
+    flags: Tuple[bool, bool, bool, bool, bool],
+    overlap: Optional[int] = None,
+) -> int:
+    streamer = _compressed_streamer(matcher, path, flags, overlap)
+    count = 0
+    for chunk in iter_decompressed(path, compression=compression):
+        count += streamer.feed_count(chunk)
+    return count + streamer.finish_count()
+
+
 def get_version() -> str:
     version = _get_library().oa_matcher_version()
     if version == ffi.NULL:
@@ -258,6 +701,344 @@ def get_version() -> str:
     return ffi.string(version).decode("utf-8")
 
 
+class MatchResults(Sequence[MatchResult]):
+    """Lazy view over a native ``oa_match_results_t``.
+
+    ``MatchResult`` objects are only built for the entries that are accessed.
+    The native array (and the haystack it points into) is kept alive until
+    ``close()`` is called or the view is garbage-collected.
+    """
+
+    def __init__(
+        self, results: ffi.CData, buffer: ffi.CData, haystack: HaystackType
+    ) -> None:
+        self._results = results
+        self._count = 0 if results == ffi.NULL else int(results.count)
+        # Keep the memory the result pointers refer into alive
+        self._buffer = buffer
+        self._haystack = haystack
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @overload
+    def __getitem__(self, index: int) -> MatchResult: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[MatchResult]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("match result index out of range")
+        m = self._native()[index]
+        return MatchResult(offset=m.offset, match=bytes(ffi.buffer(m.match, m.len)))
+
+    def __iter__(self) -> Iterator[MatchResult]:
+        for i in range(self._count):
+            yield self[i]
+
+    @property
+    def closed(self) -> bool:
+        return self._results is None
+
+    def to_arrays(self) -> MatchArrays:
+        self._check()
+        return _result_arrays(self._results)
+
+    def _native(self) -> ffi.CData:
+        self._check()
+        return self._results.matches
+
+    def _check(self) -> None:
+        if self._results is None:
+            raise ValueError("MatchResults is closed")
+        if isinstance(self._haystack, MappedHaystack) and self._haystack.closed:
+            raise ValueError("MatchResults refers to a closed MappedHaystack")
+
+    def close(self) -> None:
+        results = getattr(self, "_results", None)
+        if results is not None:
+            if results != ffi.NULL and C is not None:
+                _get_library().oa_match_results_destroy(results)
+            self._results = None
+            self._buffer = None
+            self._haystack = None
+
+
+class MappedHaystack:
+    """A file mapped into memory by the native library, usable as a haystack.
+
+    Only regular files are mapped; pipes, FIFOs, character devices and the
+    like (``/dev/stdin``, ``<(...)``) report no useful size and are read into
+    memory instead. The mapping is released by ``close()`` (or on leaving the
+    ``with`` block); ``buffer`` must not be used afterwards.
+    """
+
+    def __init__(self, path: str, prefetch_sequential: bool = True) -> None:
+        self._mapped = False
+        self._closed = False
+        self._size = 0
+        self._data: Optional[bytes] = None
+        self.path = os.fspath(path)
+        st = os.stat(self.path)
+        if not stat.S_ISREG(st.st_mode):
+            with open(self.path, "rb") as f:
+                self._data = f.read()
+            self._addr = ffi.from_buffer("uint8_t[]", self._data)
+            self._size = len(self._data)
+            return
+        if st.st_size == 0:
+            # Nothing to map; behave like an empty haystack
+            self._addr = ffi.new("uint8_t[1]")
+            return
+        size = ffi.new("size_t*")
+        addr = _get_library().oa_matcher_map_filename(
+            self.path.encode("utf-8"), size, int(prefetch_sequential)
+        )
+        if addr == ffi.NULL:
+            raise RuntimeError(f"Failed to map file: {self.path}")
+        self._addr = addr
+        self._size = size[0]
+        self._mapped = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def buffer(self) -> ffi.CData:
+        return ffi.buffer(self._address(), self._size)
+
+    def _address(self) -> ffi.CData:
+        if self._closed:
+            raise ValueError("I/O operation on closed MappedHaystack")
+        return self._addr
+
+    def close(self) -> None:
+        if getattr(self, "_mapped", False) and C is not None:
+            _get_library().oa_matcher_unmap_file(self._addr, self._size)
+            self._mapped = False
+        self._data = None
+        self._closed = True
+
+
+class _PatternTable:
+    """Pattern IDs and payloads stored in the ``.ids`` sidecar of a matcher.
+
+    IDs are assigned in order of first appearance; a pattern the compiler
+    deduplicates keeps the ID of its first occurrence. The sidecar holds a
+    JSON header line followed by one ``<hex pattern>\\t<hex payload>`` line
+    per ID, with ``-`` marking a missing payload. The header records the
+    normalization the patterns were compiled with and the size and
+    modification time of the compiled file, so a sidecar left next to a
+    recompiled file is rejected (copy the pair with their timestamps).
+    Dictionaries compiled without pattern IDs get a sidecar with the header
+    only, since the native file does not report its normalization.
+    """
+
+    def __init__(self, flags: Tuple[bool, bool, bool]) -> None:
+        self.flags = flags
+        self.ids: Dict[bytes, int] = {}
+        self.patterns: List[bytes] = []
+        self.payloads: List[Optional[bytes]] = []
+        # Matched haystack bytes -> ID, so repeated surface forms skip the
+        # normalization
+        self._memo: Dict[bytes, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def add(self, pattern: bytes, payload: Optional[bytes] = None) -> int:
+        key = _normalize_pattern(pattern, *self.flags)
+        pattern_id = self.ids.get(key)
+        if pattern_id is None:
+            pattern_id = self.ids[key] = len(self.patterns)
+            self.patterns.append(pattern)
+            self.payloads.append(payload)
+        return pattern_id
+
+    def add_lines(self, data: bytes) -> None:
+        for line in data.split(b"\n"):
+            pattern = line.rstrip(b"\r")
+            if pattern:
+                self.add(pattern)
+
+    def lookup(self, match: bytes) -> int:
+        pattern_id = self._memo.get(match)
+        if pattern_id is None:
+            key = _normalize_pattern(match, *self.flags)
+            try:
+                pattern_id = self.ids[key]
+            except KeyError:
+                raise KeyError(f"Unknown pattern: {match!r}") from None
+            if len(self._memo) >= _PATTERN_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[match] = pattern_id
+        return pattern_id
+
+    def save(self, compiled_file: str, pattern_ids: bool = True) -> None:
+        header = {
+            "format": PATTERN_IDS_FORMAT,
+            "version": 1,
+            "pattern_ids": pattern_ids,
+            "count": len(self.patterns),
+            "case_insensitive": self.flags[0],
+            "ignore_punctuation": self.flags[1],
+            "elide_whitespace": self.flags[2],
+            **_compiled_identity(compiled_file),
+        }
+        tmp = compiled_file + PATTERN_IDS_SUFFIX + ".tmp"
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(json.dumps(header) + "\n")
+            for pattern, payload in zip(self.patterns, self.payloads):
+                f.write(pattern.hex())
+                f.write("\t")
+                f.write("-" if payload is None else payload.hex())
+                f.write("\n")
+        os.replace(tmp, compiled_file + PATTERN_IDS_SUFFIX)
+
+    @staticmethod
+    def read_header(compiled_file: str) -> Dict[str, Any]:
+        path = compiled_file + PATTERN_IDS_SUFFIX
+        with open(path, "r", encoding="ascii") as f:
+            header = json.loads(f.readline())
+        if header.get("format") != PATTERN_IDS_FORMAT:
+            raise ValueError(f"Not a pattern ID table: {path}")
+        identity = _compiled_identity(compiled_file)
+        if any(header.get(k) != v for k, v in identity.items()):
+            raise ValueError(f"{path} does not belong to {compiled_file}")
+        return header
+
+    @staticmethod
+    def header_flags(header: Dict[str, Any]) -> Tuple[bool, bool, bool]:
+        return (
+            bool(header["case_insensitive"]),
+            bool(header["ignore_punctuation"]),
+            bool(header["elide_whitespace"]),
+        )
+
+    @classmethod
+    def load(cls, compiled_file: str) -> "_PatternTable":
+        header = cls.read_header(compiled_file)
+        if not header.get("pattern_ids", True):
+            raise ValueError(
+                f"{compiled_file} has no pattern IDs; compile it with pattern_ids=True"
+            )
+        table = cls(cls.header_flags(header))
+        with open(compiled_file + PATTERN_IDS_SUFFIX, "r", encoding="ascii") as f:
+            f.readline()
+            for line in f:
+                pattern, payload = line.rstrip("\n").split("\t")
+                table.add(
+                    bytes.fromhex(pattern),
+                    None if payload == "-" else bytes.fromhex(payload),
+                )
+        if len(table) != header["count"]:
+            raise ValueError(f"Truncated pattern ID table: {compiled_file}")
+        return table
+
+
+def _compiled_identity(compiled_file: str) -> Dict[str, int]:
+    # Ties a sidecar to the compiled file it was written for, even if another
+    # tool rebuilds that file at the same size
+    st = os.stat(compiled_file)
+    return {"compiled_size": st.st_size, "compiled_mtime_ns": st.st_mtime_ns}
+
+
+def _write_normalization(
+    compiled_file: str,
+    case_insensitive: bool,
+    ignore_punctuation: bool,
+    elide_whitespace: bool,
+) -> None:
+    # A sidecar without pattern IDs, recording the normalization alone
+    flags = (bool(case_insensitive), bool(ignore_punctuation), bool(elide_whitespace))
+    _PatternTable(flags).save(os.fspath(compiled_file), pattern_ids=False)
+
+
+def _compiled_normalization(
+    compiled_file: str,
+) -> Optional[Tuple[bool, bool, bool]]:
+    # The native library applies the normalization stored in a compiled file
+    # (the constructor flags are ignored) but does not report it; the .ids
+    # sidecar written by every Compiler path records it
+    try:
+        return _PatternTable.header_flags(_PatternTable.read_header(compiled_file))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _remove_pattern_ids(compiled_file: str) -> None:
+    # The sidecar of a file about to be recompiled no longer describes it
+    try:
+        os.remove(os.fspath(compiled_file) + PATTERN_IDS_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def _read_tombstones(
+    tombstones: Union[str, Iterable[bytes], None],
+    flags: Tuple[bool, bool, bool],
+) -> Set[bytes]:
+    # Normalized deleted patterns, from a patterns file or an iterable
+    if tombstones is None:
+        return set()
+    if isinstance(tombstones, (str, os.PathLike)):
+        with open(tombstones, "rb") as f:
+            tombstones = f.read().split(b"\n")
+    deleted: Set[bytes] = set()
+    for pattern in tombstones:
+        pattern = bytes(pattern).rstrip(b"\r")
+        if pattern:
+            deleted.add(_normalize_pattern(pattern, *flags))
+    return deleted
+
+
+def _read_pattern_table(path: str, flags: Tuple[bool, bool, bool]) -> _PatternTable:
+    # Patterns of a compiled file come from its .ids sidecar; anything else
+    # is read as a patterns file
+    path = os.fspath(path)
+    if os.path.isfile(path + PATTERN_IDS_SUFFIX):
+        table = _PatternTable.load(path)
+        if table.flags != flags:
+            raise ValueError(f"Pattern IDs for {path} use different normalization")
+        return table
+    if _get_library().oa_matcher_is_compiled(path.encode("utf-8")):
+        raise ValueError(
+            f"{path} is compiled and has no {PATTERN_IDS_SUFFIX} sidecar; "
+            "compile it with pattern_ids=True"
+        )
+    table = _PatternTable(flags)
+    with open(path, "rb") as f:
+        table.add_lines(f.read())
+    return table
+
+
 class Compiler:
     def __init__(
         self,
@@ -265,9 +1046,20 @@ class Compiler:
         case_insensitive: bool = False,
         ignore_punctuation: bool = False,
         elide_whitespace: bool = False,
+        pattern_ids: bool = False,
     ) -> None:
         lib = _get_library()
         self._lib = lib
+        self._compiled_file = os.fspath(compiled_file)
+        _remove_pattern_ids(self._compiled_file)
+        self._flags = (
+            bool(case_insensitive),
+            bool(ignore_punctuation),
+            bool(elide_whitespace),
+        )
+        # The .ids sidecar is written when the compiler is destroyed; with
+        # pattern_ids it also holds the IDs and payloads
+        self._pattern_table = _PatternTable(self._flags) if pattern_ids else None
         self._compiler = lib.oa_matcher_compiler_create(
             compiled_file.encode("utf-8"),
             int(case_insensitive),
@@ -286,9 +1078,19 @@ class Compiler:
     def __del__(self):
         self.destroy()
 
-    def add_pattern(self, pattern: bytes) -> None:
+    def add_pattern(
+        self, pattern: bytes, payload: Optional[bytes] = None
+    ) -> Optional[int]:
+        # Returns the pattern ID when the compiler was created with
+        # pattern_ids=True, None otherwise
         if not isinstance(pattern, (bytes, bytearray)):
             raise TypeError("Pattern must be bytes")
+        if payload is not None and self._pattern_table is None:
+            raise ValueError("Payloads require pattern_ids=True")
+        raw = bytes(pattern)
+        if isinstance(pattern, bytearray):
+            # cffi only passes bytes objects directly as uint8_t *
+            pattern = ffi.from_buffer("uint8_t[]", pattern)
         if (
             self._lib.oa_matcher_compiler_add_pattern(
                 self._compiler, pattern, len(pattern)
@@ -296,6 +1098,53 @@ class Compiler:
             != 0
         ):
             raise ValueError("Failed to add pattern")
+        if self._pattern_table is None:
+            return None
+        return self._pattern_table.add(raw, None if payload is None else bytes(payload))
+
+    def add_patterns(self, patterns: Iterable[bytes]) -> int:
+        # Same as calling add_pattern() for each pattern, minus the per-call
+        # attribute lookups; returns the number of patterns added
+        add = self._lib.oa_matcher_compiler_add_pattern
+        compiler = self._compiler
+        table = self._pattern_table
+        count = 0
+        for pattern in patterns:
+            if not isinstance(pattern, bytes):
+                if not isinstance(pattern, bytearray):
+                    raise TypeError("Pattern must be bytes")
+                # cffi only passes bytes objects directly as uint8_t *
+                pattern = ffi.from_buffer("uint8_t[]", pattern)
+            if add(compiler, pattern, len(pattern)) != 0:
+                raise ValueError(f"Failed to add pattern: {pattern!r}")
+            if table is not None:
+                table.add(bytes(pattern))
+            count += 1
+        return count
+
+    def add_patterns_buffer(self, patterns_buf: HaystackType) -> int:
+        """Add newline-delimited patterns from a buffer.
+
+        Trailing carriage returns are stripped and empty lines skipped. The
+        patterns are passed to the native compiler as pointers into the
+        buffer, so no per-pattern Python objects are created, and the buffer
+        is never copied whole. Returns the number of patterns added.
+        """
+        buf, size = _as_haystack(patterns_buf)
+        # Sized explicitly: a mapped haystack is a bare pointer
+        view = ffi.buffer(buf, size)
+        data = patterns_buf if hasattr(patterns_buf, "find") else view
+        add = self._lib.oa_matcher_compiler_add_pattern
+        compiler = self._compiler
+        table = self._pattern_table
+        count = 0
+        for start, stop in _line_spans(data, size):
+            if add(compiler, buf + start, stop - start) != 0:
+                raise ValueError(f"Failed to add pattern: {view[start:stop]!r}")
+            if table is not None:
+                table.add(view[start:stop])
+            count += 1
+        return count
 
     def get_stats(self) -> PatternStoreStats:
         stats_ptr = self._lib.oa_matcher_compiler_get_pattern_store_stats(
@@ -311,6 +1160,11 @@ class Compiler:
         if hasattr(self, "_compiler") and self._compiler and C is not None:
             self._lib.oa_matcher_compiler_destroy(self._compiler)
             self._compiler = ffi.NULL
+            if self._pattern_table is not None:
+                self._pattern_table.save(self._compiled_file)
+                self._pattern_table = None
+            else:
+                _write_normalization(self._compiled_file, *self._flags)
 
     @staticmethod
     def compile_from_filename(
@@ -319,7 +1173,9 @@ class Compiler:
         case_insensitive: bool = False,
         ignore_punctuation: bool = False,
         elide_whitespace: bool = False,
+        pattern_ids: bool = False,
     ) -> PatternStoreStats:
+        _remove_pattern_ids(compiled_file)
         stats = ffi.new("oa_match_pattern_store_stats_t*")
         if (
             _get_library().oa_matcher_compile_patterns_filename(
@@ -333,6 +1189,19 @@ class Compiler:
             != 0
         ):
             raise RuntimeError("Compilation failed")
+        if pattern_ids:
+            with open(patterns_file, "rb") as f:
+                Compiler._write_pattern_ids(
+                    compiled_file,
+                    f.read(),
+                    case_insensitive,
+                    ignore_punctuation,
+                    elide_whitespace,
+                )
+        else:
+            _write_normalization(
+                compiled_file, case_insensitive, ignore_punctuation, elide_whitespace
+            )
         return PatternStoreStats(
             **{k: getattr(stats, k) for k in PatternStoreStats.__annotations__}
         )
@@ -344,7 +1213,9 @@ class Compiler:
         case_insensitive: bool = False,
         ignore_punctuation: bool = False,
         elide_whitespace: bool = False,
+        pattern_ids: bool = False,
     ) -> PatternStoreStats:
+        _remove_pattern_ids(compiled_file)
         stats = ffi.new("oa_match_pattern_store_stats_t*")
         if (
             _get_library().oa_matcher_compile_patterns(
@@ -359,12 +1230,325 @@ class Compiler:
             != 0
         ):
             raise RuntimeError("Compilation failed")
+        if pattern_ids:
+            Compiler._write_pattern_ids(
+                compiled_file,
+                patterns_buf,
+                case_insensitive,
+                ignore_punctuation,
+                elide_whitespace,
+            )
+        else:
+            _write_normalization(
+                compiled_file, case_insensitive, ignore_punctuation, elide_whitespace
+            )
         return PatternStoreStats(
             **{k: getattr(stats, k) for k in PatternStoreStats.__annotations__}
         )
 
+    @staticmethod
+    def _write_pattern_ids(
+        compiled_file: str,
+        patterns_buf: bytes,
+        case_insensitive: bool,
+        ignore_punctuation: bool,
+        elide_whitespace: bool,
+    ) -> None:
+        # IDs follow line order, as they would with add_pattern()
+        table = _PatternTable(
+            (bool(case_insensitive), bool(ignore_punctuation), bool(elide_whitespace))
+        )
+        table.add_lines(bytes(patterns_buf))
+        table.save(os.fspath(compiled_file))
+
+    @staticmethod
+    def compact(
+        base: str,
+        delta: Optional[str],
+        compiled_file: str,
+        tombstones: Union[str, Iterable[bytes], None] = None,
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+    ) -> PatternStoreStats:
+        """Fold a delta and tombstones into a new base dictionary.
+
+        ``base`` and ``delta`` are patterns files or compiled files with a
+        ``.ids`` sidecar, which holds the patterns the native file cannot
+        give back. The result equals what ``OverlayMatcher`` matches; it is
+        written with pattern IDs (base patterns first, then new delta
+        patterns) and delta payloads replace those of existing patterns.
+        """
+        flags = (
+            bool(case_insensitive),
+            bool(ignore_punctuation),
+            bool(elide_whitespace),
+        )
+        deleted = _read_tombstones(tombstones, flags)
+        entries: Dict[bytes, Tuple[bytes, Optional[bytes]]] = {}
+        for layer, path in enumerate((base, delta)):
+            if path is None:
+                continue
+            table = _read_pattern_table(path, flags)
+            for pattern, payload in zip(table.patterns, table.payloads):
+                key = _normalize_pattern(pattern, *flags)
+                if layer == 0 and key in deleted:
+                    continue
+                if key in entries and payload is None:
+                    continue
+                entries[key] = (entries.get(key, (pattern,))[0], payload)
+
+        with Compiler(compiled_file, *flags, pattern_ids=True) as compiler:
+            for pattern, payload in entries.values():
+                compiler.add_pattern(pattern, payload)
+            return compiler.get_stats()
+
+    @staticmethod
+    def compile_sharded(
+        patterns_file: str,
+        compiled_file: str,
+        shards: int,
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+        workers: Optional[int] = None,
+    ) -> PatternStoreStats:
+        """Compile a patterns file as ``shards`` parts in parallel.
+
+        Patterns are partitioned by a hash of their normalized form, so
+        duplicates always land in the same shard and the summed statistics
+        match a serial compile. Each shard is compiled by a worker process
+        to ``<compiled_file>.shard<N>``, and ``compiled_file`` itself becomes
+        a small JSON manifest that ``ShardedMatcher`` loads.
+        """
+        if shards <= 0:
+            raise ValueError(f"Invalid shard count: {shards}")
+        compiled_file = os.fspath(compiled_file)
+        out_dir = os.path.dirname(os.path.abspath(compiled_file))
+        names = [f"{os.path.basename(compiled_file)}.shard{i}" for i in range(shards)]
+        flags = (
+            bool(case_insensitive),
+            bool(ignore_punctuation),
+            bool(elide_whitespace),
+        )
+        with tempfile.TemporaryDirectory(dir=out_dir) as tmp:
+            inputs = [os.path.join(tmp, f"patterns{i}.txt") for i in range(shards)]
+            with ExitStack() as stack, open(patterns_file, "rb") as f:
+                outs = [stack.enter_context(open(path, "wb")) for path in inputs]
+                for line in f:
+                    pattern = line.rstrip(b"\r\n")
+                    if pattern:
+                        key = _normalize_pattern(pattern, *flags)
+                        out = outs[zlib.crc32(key) % shards]
+                        out.write(pattern)
+                        out.write(b"\n")
+            jobs = [
+                (path, os.path.join(out_dir, name), *flags)
+                for path, name in zip(inputs, names)
+            ]
+            if shards == 1 or workers == 1:
+                stats = [_compile_shard(job) for job in jobs]
+            else:
+                with multiprocessing.Pool(min(workers or shards, shards)) as pool:
+                    stats = pool.map(_compile_shard, jobs)
+
+        total = _merge_pattern_store_stats(stats)
+        manifest = {
+            "format": SHARD_MANIFEST_FORMAT,
+            "version": 1,
+            "shards": names,
+            "case_insensitive": flags[0],
+            "ignore_punctuation": flags[1],
+            "elide_whitespace": flags[2],
+            "stats": asdict(total),
+        }
+        with open(compiled_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return total
+
+
+class _MatchMixin(ABC):
+    # Record, file and compressed-file matching shared by Matcher and
+    # ShardedMatcher, built on the abstract methods below; implementations
+    # may take further keyword options (Matcher.match takes with_ids and
+    # limit), but must accept these arguments
+
+    @abstractmethod
+    def match(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> List[MatchResult]: ...
+
+    @abstractmethod
+    def match_arrays(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> MatchArrays: ...
+
+    @abstractmethod
+    def count(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> int: ...
+
+    @abstractmethod
+    def _match_buffer_arrays(
+        self, buf: ffi.CData, size: int, *flags: bool
+    ) -> MatchArrays: ...
+
+    @abstractmethod
+    def get_pattern_store_stats(self) -> PatternStoreStats: ...
+
+    @abstractmethod
+    def _may_elide(self) -> bool:
+        # Whether a hit can cover more haystack bytes than its pattern
+        ...
+
+    def match_records(
+        self,
+        haystack: HaystackType,
+        delimiter: bytes = b"\n",
+        drop_crossing: Literal[True, False] = False,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> List[RecordMatch]:
+        """Match a delimited haystack, locating hits by record and column.
+
+        Record numbers and columns are 0-based. With ``drop_crossing``, hits
+        that run into a delimiter are dropped before ``no_overlap`` and
+        ``longest_only`` are applied.
+        """
+        located, _ = _match_records(
+            self,
+            haystack,
+            delimiter,
+            drop_crossing,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+        )
+        return [
+            RecordMatch(record, off - start, length, off)
+            for record, start, off, length in located
+        ]
+
+    def matching_records(
+        self,
+        haystack: HaystackType,
+        delimiter: bytes = b"\n",
+        drop_crossing: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> List[Tuple[int, bytes]]:
+        # (record number, record without delimiter) for every record with a
+        # hit, once each, like grep
+        located, index = _match_records(
+            self,
+            haystack,
+            delimiter,
+            drop_crossing,
+            False,
+            True,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+        )
+        return _matching_records(located, index)
+
+    def match_file(
+        self,
+        path: str,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        prefetch_sequential: Literal[True, False] = True,
+        decompress: Literal[True, False] = False,
+        overlap: Optional[int] = None,
+    ) -> List[MatchResult]:
+        # With decompress, a gzip, bz2, xz or zstd file is matched as it is
+        # decompressed (see _match_compressed); offsets are positions in the
+        # decompressed data. ``overlap`` is carried across the decompressed
+        # blocks as in StreamingMatcher, and is required when the dictionary
+        # ignores punctuation or elides whitespace, or when its normalization
+        # is not known (a compiled file without its .ids sidecar).
+        if decompress:
+            compression = detect_compression(path)
+            if compression is not None:
+                return _match_compressed(
+                    self,
+                    path,
+                    compression,
+                    (no_overlap, longest_only, word_boundary, word_prefix, word_suffix),
+                    overlap,
+                )
+        with MappedHaystack(path, prefetch_sequential) as haystack:
+            return self.match(
+                haystack,
+                no_overlap,
+                longest_only,
+                word_boundary,
+                word_prefix,
+                word_suffix,
+            )
+
+    def count_file(
+        self,
+        path: str,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        prefetch_sequential: Literal[True, False] = True,
+        decompress: Literal[True, False] = False,
+        overlap: Optional[int] = None,
+    ) -> int:
+        # Number of hits match_file() would return, without building them
+        flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+        if decompress:
+            compression = detect_compression(path)
+            if compression is not None:
+                return _count_compressed(self, path, compression, flags, overlap)
+        with MappedHaystack(path, prefetch_sequential) as haystack:
+            return self.count(haystack, *flags)
+
+
+class Matcher(_MatchMixin):
+    """A loaded matcher; safe to share between threads.
+
+    The native scan only reads the matcher and runs with the GIL released
+    (cffi drops it around every C call), so concurrent ``match`` calls from
+    several threads proceed in parallel. ``destroy()`` waits for in-flight
+    calls to finish, and later calls raise ``RuntimeError``. The match
+    statistics are a single set of counters attached to the native handle;
+    under concurrent calls they may be approximate. Use
+    ``omg.parallel.ThreadPoolMatcher(shared=False)`` for exact per-thread
+    statistics.
+    """
 
-class Matcher:
     def __init__(
         self,
         compiled_or_patterns_file: str,
@@ -372,10 +1556,30 @@ class Matcher:
         ignore_punctuation: bool = False,
         elide_whitespace: bool = False,
     ) -> None:
+        # Tracks in-flight native calls so destroy() can wait for them
+        self._cond = threading.Condition()
+        self._active = 0
+        # Inputs smaller than this are matched single-threaded; while that is
+        # in effect _restore_threads holds the configured thread count
+        self._small_input_threshold = 0
+        self._restore_threads = 0
+        self._path = os.fspath(compiled_or_patterns_file)
+        if is_shard_manifest(self._path):
+            # Would otherwise be compiled as a patterns file of JSON lines
+            raise ValueError(
+                f"{self._path} is a shard manifest; load it with ShardedMatcher"
+            )
+        self._flags = (
+            bool(case_insensitive),
+            bool(ignore_punctuation),
+            bool(elide_whitespace),
+        )
+        # Loaded from the .ids sidecar on first use
+        self._pattern_table: Optional[_PatternTable] = None
         lib = _get_library()
         pat_stats = ffi.new("oa_match_pattern_store_stats_t*")
         m = lib.oa_matcher_create(
-            compiled_or_patterns_file.encode("utf-8"),
+            self._path.encode("utf-8"),
             int(case_insensitive),
             int(ignore_punctuation),
             int(elide_whitespace),
@@ -384,11 +1588,24 @@ class Matcher:
         if m == ffi.NULL:
             raise RuntimeError("Failed to create matcher")
         self._matcher = m
+        self._pattern_store_stats = PatternStoreStats(
+            **{k: getattr(pat_stats, k) for k in PatternStoreStats.__annotations__}
+        )
+        # Normalization the dictionary was built with, None if unknown: a
+        # patterns file is compiled with the constructor flags
+        self._normalization = (
+            _compiled_normalization(self._path)
+            if lib.oa_matcher_is_compiled(self._path.encode("utf-8"))
+            else self._flags
+        )
 
         self._match_stats = ffi.new("oa_match_stats_t*")
         if lib.oa_matcher_add_stats(self._matcher, self._match_stats) != 0:
             raise RuntimeError("Failed to attach stats to matcher")
 
+        if os.path.isfile(self._path + TUNING_SUFFIX):
+            self._load_tuning(self._path + TUNING_SUFFIX)
+
     def __enter__(self):
         return self
 
@@ -400,38 +1617,474 @@ class Matcher:
 
     def match(
         self,
-        haystack: bytes,
+        haystack: HaystackType,
         no_overlap: Literal[True, False] = False,
         longest_only: Literal[True, False] = False,
         word_boundary: Literal[True, False] = False,
         word_prefix: Literal[True, False] = False,
         word_suffix: Literal[True, False] = False,
+        with_ids: Literal[True, False] = False,
+        limit: Optional[int] = None,
     ) -> List[MatchResult]:
-        if not isinstance(haystack, (bytes, bytearray)):
-            raise TypeError("haystack must be bytes or bytearray")
-        lib = _get_library()
-        buf = ffi.new("uint8_t[]", haystack)
-        res = lib.oa_matcher_match(
-            self._matcher,
-            buf,
-            len(haystack),
-            int(no_overlap),
-            int(longest_only),
-            int(word_boundary),
-            int(word_prefix),
-            int(word_suffix),
+        # With limit, only the first limit hits are converted, and a large
+        # haystack is scanned in windows until enough hits are found
+        if limit is not None and limit < 0:
+            raise ValueError(f"Invalid limit: {limit}")
+        lookup = self._get_pattern_table().lookup if with_ids else None
+        flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+        windows = None if limit is None else self._early_exit_windows(haystack)
+        if windows is not None and limit is not None:
+            out: List[MatchResult] = []
+            streamer = StreamingMatcher(self, *flags)
+            for chunk in windows:
+                out.extend(streamer.feed(chunk))
+                if len(out) >= limit:
+                    break
+            else:
+                out.extend(streamer.finish())
+            del out[limit:]
+            if lookup is not None:
+                for hit in out:
+                    hit.pattern_id = lookup(hit.match)
+            return out
+
+        res, buf = self._match_native(haystack, *flags)
+        if res == ffi.NULL:
+            return []
+
+        out = []
+        try:
+            count = res.count if limit is None else min(res.count, limit)
+            for i in range(count):
+                m = res.matches[i]
+                match = bytes(ffi.buffer(m.match, m.len))
+                out.append(
+                    MatchResult(
+                        offset=m.offset,
+                        match=match,
+                        pattern_id=None if lookup is None else lookup(match),
+                    )
+                )
+        finally:
+            _get_library().oa_match_results_destroy(res)
+        return out
+
+    def count(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> int:
+        # Number of hits, without converting any of them
+        res, _ = self._match_native(
+            haystack, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
         )
         if res == ffi.NULL:
+            return 0
+        try:
+            return res.count
+        finally:
+            _get_library().oa_match_results_destroy(res)
+
+    def contains(
+        self,
+        haystack: HaystackType,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> bool:
+        # A large haystack is scanned in windows, stopping at the first hit
+        windows = self._early_exit_windows(haystack)
+        if windows is None:
+            return (
+                self.count(
+                    haystack, False, True, word_boundary, word_prefix, word_suffix
+                )
+                > 0
+            )
+        streamer = StreamingMatcher(
+            self, False, True, word_boundary, word_prefix, word_suffix
+        )
+        for chunk in windows:
+            if streamer.feed(chunk):
+                return True
+        return bool(streamer.finish())
+
+    def histogram(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        by_id: Literal[True, False] = False,
+    ) -> "Counter[Union[bytes, int]]":
+        # Hit counts per pattern; see HitCounter
+        counter = HitCounter(
+            self,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+            by_id=by_id,
+        )
+        counter.update(haystack)
+        return counter.counts()
+
+    def _surface_counts(self, haystack: HaystackType, *flags: bool) -> "Counter[bytes]":
+        # Hit counts keyed on the matched haystack bytes, built from the
+        # result columns without creating MatchResult objects; the key is
+        # still one short-lived bytes slice per hit
+        buf, size = _as_haystack(haystack)
+        arrays = self._match_buffer_arrays(buf, size, *flags)
+        # Sized explicitly: a mapped haystack is a bare pointer
+        view = ffi.buffer(buf, size)
+        return Counter(
+            view[off : off + length]
+            for off, length in zip(arrays.offsets, arrays.lengths)
+        )
+
+    def _early_exit_windows(self, haystack: HaystackType) -> Optional[Iterator[bytes]]:
+        # Windows of a haystack large enough to be worth scanning piecewise,
+        # or None to scan it whole. Elided punctuation or whitespace can make
+        # a hit longer than any pattern and hide it at a seam, so those
+        # matchers, and compiled files whose normalization is unknown, always
+        # scan whole.
+        normalization = self._normalization
+        if normalization is None or normalization[1] or normalization[2]:
+            return None
+        if self._pattern_store_stats.largest_pattern_length <= 0:
+            return None
+        buf, size = _as_haystack(haystack)
+        window = _EARLY_EXIT_WINDOW
+        if size <= 2 * window:
+            return None
+        view = ffi.buffer(buf, size)
+        return (view[pos : pos + window] for pos in range(0, size, window))
+
+    def match_arrays(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        with_ids: Literal[True, False] = False,
+    ) -> MatchArrays:
+        lookup = self._get_pattern_table().lookup if with_ids else None
+        res, _ = self._match_native(
+            haystack, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        try:
+            arrays = _result_arrays(res)
+            if lookup is not None:
+                arrays.pattern_ids = array(
+                    "I",
+                    (
+                        lookup(bytes(ffi.buffer(res.matches[i].match, length)))
+                        for i, length in enumerate(arrays.lengths)
+                    ),
+                )
+            return arrays
+        finally:
+            if res != ffi.NULL:
+                _get_library().oa_match_results_destroy(res)
+
+    def match_lazy(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> MatchResults:
+        res, buf = self._match_native(
+            haystack, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        return MatchResults(res, buf, haystack)
+
+    def match_many(
+        self,
+        docs: Sequence[HaystackType],
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> List[List[MatchResult]]:
+        """Match many documents with a single native call.
+
+        The documents are joined with newline separators and matched as one
+        haystack; hits are returned per document with document-relative
+        offsets, and hits spanning a document boundary are dropped.
+        """
+        if not docs:
             return []
+        joined = b"\n".join(docs)
+        # Resolved per document below so a hit spanning a boundary cannot
+        # shadow a hit inside a document
+        arrays = self.match_arrays(
+            joined, False, False, word_boundary, word_prefix, word_suffix
+        )
 
-        out: List[MatchResult] = []
-        for i in range(res.count):
-            m = res.matches[i]
-            out.append(
-                MatchResult(offset=m.offset, match=bytes(ffi.buffer(m.match, m.len)))
+        starts: List[int] = []
+        ends: List[int] = []
+        pos = 0
+        for doc in docs:
+            starts.append(pos)
+            pos += memoryview(doc).nbytes
+            ends.append(pos)
+            pos += 1
+
+        per_doc: List[List[Tuple[int, int]]] = [[] for _ in docs]
+        last = len(docs) - 1
+        i = 0
+        for off, length in zip(arrays.offsets, arrays.lengths):
+            while i < last and off >= ends[i]:
+                i += 1
+            if off < starts[i] or off + length > ends[i]:
+                continue
+            per_doc[i].append((off, length))
+
+        return [
+            [
+                MatchResult(offset=off - start, match=joined[off : off + length])
+                for off, length in _resolve_overlaps(hits, no_overlap, longest_only)
+            ]
+            for start, hits in zip(starts, per_doc)
+        ]
+
+    def _match_native(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool,
+        longest_only: bool,
+        word_boundary: bool,
+        word_prefix: bool,
+        word_suffix: bool,
+    ) -> Tuple[ffi.CData, ffi.CData]:
+        # Returns the native results together with the haystack buffer the
+        # result pointers refer into; the caller must keep the buffer alive
+        # while reading them and destroy the results.
+        buf, size = _as_haystack(haystack)
+        res = self._match_buffer(
+            buf, size, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        return res, buf
+
+    def _match_buffer(
+        self,
+        buf: ffi.CData,
+        size: int,
+        no_overlap: bool,
+        longest_only: bool,
+        word_boundary: bool,
+        word_prefix: bool,
+        word_suffix: bool,
+    ) -> ffi.CData:
+        # Match an already prepared haystack buffer, so several matchers can
+        # share one
+        with self._in_use(size < self._small_input_threshold) as matcher:
+            return _get_library().oa_matcher_match(
+                matcher,
+                buf,
+                size,
+                int(no_overlap),
+                int(longest_only),
+                int(word_boundary),
+                int(word_prefix),
+                int(word_suffix),
             )
-        lib.oa_match_results_destroy(res)
-        return out
+
+    def _match_buffer_arrays(
+        self, buf: ffi.CData, size: int, *flags: bool
+    ) -> MatchArrays:
+        res = self._match_buffer(buf, size, *flags)
+        try:
+            return _result_arrays(res)
+        finally:
+            if res != ffi.NULL:
+                _get_library().oa_match_results_destroy(res)
+
+    @contextmanager
+    def _in_use(self, single_threaded: bool = False) -> Iterator[ffi.CData]:
+        lib = _get_library()
+        with self._cond:
+            if not self._matcher:
+                raise RuntimeError("Matcher has been destroyed")
+            self._active += 1
+            # Only drop to one thread when no other call is in flight, so a
+            # concurrent large scan keeps its threads
+            downshift = single_threaded and self._active == 1
+            if downshift:
+                threads = lib.oa_matcher_get_num_threads(self._matcher)
+                downshift = threads > 1
+                if downshift:
+                    self._restore_threads = threads
+                    lib.oa_matcher_set_num_threads(self._matcher, 1)
+        try:
+            yield self._matcher
+        finally:
+            with self._cond:
+                if downshift:
+                    lib.oa_matcher_set_num_threads(self._matcher, self._restore_threads)
+                    self._restore_threads = 0
+                self._active -= 1
+                if self._active == 0:
+                    self._cond.notify_all()
+
+    def autotune(
+        self,
+        sample_haystack: HaystackType,
+        threads: Optional[Sequence[int]] = None,
+        chunk_sizes: Optional[Sequence[int]] = None,
+        repeat: int = 3,
+        persist: bool = False,
+    ) -> TuningResult:
+        """Pick the fastest thread count and chunk size for a sample haystack.
+
+        Every combination of ``threads`` (default: 1 and the powers of two up
+        to the CPU count) and ``chunk_sizes`` (default: powers of two from
+        1 KiB up to the sample size, at most 1 MiB) is timed, best of
+        ``repeat`` runs. The winner is applied to this matcher, and inputs too
+        small to give every thread a chunk are matched single-threaded from
+        then on. With ``persist`` the choice is saved next to the matcher file
+        and applied automatically when it is loaded again. Match statistics
+        are left as they were before tuning.
+        """
+        _, size = _as_haystack(sample_haystack)
+        if threads is None:
+            cpus = os.cpu_count() or 1
+            threads = sorted({1, cpus} | {1 << k for k in range(cpus.bit_length())})
+        if chunk_sizes is None:
+            chunk_sizes = [
+                1 << k for k in range(10, 21) if (1 << k) <= max(size, 1 << 10)
+            ]
+        if not threads or not chunk_sizes or repeat <= 0:
+            raise ValueError("Nothing to tune")
+
+        lib = _get_library()
+        saved_stats = self.get_match_stats()
+        saved_threshold = self._small_input_threshold
+        self._small_input_threshold = 0
+        best: Optional[TuningResult] = None
+        try:
+            for t in threads:
+                # The chunk size only matters with more than one thread
+                for chunk in chunk_sizes if t > 1 else chunk_sizes[:1]:
+                    self.set_threads(t)
+                    self.set_chunk_size(chunk)
+                    elapsed = float("inf")
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        res, _ = self._match_native(
+                            sample_haystack, False, False, False, False, False
+                        )
+                        elapsed = min(elapsed, time.perf_counter() - start)
+                        if res != ffi.NULL:
+                            lib.oa_match_results_destroy(res)
+                    if best is None or elapsed < best.seconds:
+                        best = TuningResult(
+                            self.get_threads(), self.get_chunk_size(), 0, elapsed
+                        )
+        finally:
+            self._small_input_threshold = saved_threshold
+            for k in MatchStats.__annotations__:
+                setattr(self._match_stats, k, getattr(saved_stats, k))
+
+        assert best is not None
+        if best.threads > 1:
+            best.small_input_threshold = best.threads * best.chunk_size
+        self.set_threads(best.threads)
+        self.set_chunk_size(best.chunk_size)
+        self._small_input_threshold = best.small_input_threshold
+        if persist:
+            with open(self._path + TUNING_SUFFIX, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "threads": best.threads,
+                        "chunk_size": best.chunk_size,
+                        "small_input_threshold": best.small_input_threshold,
+                    },
+                    f,
+                )
+        return best
+
+    def _load_tuning(self, path: str) -> None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                tuning = json.load(f)
+            threads = min(int(tuning["threads"]), os.cpu_count() or 1)
+            self.set_threads(threads)
+            self.set_chunk_size(int(tuning["chunk_size"]))
+            self.set_small_input_threshold(int(tuning["small_input_threshold"]))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            warnings.warn(f"Ignoring invalid tuning file {path}: {e}", RuntimeWarning)
+
+    def stream(
+        self,
+        chunks: Iterable[HaystackType],
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        overlap: Optional[int] = None,
+    ) -> Iterator[MatchResult]:
+        streamer = StreamingMatcher(
+            self,
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+            overlap=overlap,
+        )
+        for chunk in chunks:
+            yield from streamer.feed(chunk)
+        yield from streamer.finish()
+
+    def _fold_flags(self) -> Tuple[bool, bool, bool]:
+        # Normalization to fold matched text onto patterns with: the one the
+        # dictionary was built with when known, else the constructor flags
+        return self._normalization or self._flags
+
+    def _may_elide(self) -> bool:
+        normalization = self._normalization
+        return normalization is None or normalization[1] or normalization[2]
+
+    def _get_pattern_table(self) -> _PatternTable:
+        table = self._pattern_table
+        if table is None:
+            with self._cond:
+                if self._pattern_table is None:
+                    if not os.path.isfile(self._path + PATTERN_IDS_SUFFIX):
+                        raise ValueError(f"No pattern IDs for {self._path}")
+                    # Lookups normalize with the flags recorded at compile
+                    # time, which are the ones the compiled file uses
+                    self._pattern_table = _PatternTable.load(self._path)
+                table = self._pattern_table
+        return table
+
+    def pattern_id(self, match: bytes) -> int:
+        # ID of the pattern a matched slice of the haystack belongs to
+        return self._get_pattern_table().lookup(bytes(match))
+
+    def pattern(self, pattern_id: int) -> bytes:
+        return self._get_pattern_table().patterns[pattern_id]
+
+    def pattern_payload(self, pattern_id: int) -> Optional[bytes]:
+        return self._get_pattern_table().payloads[pattern_id]
+
+    def get_pattern_store_stats(self) -> PatternStoreStats:
+        return self._pattern_store_stats
 
     def get_match_stats(self) -> MatchStats:
         ms = self._match_stats
@@ -445,20 +2098,654 @@ class Matcher:
             setattr(ms, k, 0)
 
     def set_threads(self, threads: int) -> None:
-        if _get_library().oa_matcher_set_num_threads(self._matcher, threads) != 0:
-            raise ValueError(f"Invalid thread count: {threads}")
+        with self._in_use() as matcher, self._cond:
+            if _get_library().oa_matcher_set_num_threads(matcher, threads) != 0:
+                raise ValueError(f"Invalid thread count: {threads}")
+            if self._restore_threads:
+                # A small input is being matched single-threaded right now
+                self._restore_threads = _get_library().oa_matcher_get_num_threads(
+                    matcher
+                )
 
     def get_threads(self) -> int:
-        return _get_library().oa_matcher_get_num_threads(self._matcher)
+        with self._in_use() as matcher, self._cond:
+            if self._restore_threads:
+                return self._restore_threads
+            return _get_library().oa_matcher_get_num_threads(matcher)
 
     def set_chunk_size(self, chunk: int) -> None:
-        if _get_library().oa_matcher_set_chunk_size(self._matcher, chunk) != 0:
-            raise ValueError(f"Invalid chunk size: {chunk}")
+        with self._in_use() as matcher:
+            if _get_library().oa_matcher_set_chunk_size(matcher, chunk) != 0:
+                raise ValueError(f"Invalid chunk size: {chunk}")
 
     def get_chunk_size(self) -> int:
-        return _get_library().oa_matcher_get_chunk_size(self._matcher)
+        with self._in_use() as matcher:
+            return _get_library().oa_matcher_get_chunk_size(matcher)
+
+    def set_small_input_threshold(self, size: int) -> None:
+        if size < 0:
+            raise ValueError(f"Invalid small input threshold: {size}")
+        self._small_input_threshold = size
+
+    def get_small_input_threshold(self) -> int:
+        return self._small_input_threshold
+
+    def destroy(self) -> None:
+        if not hasattr(self, "_matcher") or not hasattr(self, "_cond"):
+            return
+        with self._cond:
+            self._cond.wait_for(lambda: self._active == 0)
+            if self._matcher and C is not None:
+                _get_library().oa_matcher_destroy(self._matcher)
+                self._matcher = ffi.NULL
+
+
+class StreamingMatcher:
+    """Match an unbounded haystack that arrives in chunks.
+
+    Hits are reported with offsets relative to the start of the stream. The
+    last ``overlap`` bytes of every window (by default the largest pattern
+    length) are carried into the next one, along with one byte of context for
+    the word-boundary checks, so a hit spanning a chunk seam is reported
+    exactly once. With ``ignore_punctuation`` or ``elide_whitespace`` a hit can
+    cover more haystack bytes than the longest pattern; pass a larger
+    ``overlap`` to cover the longest run of elided bytes expected inside a hit.
+
+    ``no_overlap`` is resolved here rather than natively, as a leftmost-longest
+    selection over the whole stream, so that it is not reset at each seam.
+    """
+
+    def __init__(
+        self,
+        matcher: _MatchMixin,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        overlap: Optional[int] = None,
+    ) -> None:
+        if overlap is None:
+            overlap = matcher.get_pattern_store_stats().largest_pattern_length
+            if overlap <= 0:
+                raise ValueError(
+                    "overlap is required when the largest pattern length is unknown"
+                )
+        elif overlap <= 0:
+            raise ValueError(f"Invalid overlap: {overlap}")
+        self._matcher = matcher
+        self._no_overlap = bool(no_overlap)
+        self._flags = (
+            False,
+            bool(longest_only or no_overlap),
+            bool(word_boundary),
+            bool(word_prefix),
+            bool(word_suffix),
+        )
+        self._overlap = overlap
+        self._window = b""
+        # Stream offset of the first window byte
+        self._base = 0
+        # Window offset of the first position not yet reported on
+        self._start = 0
+        # Stream offset where the last reported hit ends (for no_overlap)
+        self._last_end = 0
+        self._finished = False
+
+    @property
+    def overlap(self) -> int:
+        return self._overlap
+
+    @property
+    def position(self) -> int:
+        # Total number of bytes fed so far
+        return self._base + len(self._window)
+
+    def feed(self, chunk: HaystackType) -> List[MatchResult]:
+        cut = self._push(chunk)
+        return [] if cut is None else self._results(cut)
+
+    def finish(self) -> List[MatchResult]:
+        cut = self._end()
+        return [] if cut is None else self._results(cut)
+
+    def feed_count(self, chunk: HaystackType) -> int:
+        # Like feed(), returning the number of hits instead of the hits
+        cut = self._push(chunk)
+        return 0 if cut is None else len(self._scan(cut)[1])
+
+    def finish_count(self) -> int:
+        cut = self._end()
+        return 0 if cut is None else len(self._scan(cut)[1])
+
+    def _push(self, chunk: HaystackType) -> Optional[int]:
+        # Buffers a chunk; returns where to cut the window if it is due for
+        # a scan
+        if self._finished:
+            raise ValueError("feed() called after finish()")
+        self._window = b"".join((self._window, chunk))
+        # Only scan once enough new data is buffered to amortize rescanning
+        # the carried-over tail
+        if len(self._window) - self._start <= 2 * self._overlap:
+            return None
+        return len(self._window) - self._overlap
+
+    def _end(self) -> Optional[int]:
+        if self._finished:
+            return None
+        self._finished = True
+        return len(self._window)
+
+    def _results(self, cut: int) -> List[MatchResult]:
+        base = self._base
+        window, hits = self._scan(cut)
+        return [
+            MatchResult(offset=base + off, match=window[off : off + length])
+            for off, length in hits
+        ]
+
+    def _scan(self, cut: int) -> Tuple[bytes, List[Tuple[int, int]]]:
+        # The scanned window and the (window offset, length) of the hits it
+        # reports; the window is then advanced past cut
+        window = self._window
+        arrays = self._matcher.match_arrays(window, *self._flags)
+        hits: List[Tuple[int, int]] = []
+        for off, length in zip(arrays.offsets, arrays.lengths):
+            # Hits before _start were reported by the previous window, hits at
+            # or after cut may not be complete yet
+            if off < self._start or off >= cut:
+                continue
+            if self._no_overlap:
+                pos = self._base + off
+                if pos < self._last_end:
+                    continue
+                self._last_end = pos + length
+            hits.append((off, length))
+
+        keep = max(cut - 1, 0)
+        self._window = b"" if self._finished else window[keep:]
+        self._base += keep
+        self._start = cut - keep
+        return window, hits
+
+
+class HitCounter:
+    """Per-pattern hit counts accumulated over many haystacks.
+
+    Counts are kept per distinct matched surface form, so memory grows with
+    the number of distinct hits rather than the total, and are folded onto
+    the normalized pattern (or its pattern ID with ``by_id``) when read.
+    Folding uses the normalization the dictionary was compiled with when it
+    is known (a patterns file, or a ``.ids`` sidecar), else the flags the
+    matcher was created with. No ``MatchResult`` objects are built, but each
+    hit is still keyed by a bytes slice of the haystack while it is tallied.
+    """
+
+    def __init__(
+        self,
+        matcher: Matcher,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        by_id: Literal[True, False] = False,
+    ) -> None:
+        self._matcher = matcher
+        self._flags = (
+            no_overlap,
+            longest_only,
+            word_boundary,
+            word_prefix,
+            word_suffix,
+        )
+        # Fails early if the matcher has no pattern IDs
+        self._lookup = matcher._get_pattern_table().lookup if by_id else None
+        self._surface: "Counter[bytes]" = Counter()
+        self._folded: Optional["Counter[Union[bytes, int]]"] = None
+        self._total = 0
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def update(self, haystack: HaystackType) -> int:
+        # Returns the number of hits added
+        counts = self._matcher._surface_counts(haystack, *self._flags)
+        added = sum(counts.values())
+        self._surface.update(counts)
+        self._total += added
+        self._folded = None
+        return added
+
+    def counts(self) -> "Counter[Union[bytes, int]]":
+        if self._folded is None:
+            folded: "Counter[Union[bytes, int]]" = Counter()
+            flags = self._matcher._fold_flags()
+            for surface, count in self._surface.items():
+                key = (
+                    self._lookup(surface)
+                    if self._lookup is not None
+                    else _normalize_pattern(surface, *flags)
+                )
+                folded[key] += count
+            self._folded = folded
+        return Counter(self._folded)
+
+    def most_common(
+        self, n: Optional[int] = None
+    ) -> List[Tuple[Union[bytes, int], int]]:
+        return self.counts().most_common(n)
+
+    def clear(self) -> None:
+        self._surface.clear()
+        self._folded = None
+        self._total = 0
+
+
+class ShardedMatcher(_MatchMixin):
+    """Matcher over the shards written by ``Compiler.compile_sharded()``.
+
+    Every shard scans the same haystack buffer; hits are merged, ordered by
+    offset (longest first), and ``no_overlap`` / ``longest_only`` are applied
+    to the merged hits so the results equal those of a serial compile.
+    """
+
+    def __init__(
+        self,
+        manifest_file: str,
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+    ) -> None:
+        manifest_file = os.fspath(manifest_file)
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != SHARD_MANIFEST_FORMAT:
+            raise ValueError(f"Not a shard manifest: {manifest_file}")
+        base = os.path.dirname(os.path.abspath(manifest_file))
+        self._matchers: List[Union[Matcher, ShardedMatcher]] = []
+        try:
+            for name in manifest["shards"]:
+                shard = Matcher(
+                    os.path.join(base, name),
+                    case_insensitive,
+                    ignore_punctuation,
+                    elide_whitespace,
+                )
+                self._matchers.append(shard)
+                if "case_insensitive" in manifest:
+                    # Every shard was compiled with the manifest's normalization
+                    shard._normalization = _PatternTable.header_flags(manifest)
+        except BaseException:
+            self.destroy()
+            raise
+        self._pattern_store_stats = PatternStoreStats(**manifest["stats"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.destroy()
+
+    def __del__(self):
+        self.destroy()
+
+    def _match_hits(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool,
+        longest_only: bool,
+        word_boundary: bool,
+        word_prefix: bool,
+        word_suffix: bool,
+    ) -> Tuple[List[Tuple[int, int]], ffi.CData, int]:
+        buf, size = _as_haystack(haystack)
+        hits = self._match_buffer_hits(
+            buf, size, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        return hits, buf, size
+
+    def _match_buffer_hits(
+        self,
+        buf: ffi.CData,
+        size: int,
+        no_overlap: bool,
+        longest_only: bool,
+        word_boundary: bool,
+        word_prefix: bool,
+        word_suffix: bool,
+    ) -> List[Tuple[int, int]]:
+        flags = (False, False, word_boundary, word_prefix, word_suffix)
+        columns = [m._match_buffer_arrays(buf, size, *flags) for m in self._matchers]
+        return _merge_hits(columns, no_overlap, longest_only)
+
+    def _match_buffer_arrays(
+        self, buf: ffi.CData, size: int, *flags: bool
+    ) -> MatchArrays:
+        hits = self._match_buffer_hits(buf, size, *flags)
+        return MatchArrays(
+            array("Q", (off for off, _ in hits)),
+            array("I", (length for _, length in hits)),
+        )
+
+    def match(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> List[MatchResult]:
+        hits, buf, size = self._match_hits(
+            haystack, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        view = ffi.buffer(buf, size)
+        return [MatchResult(off, view[off : off + length]) for off, length in hits]
+
+    def match_arrays(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> MatchArrays:
+        buf, size = _as_haystack(haystack)
+        return self._match_buffer_arrays(
+            buf, size, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+
+    def count(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> int:
+        hits, _, _ = self._match_hits(
+            haystack, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        return len(hits)
+
+    def get_pattern_store_stats(self) -> PatternStoreStats:
+        return self._pattern_store_stats
+
+    def get_match_stats(self) -> MatchStats:
+        total = MatchStats(0, 0, 0, 0, 0)
+        for matcher in self._matchers:
+            total = total + matcher.get_match_stats()
+        return total
+
+    def reset_match_stats(self) -> None:
+        for matcher in self._matchers:
+            matcher.reset_match_stats()
+
+    def set_threads(self, threads: int) -> None:
+        for matcher in self._matchers:
+            matcher.set_threads(threads)
+
+    def set_chunk_size(self, chunk: int) -> None:
+        for matcher in self._matchers:
+            matcher.set_chunk_size(chunk)
+
+    def _may_elide(self) -> bool:
+        return any(matcher._may_elide() for matcher in self._matchers)
+
+    def destroy(self) -> None:
+        for matcher in getattr(self, "_matchers", []):
+            matcher.destroy()
+        self._matchers = []
+
+
+class OverlayMatcher(ShardedMatcher):
+    """A base dictionary with a small delta and deletions layered on top.
+
+    The ``delta`` (compiled or patterns file) is matched alongside ``base``,
+    and base hits whose normalized text is in ``tombstones`` (a patterns file
+    or an iterable of patterns) are dropped, so an update costs a compile of
+    the change only. Tombstones are normalized the way ``base`` was compiled
+    when that is known (a patterns file, or a ``.ids`` sidecar), else with
+    the flags given here. Overlap options are applied after the layers are
+    merged. ``Compiler.compact()`` folds the layers into a new base offline.
+    """
+
+    def __init__(
+        self,
+        base: str,
+        delta: Optional[str] = None,
+        tombstones: Union[str, Iterable[bytes], None] = None,
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+    ) -> None:
+        # Matched base text -> deleted, so repeated surface forms skip the
+        # normalization
+        self._deleted_memo: Dict[bytes, bool] = {}
+        self._matchers = []
+        try:
+            for path in (base, delta):
+                if path is None:
+                    continue
+                path = os.fspath(path)
+                matcher_type = ShardedMatcher if is_shard_manifest(path) else Matcher
+                self._matchers.append(
+                    matcher_type(
+                        path, case_insensitive, ignore_punctuation, elide_whitespace
+                    )
+                )
+        except BaseException:
+            self.destroy()
+            raise
+        base_matcher = self._matchers[0]
+        self._flags = (
+            base_matcher._fold_flags()
+            if isinstance(base_matcher, Matcher)
+            else (
+                bool(case_insensitive),
+                bool(ignore_punctuation),
+                bool(elide_whitespace),
+            )
+        )
+        self._tombstones = _read_tombstones(tombstones, self._flags)
+        self._pattern_store_stats = _merge_pattern_store_stats(
+            [m.get_pattern_store_stats() for m in self._matchers]
+        )
+
+    def _is_deleted(self, match: bytes) -> bool:
+        deleted = self._deleted_memo.get(match)
+        if deleted is None:
+            deleted = _normalize_pattern(match, *self._flags) in self._tombstones
+            if len(self._deleted_memo) >= _PATTERN_MEMO_SIZE:
+                self._deleted_memo.clear()
+            self._deleted_memo[match] = deleted
+        return deleted
+
+    def _match_buffer_hits(
+        self,
+        buf: ffi.CData,
+        size: int,
+        no_overlap: bool,
+        longest_only: bool,
+        word_boundary: bool,
+        word_prefix: bool,
+        word_suffix: bool,
+    ) -> List[Tuple[int, int]]:
+        flags = (False, False, word_boundary, word_prefix, word_suffix)
+        columns = [m._match_buffer_arrays(buf, size, *flags) for m in self._matchers]
+        if self._tombstones and columns:
+            # Deletions only apply to the base layer
+            base = columns[0]
+            view = ffi.buffer(buf, size)
+            kept = [
+                (off, length)
+                for off, length in zip(base.offsets, base.lengths)
+                if not self._is_deleted(view[off : off + length])
+            ]
+            columns[0] = MatchArrays(
+                array("Q", (off for off, _ in kept)),
+                array("I", (length for _, length in kept)),
+            )
+        return _merge_hits(columns, no_overlap, longest_only)
+
+
+class MatcherSet:
+    """Several independent dictionaries matched over the same haystack.
+
+    ``dictionaries`` maps a name to a compiled file, a patterns file or a
+    shard manifest; a plain sequence of paths is named after the file stems.
+    The haystack buffer is prepared once (one mapping for files) and handed
+    to every dictionary, and each hit is tagged with the dictionary name.
+    With ``workers`` > 1 the dictionaries are scanned concurrently on a
+    thread pool, since the native scans release the GIL.
+    """
+
+    def __init__(
+        self,
+        dictionaries: Union[Mapping[str, str], Sequence[str]],
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+        workers: int = 1,
+    ) -> None:
+        if isinstance(dictionaries, Mapping):
+            named = [(name, os.fspath(path)) for name, path in dictionaries.items()]
+        else:
+            named = [(Path(path).stem, os.fspath(path)) for path in dictionaries]
+        if len({name for name, _ in named}) != len(named):
+            raise ValueError("Dictionary names must be unique")
+        self._matchers: Dict[str, Union[Matcher, ShardedMatcher]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        try:
+            for name, path in named:
+                matcher_type = ShardedMatcher if is_shard_manifest(path) else Matcher
+                self._matchers[name] = matcher_type(
+                    path, case_insensitive, ignore_punctuation, elide_whitespace
+                )
+        except BaseException:
+            self.destroy()
+            raise
+        if workers > 1 and len(self._matchers) > 1:
+            self._executor = ThreadPoolExecutor(
+                min(workers, len(self._matchers)), thread_name_prefix="omg-set"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.destroy()
+
+    def __del__(self):
+        self.destroy()
+
+    def __len__(self) -> int:
+        return len(self._matchers)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._matchers)
+
+    def __getitem__(self, name: str) -> Union[Matcher, ShardedMatcher]:
+        return self._matchers[name]
+
+    def _match_buffer(
+        self, buf: ffi.CData, size: int, flags: Tuple[bool, ...]
+    ) -> Dict[str, MatchArrays]:
+        matchers = list(self._matchers.items())
+        if self._executor is None:
+            columns = [m._match_buffer_arrays(buf, size, *flags) for _, m in matchers]
+        else:
+            columns = list(
+                self._executor.map(
+                    lambda m: m._match_buffer_arrays(buf, size, *flags),
+                    (m for _, m in matchers),
+                )
+            )
+        return {name: arrays for (name, _), arrays in zip(matchers, columns)}
+
+    def match_arrays(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> Dict[str, MatchArrays]:
+        buf, size = _as_haystack(haystack)
+        flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+        return self._match_buffer(buf, size, flags)
+
+    def match(
+        self,
+        haystack: HaystackType,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+    ) -> List[TaggedMatchResult]:
+        # Hits ordered by offset, then by dictionary order
+        buf, size = _as_haystack(haystack)
+        flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+        by_name = self._match_buffer(buf, size, flags)
+        hits = [
+            (off, rank, length, name)
+            for rank, (name, arrays) in enumerate(by_name.items())
+            for off, length in zip(arrays.offsets, arrays.lengths)
+        ]
+        hits.sort(key=lambda hit: (hit[0], hit[1]))
+        view = ffi.buffer(buf, size)
+        return [
+            TaggedMatchResult(off, view[off : off + length], name)
+            for off, _, length, name in hits
+        ]
+
+    def match_file(
+        self,
+        path: str,
+        no_overlap: Literal[True, False] = False,
+        longest_only: Literal[True, False] = False,
+        word_boundary: Literal[True, False] = False,
+        word_prefix: Literal[True, False] = False,
+        word_suffix: Literal[True, False] = False,
+        prefetch_sequential: Literal[True, False] = True,
+    ) -> List[TaggedMatchResult]:
+        with MappedHaystack(path, prefetch_sequential) as haystack:
+            return self.match(
+                haystack,
+                no_overlap,
+                longest_only,
+                word_boundary,
+                word_prefix,
+                word_suffix,
+            )
+
+    def get_match_stats(self) -> Dict[str, MatchStats]:
+        return {name: m.get_match_stats() for name, m in self._matchers.items()}
+
+    def reset_match_stats(self) -> None:
+        for matcher in self._matchers.values():
+            matcher.reset_match_stats()
+
+    def set_threads(self, threads: int) -> None:
+        for matcher in self._matchers.values():
+            matcher.set_threads(threads)
+
+    def set_chunk_size(self, chunk: int) -> None:
+        for matcher in self._matchers.values():
+            matcher.set_chunk_size(chunk)
 
     def destroy(self) -> None:
-        if hasattr(self, "_matcher") and self._matcher and C is not None:
-            _get_library().oa_matcher_destroy(self._matcher)
-            self._matcher = ffi.NULL
+        executor = getattr(self, "_executor", None)
+        if executor is not None:
+            executor.shutdown(wait=True)
+            self._executor = None
+        for matcher in getattr(self, "_matchers", {}).values():
+            matcher.destroy()
+        self._matchers = {}
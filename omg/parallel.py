@@ -0,0 +1,219 @@
+# parallel.py
+
+import multiprocessing
+import os
+import threading
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import repeat
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+from .omg import (
+    HaystackType,
+    MappedHaystack,
+    MatchArrays,
+    Matcher,
+    MatchResult,
+    MatchStats,
+)
+
+# Per-process state of a scan_corpus() worker
+_matcher: Optional[Matcher] = None
+_match_flags: Tuple[bool, ...] = ()
+# Why the worker could not load the matcher; raising from a pool initializer
+# only makes the pool respawn the worker forever
+_load_error: Optional[Exception] = None
+
+
+def _init_worker(
+    compiled_file: str,
+    case_insensitive: bool,
+    ignore_punctuation: bool,
+    elide_whitespace: bool,
+    threads: int,
+    chunk_size: int,
+    match_flags: Tuple[bool, ...],
+) -> None:
+    global _matcher, _match_flags, _load_error
+    try:
+        _matcher = Matcher(
+            compiled_file, case_insensitive, ignore_punctuation, elide_whitespace
+        )
+        if threads:
+            _matcher.set_threads(threads)
+        if chunk_size:
+            _matcher.set_chunk_size(chunk_size)
+    except Exception as e:
+        _load_error = e
+    _match_flags = match_flags
+
+
+def _scan_file(path: str) -> Tuple[str, Union[MatchArrays, Exception]]:
+    if _matcher is None:
+        assert _load_error is not None
+        return path, _load_error
+    try:
+        with MappedHaystack(path) as haystack:
+            return path, _matcher.match_arrays(haystack, *_match_flags)
+    except (OSError, RuntimeError) as e:
+        # Reported for this path only, so one bad file does not end the scan
+        return path, e
+
+
+def scan_corpus(
+    compiled_file: str,
+    paths: Iterable[str],
+    workers: Optional[int] = None,
+    case_insensitive: bool = False,
+    ignore_punctuation: bool = False,
+    elide_whitespace: bool = False,
+    no_overlap: bool = False,
+    longest_only: bool = False,
+    word_boundary: bool = False,
+    word_prefix: bool = False,
+    word_suffix: bool = False,
+    threads: int = 1,
+    chunk_size: int = 0,
+    ordered: bool = False,
+    chunksize: int = 1,
+) -> Iterator[Tuple[str, Union[MatchArrays, Exception]]]:
+    """Scan many files with a pool of worker processes.
+
+    Every worker loads ``compiled_file`` once and then maps and matches the
+    files it is handed, sending back ``(path, MatchArrays)`` pairs. A
+    ``compiled_file`` that cannot be loaded raises here, before the pool is
+    started. A file that cannot be read or matched is sent back as
+    ``(path, exception)`` (an ``OSError`` or ``RuntimeError``) and the scan
+    carries on. Results are yielded as soon as they arrive unless ``ordered``
+    is set. ``threads`` is the native thread count inside each worker; it
+    defaults to 1 so that the pool does not oversubscribe the cores.
+    """
+    initargs = (
+        os.fspath(compiled_file),
+        case_insensitive,
+        ignore_punctuation,
+        elide_whitespace,
+        threads,
+        chunk_size,
+        (no_overlap, longest_only, word_boundary, word_prefix, word_suffix),
+    )
+    # Load errors surface in the caller rather than in every worker
+    Matcher(*initargs[:4]).destroy()
+    with multiprocessing.Pool(workers, _init_worker, initargs) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield from imap(_scan_file, (os.fspath(p) for p in paths), chunksize)
+
+
+class ThreadPoolMatcher:
+    """Fan haystacks out across a pool of threads in this process.
+
+    The native scan runs with the GIL released, so threads match in parallel
+    without the pickling costs of a process pool. All worker threads share
+    one thread-safe ``Matcher``, so the dictionary is loaded once; its
+    statistics counters are not synchronized, so ``get_match_stats()`` warns
+    that they may be approximate. Pass ``shared=False`` to give each worker
+    thread its own ``Matcher`` and exact statistics, at the cost of a copy of
+    the dictionary per thread.
+    """
+
+    def __init__(
+        self,
+        compiled_file: str,
+        workers: Optional[int] = None,
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+        threads: int = 1,
+        chunk_size: int = 0,
+        shared: bool = True,
+    ) -> None:
+        self._args = (
+            os.fspath(compiled_file),
+            case_insensitive,
+            ignore_punctuation,
+            elide_whitespace,
+        )
+        self._threads = threads
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._matchers: List[Matcher] = []
+        self._shared = self._create_matcher() if shared else None
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="omg-match")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _create_matcher(self) -> Matcher:
+        matcher = Matcher(*self._args)
+        if self._threads:
+            matcher.set_threads(self._threads)
+        if self._chunk_size:
+            matcher.set_chunk_size(self._chunk_size)
+        with self._lock:
+            self._matchers.append(matcher)
+        return matcher
+
+    def _matcher(self) -> Matcher:
+        if self._shared is not None:
+            return self._shared
+        matcher = getattr(self._local, "matcher", None)
+        if matcher is None:
+            matcher = self._local.matcher = self._create_matcher()
+        return matcher
+
+    def _match(self, haystack: HaystackType, flags: Tuple[bool, ...]):
+        return self._matcher().match(haystack, *flags)
+
+    def submit(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> "Future[List[MatchResult]]":
+        flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+        return self._executor.submit(self._match, haystack, flags)
+
+    def map(
+        self,
+        haystacks: Iterable[HaystackType],
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> List[List[MatchResult]]:
+        flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+        return list(self._executor.map(self._match, haystacks, repeat(flags)))
+
+    def get_match_stats(self) -> MatchStats:
+        if self._shared is not None:
+            warnings.warn(
+                "Match statistics of a shared ThreadPoolMatcher may be approximate; "
+                "use shared=False for exact statistics",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+        total = MatchStats(0, 0, 0, 0, 0)
+        with self._lock:
+            for matcher in self._matchers:
+                total = total + matcher.get_match_stats()
+        return total
+
+    def reset_match_stats(self) -> None:
+        with self._lock:
+            for matcher in self._matchers:
+                matcher.reset_match_stats()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for matcher in self._matchers:
+                matcher.destroy()
+            self._matchers = []
@@ -0,0 +1,306 @@
+# reload.py
+
+import os
+import threading
+import warnings
+import weakref
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from .omg import (
+    HaystackType,
+    MatchArrays,
+    Matcher,
+    MatchResult,
+    MatchStats,
+    PatternStoreStats,
+)
+
+# (st_dev, st_ino, st_mtime_ns, st_size)
+_FileIdentity = Tuple[int, int, int, int]
+
+
+def _file_identity(path: str) -> Optional[_FileIdentity]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _poll(
+    ref: "weakref.ReferenceType[ReloadableMatcher]",
+    stop: threading.Event,
+    interval: float,
+) -> None:
+    # Holds the matcher only while checking it, so an unclosed one can still
+    # be collected; polling stops once it is gone
+    while not stop.wait(interval):
+        matcher = ref()
+        if matcher is None:
+            return
+        try:
+            matcher.reload()
+        except Exception as e:  # pragma: no cover - keep polling
+            warnings.warn(f"Reloading {matcher._path} failed: {e}", RuntimeWarning)
+        del matcher
+
+
+class _Generation:
+    # A loaded matcher and the number of calls currently using it
+    def __init__(self, matcher: Matcher, identity: Optional[_FileIdentity]) -> None:
+        self.matcher = matcher
+        self.identity = identity
+        self.users = 0
+        self.retired = False
+
+
+class ReloadableMatcher:
+    """A ``Matcher`` that picks up a recompiled file without a restart.
+
+    The file's device, inode, mtime and size are polled every
+    ``poll_interval`` seconds on a background thread (or checked on demand
+    with ``reload()``). A changed file is loaded off the request path and
+    swapped in under a lock only once fully loaded; if it changed again
+    while loading, or fails to load, the current matcher stays in service.
+    Calls started before a swap finish on the matcher they started with,
+    which is destroyed once the last of them returns. Writing the new file
+    elsewhere and renaming it over the old one avoids loading partial files.
+    """
+
+    def __init__(
+        self,
+        compiled_or_patterns_file: str,
+        case_insensitive: bool = False,
+        ignore_punctuation: bool = False,
+        elide_whitespace: bool = False,
+        poll_interval: Optional[float] = 1.0,
+    ) -> None:
+        if poll_interval is not None and poll_interval <= 0:
+            raise ValueError(f"Invalid poll interval: {poll_interval}")
+        self._path = os.fspath(compiled_or_patterns_file)
+        self._flags = (case_insensitive, ignore_punctuation, elide_whitespace)
+        self._lock = threading.Lock()
+        # Serializes reload() so two checks never load the same file twice
+        self._reload_lock = threading.Lock()
+        # Settings re-applied to every newly loaded matcher
+        self._threads = 0
+        self._chunk_size = 0
+        self._small_input_threshold: Optional[int] = None
+        self._reloads = 0
+        self._failed: Optional[_FileIdentity] = None
+        identity = _file_identity(self._path)
+        self._current: Optional[_Generation] = _Generation(
+            Matcher(self._path, *self._flags), identity
+        )
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if poll_interval is not None:
+            self._thread = threading.Thread(
+                target=_poll,
+                args=(weakref.ref(self), self._stop, poll_interval),
+                name="omg-reload",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def reloads(self) -> int:
+        # Number of times a new version of the file has been swapped in
+        return self._reloads
+
+    def reload(self) -> bool:
+        """Load the file now if it changed; returns True if swapped in."""
+        with self._reload_lock:
+            current = self._current
+            if current is None:
+                return False
+            identity = _file_identity(self._path)
+            if identity is None or identity in (current.identity, self._failed):
+                return False
+            try:
+                matcher = Matcher(self._path, *self._flags)
+            except (RuntimeError, ValueError) as e:
+                self._failed = identity
+                warnings.warn(f"Failed to load {self._path}: {e}", RuntimeWarning)
+                return False
+            if _file_identity(self._path) != identity:
+                # Replaced while loading; pick up the newer file next time
+                matcher.destroy()
+                return False
+            retire: Optional[Matcher]
+            with self._lock:
+                old = self._current
+                if old is None:
+                    retire = matcher
+                else:
+                    self._configure(matcher)
+                    self._current = _Generation(matcher, identity)
+                    self._reloads += 1
+                    self._failed = None
+                    old.retired = True
+                    retire = old.matcher if old.users == 0 else None
+            if retire is not None:
+                retire.destroy()
+            return old is not None
+
+    def _configure(self, matcher: Matcher) -> None:
+        if self._threads:
+            matcher.set_threads(self._threads)
+        if self._chunk_size:
+            matcher.set_chunk_size(self._chunk_size)
+        if self._small_input_threshold is not None:
+            matcher.set_small_input_threshold(self._small_input_threshold)
+
+    @contextmanager
+    def pinned(self) -> Iterator[Matcher]:
+        """The current matcher, kept alive across a swap until exit."""
+        with self._lock:
+            generation = self._current
+            if generation is None:
+                raise RuntimeError("Matcher has been destroyed")
+            generation.users += 1
+        try:
+            yield generation.matcher
+        finally:
+            with self._lock:
+                generation.users -= 1
+                retire = generation.retired and generation.users == 0
+            if retire:
+                generation.matcher.destroy()
+
+    def match(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> List[MatchResult]:
+        with self.pinned() as matcher:
+            return matcher.match(
+                haystack,
+                no_overlap,
+                longest_only,
+                word_boundary,
+                word_prefix,
+                word_suffix,
+            )
+
+    def match_arrays(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> MatchArrays:
+        with self.pinned() as matcher:
+            return matcher.match_arrays(
+                haystack,
+                no_overlap,
+                longest_only,
+                word_boundary,
+                word_prefix,
+                word_suffix,
+            )
+
+    def match_many(
+        self,
+        docs: Sequence[HaystackType],
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> List[List[MatchResult]]:
+        with self.pinned() as matcher:
+            return matcher.match_many(
+                docs, no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+            )
+
+    def match_file(
+        self,
+        path: str,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+        decompress: bool = False,
+        overlap: Optional[int] = None,
+    ) -> List[MatchResult]:
+        with self.pinned() as matcher:
+            return matcher.match_file(
+                path,
+                no_overlap,
+                longest_only,
+                word_boundary,
+                word_prefix,
+                word_suffix,
+                decompress=decompress,
+                overlap=overlap,
+            )
+
+    def get_pattern_store_stats(self) -> PatternStoreStats:
+        with self.pinned() as matcher:
+            return matcher.get_pattern_store_stats()
+
+    def get_match_stats(self) -> MatchStats:
+        # Statistics of the current version only; they restart at a reload
+        with self.pinned() as matcher:
+            return matcher.get_match_stats()
+
+    def reset_match_stats(self) -> None:
+        with self.pinned() as matcher:
+            matcher.reset_match_stats()
+
+    def set_threads(self, threads: int) -> None:
+        # Under the swap lock, so a matcher being swapped in gets it too
+        with self._lock:
+            self._threads = threads
+            if self._current is not None:
+                self._current.matcher.set_threads(threads)
+
+    def set_chunk_size(self, chunk: int) -> None:
+        # Under the swap lock, so a matcher being swapped in gets it too
+        with self._lock:
+            self._chunk_size = chunk
+            if self._current is not None:
+                self._current.matcher.set_chunk_size(chunk)
+
+    def set_small_input_threshold(self, size: int) -> None:
+        # Under the swap lock, so a matcher being swapped in gets it too
+        with self._lock:
+            self._small_input_threshold = size
+            if self._current is not None:
+                self._current.matcher.set_small_input_threshold(size)
+
+    def close(self) -> None:
+        # Stops polling; the last matcher is destroyed after in-flight calls
+        if not hasattr(self, "_stop"):
+            return
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        with self._reload_lock, self._lock:
+            generation = self._current
+            self._current = None
+            if generation is None:
+                return
+            generation.retired = True
+            retire = generation.users == 0
+        if retire:
+            generation.matcher.destroy()
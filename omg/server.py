@@ -0,0 +1,342 @@
+# server.py
+#
+# A resident matcher served over a Unix domain socket or TCP.
+#
+# Request:  uint64 haystack length, uint8 flags, haystack bytes
+# Response: uint8 status, uint64 count, then
+#             status 0 (ok):    count records of uint64 offset, uint32 length
+#             status 1 (error): count bytes of UTF-8 error message
+#
+# All integers are little-endian. Requests on a connection may be pipelined;
+# responses are sent in request order.
+
+import os
+import queue
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple, Union
+
+from .omg import HaystackType, MatchArrays, Matcher, ShardedMatcher
+
+REQUEST_HEADER = struct.Struct("<QB")
+RESPONSE_HEADER = struct.Struct("<BQ")
+RECORD = struct.Struct("<QI")
+
+FLAG_NO_OVERLAP = 0x01
+FLAG_LONGEST_ONLY = 0x02
+FLAG_WORD_BOUNDARY = 0x04
+FLAG_WORD_PREFIX = 0x08
+FLAG_WORD_SUFFIX = 0x10
+_FLAG_BITS = (
+    FLAG_NO_OVERLAP,
+    FLAG_LONGEST_ONLY,
+    FLAG_WORD_BOUNDARY,
+    FLAG_WORD_PREFIX,
+    FLAG_WORD_SUFFIX,
+)
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# A Unix socket path, or a (host, port) pair for TCP
+Address = Union[str, Tuple[str, int]]
+
+
+def encode_flags(
+    no_overlap: bool = False,
+    longest_only: bool = False,
+    word_boundary: bool = False,
+    word_prefix: bool = False,
+    word_suffix: bool = False,
+) -> int:
+    flags = (no_overlap, longest_only, word_boundary, word_prefix, word_suffix)
+    return sum(bit for bit, flag in zip(_FLAG_BITS, flags) if flag)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytearray]:
+    # None on EOF before the first byte; a partial read raises
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if n == 0:
+            if pos == 0:
+                return None
+            raise ConnectionError("Connection closed mid-message")
+        pos += n
+    return buf
+
+
+def _encode_arrays(arrays: MatchArrays) -> bytes:
+    pack = RECORD.pack
+    return RESPONSE_HEADER.pack(STATUS_OK, len(arrays)) + b"".join(
+        map(pack, arrays.offsets, arrays.lengths)
+    )
+
+
+def _encode_error(message: str) -> bytes:
+    data = message.encode("utf-8")
+    return RESPONSE_HEADER.pack(STATUS_ERROR, len(data)) + data
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "_SocketServer"
+
+    def handle(self) -> None:
+        owner = self.server.owner
+        sock: socket.socket = self.request
+        # Futures of responses not yet written; bounded, so a client that
+        # pipelines faster than it reads back gets backpressure
+        pending: "queue.Queue[Optional[Future]]" = queue.Queue(owner.max_pending)
+        writer = threading.Thread(
+            target=self._write_responses,
+            args=(sock, pending),
+            name="omg-server-writer",
+            daemon=True,
+        )
+        writer.start()
+        try:
+            while True:
+                header = _recv_exact(sock, REQUEST_HEADER.size)
+                if header is None:
+                    break
+                size, flags = REQUEST_HEADER.unpack(header)
+                if size > owner.max_request_size:
+                    failed: Future = Future()
+                    failed.set_result(_encode_error(f"Request too large: {size} bytes"))
+                    pending.put(failed)
+                    break
+                haystack = _recv_exact(sock, size) if size else bytearray()
+                if haystack is None:
+                    raise ConnectionError("Connection closed mid-message")
+                pending.put(owner._submit(haystack, flags))
+        except OSError:
+            pass
+        finally:
+            pending.put(None)
+            writer.join()
+
+    @staticmethod
+    def _write_responses(
+        sock: socket.socket, pending: "queue.Queue[Optional[Future]]"
+    ) -> None:
+        broken = False
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            response = future.result()
+            if not broken:
+                try:
+                    sock.sendall(response)
+                except OSError:
+                    # Keep draining so the reader never blocks on the queue
+                    broken = True
+
+
+class _SocketServer(socketserver.ThreadingMixIn, socketserver.BaseServer):
+    daemon_threads = True
+    owner: "MatchServer"
+
+
+class _TCPServer(_SocketServer, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+if hasattr(socket, "AF_UNIX"):
+
+    class _UnixServer(_SocketServer, socketserver.UnixStreamServer):
+        pass
+
+
+class MatchServer:
+    """Serve a loaded matcher over a Unix domain socket or localhost TCP.
+
+    ``address`` is a socket path or a ``(host, port)`` pair; port 0 picks a
+    free port (see ``server_address``). Each connection is read on its own
+    thread and scans run on a shared pool of ``workers`` threads (the native
+    scan releases the GIL). Up to ``max_pending`` pipelined requests per
+    connection are in flight; responses are written in request order. The
+    matcher is not destroyed when the server closes.
+    """
+
+    def __init__(
+        self,
+        matcher: Union[Matcher, ShardedMatcher],
+        address: Address,
+        workers: Optional[int] = None,
+        max_pending: int = 64,
+        max_request_size: int = 1 << 30,
+    ) -> None:
+        if max_pending <= 0:
+            raise ValueError(f"Invalid max_pending: {max_pending}")
+        self._matcher = matcher
+        self.max_pending = max_pending
+        self.max_request_size = max_request_size
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="omg-server")
+        self._unix_path: Optional[str] = None
+        server: _SocketServer
+        try:
+            if isinstance(address, tuple):
+                server = _TCPServer(address, _Handler)
+            else:
+                if not hasattr(socket, "AF_UNIX"):
+                    raise ValueError("Unix domain sockets are not supported here")
+                path = os.fspath(address)
+                # Replace a socket left behind by a previous server
+                try:
+                    if stat.S_ISSOCK(os.stat(path).st_mode):
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                server = _UnixServer(path, _Handler)
+                self._unix_path = path
+        except BaseException:
+            self._executor.shutdown(wait=False)
+            raise
+        server.owner = self
+        self._server = server
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def server_address(self) -> Address:
+        return self._server.server_address  # type: ignore[return-value]
+
+    def _submit(self, haystack: bytearray, flags: int) -> Future:
+        return self._executor.submit(self._match, haystack, flags)
+
+    def _match(self, haystack: bytearray, flags: int) -> bytes:
+        try:
+            arrays = self._matcher.match_arrays(
+                haystack, *(bool(flags & bit) for bit in _FLAG_BITS)
+            )
+        except Exception as e:
+            return _encode_error(str(e))
+        return _encode_arrays(arrays)
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def start(self) -> None:
+        # Serve on a background thread
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="omg-server", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        self._executor.shutdown(wait=True)
+        if self._unix_path is not None:
+            try:
+                os.unlink(self._unix_path)
+            except FileNotFoundError:
+                pass
+            self._unix_path = None
+
+
+class MatchClient:
+    """Client for ``MatchServer``; not safe to share between threads."""
+
+    def __init__(self, address: Address, timeout: Optional[float] = None) -> None:
+        if isinstance(address, tuple):
+            self._sock = socket.create_connection(address, timeout)
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            try:
+                self._sock.connect(os.fspath(address))
+            except BaseException:
+                self._sock.close()
+                raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _send(self, haystack: HaystackType, flags: int) -> None:
+        view = memoryview(haystack).cast("B")
+        self._sock.sendall(REQUEST_HEADER.pack(view.nbytes, flags))
+        self._sock.sendall(view)
+
+    def _receive(self) -> MatchArrays:
+        header = _recv_exact(self._sock, RESPONSE_HEADER.size)
+        if header is None:
+            raise ConnectionError("Server closed the connection")
+        status, count = RESPONSE_HEADER.unpack(header)
+        body = _recv_exact(
+            self._sock, count * RECORD.size if status == STATUS_OK else count
+        )
+        if status != STATUS_OK:
+            raise RuntimeError(bytes(body or b"").decode("utf-8", errors="replace"))
+        offsets = array("Q")
+        lengths = array("I")
+        for off, length in RECORD.iter_unpack(body or b""):
+            offsets.append(off)
+            lengths.append(length)
+        return MatchArrays(offsets, lengths)
+
+    def match(
+        self,
+        haystack: HaystackType,
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+    ) -> MatchArrays:
+        flags = encode_flags(
+            no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        self._send(haystack, flags)
+        return self._receive()
+
+    def match_many(
+        self,
+        haystacks: Iterable[HaystackType],
+        no_overlap: bool = False,
+        longest_only: bool = False,
+        word_boundary: bool = False,
+        word_prefix: bool = False,
+        word_suffix: bool = False,
+        window: int = 16,
+    ) -> List[MatchArrays]:
+        # Pipelined: up to window requests are sent ahead of their responses.
+        # Keep window at or below the server's max_pending.
+        if window <= 0:
+            raise ValueError(f"Invalid window: {window}")
+        flags = encode_flags(
+            no_overlap, longest_only, word_boundary, word_prefix, word_suffix
+        )
+        results: List[MatchArrays] = []
+        outstanding = 0
+        for haystack in haystacks:
+            self._send(haystack, flags)
+            outstanding += 1
+            if outstanding >= window:
+                results.append(self._receive())
+                outstanding -= 1
+        for _ in range(outstanding):
+            results.append(self._receive())
+        return results
+
+    def close(self) -> None:
+        self._sock.close()
@@ -0,0 +1,58 @@
+# tests/test_aio.py
+
+import asyncio
+
+import pytest
+
+from omg.aio import AsyncMatcher
+from omg.omg import Compiler, Matcher
+
+
+@pytest.fixture
+def matcher(tmp_path):
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nbar\nbazinga")
+    with Matcher(compiled_file) as m:
+        yield m
+
+
+def test_async_match(matcher, tmp_path):
+    haystack = b"xx foobar yy foo zz bar bazinga"
+    hay_file = tmp_path / "haystack.txt"
+    hay_file.write_bytes(haystack)
+
+    async def run():
+        async with AsyncMatcher(matcher, max_workers=2, max_pending=2) as am:
+            assert am.matcher is matcher
+            results = await asyncio.gather(
+                *(am.match(haystack, word_boundary=bool(i % 2)) for i in range(8))
+            )
+            assert results[0] == matcher.match(haystack)
+            assert results[1] == matcher.match(haystack, word_boundary=True)
+            arrays = await am.match_arrays(haystack)
+            assert list(arrays.offsets) == [r.offset for r in results[0]]
+            assert await am.match_many([b"foo", b"bar"]) == matcher.match_many(
+                [b"foo", b"bar"]
+            )
+            assert await am.match_file(str(hay_file)) == results[0]
+
+    asyncio.run(run())
+
+
+def test_async_stream(matcher):
+    haystack = b"xx foobar yy foo zz bar bazinga " * 50
+
+    async def run():
+        reader = asyncio.StreamReader()
+        for i in range(0, len(haystack), 100):
+            reader.feed_data(haystack[i : i + 100])
+        reader.feed_eof()
+        async with AsyncMatcher(matcher) as am:
+            return [hit async for hit in am.stream(reader, chunk_size=64)]
+
+    assert asyncio.run(run()) == matcher.match(haystack)
+
+
+def test_async_matcher_invalid_pending(matcher):
+    with pytest.raises(ValueError):
+        AsyncMatcher(matcher, max_pending=0)
@@ -0,0 +1,91 @@
+# tests/test_cache.py
+
+import os
+
+import pytest
+
+from omg.cache import CacheStats, MatcherCache
+from omg.omg import Compiler
+
+
+def compile_patterns(path, patterns):
+    Compiler.compile_from_buffer(str(path), b"\n".join(patterns))
+
+
+def test_matcher_cache_hits_and_eviction(tmp_path):
+    files = []
+    for i in range(3):
+        path = tmp_path / f"dict{i}.omg"
+        compile_patterns(path, [b"foo", b"bar%d" % i])
+        files.append(str(path))
+
+    with MatcherCache(maxsize=2) as cache:
+        with cache.get(files[0]) as m0, cache.get(files[0]) as again:
+            assert again is m0
+            assert [r.match for r in m0.match(b"foo bar0")] == [b"foo", b"bar0"]
+        # Different normalization flags are cached separately
+        with cache.get(files[0], case_insensitive=True) as m:
+            assert m is not m0
+        assert cache.get_stats() == CacheStats(1, 2, 0, 2, 2)
+
+        with cache.get(files[1]) as m1:
+            pass
+        stats = cache.get_stats()
+        assert (stats.evictions, stats.size) == (1, 2)
+        # The least recently used idle matcher was destroyed on eviction
+        with pytest.raises(RuntimeError):
+            m0.match(b"foo")
+        with cache.get(files[1]) as m:
+            assert m is m1
+        assert len(cache) == 2
+    assert len(cache) == 0
+    with pytest.raises(RuntimeError):
+        m1.match(b"foo")
+
+
+def test_matcher_cache_keeps_pinned_matcher(tmp_path):
+    files = []
+    for i in range(3):
+        path = tmp_path / f"dict{i}.omg"
+        compile_patterns(path, [b"foo%d" % i])
+        files.append(str(path))
+
+    with MatcherCache(maxsize=1) as cache:
+        with cache.get(files[0]) as m0:
+            # Evicted by other lookups while still in use
+            for path in files[1:]:
+                with cache.get(path):
+                    pass
+            assert cache.get_stats().evictions == 2
+            assert [r.match for r in m0.match(b"foo0")] == [b"foo0"]
+        with pytest.raises(RuntimeError):
+            m0.match(b"foo0")
+
+        # clear() leaves a pinned matcher to its holder
+        with cache.get(files[0]) as m:
+            cache.clear()
+            assert [r.match for r in m.match(b"foo0")] == [b"foo0"]
+        with pytest.raises(RuntimeError):
+            m.match(b"foo0")
+
+
+def test_matcher_cache_reloads_changed_file(tmp_path):
+    path = tmp_path / "dict.omg"
+    compile_patterns(path, [b"foo"])
+    with MatcherCache() as cache:
+        with cache.get(str(path)) as m:
+            assert [r.match for r in m.match(b"foo bar")] == [b"foo"]
+
+        compile_patterns(path, [b"bar"])
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        with cache.get(str(path)) as m2:
+            assert m2 is not m
+            assert [r.match for r in m2.match(b"foo bar")] == [b"bar"]
+        stats = cache.get_stats()
+        assert (stats.misses, stats.evictions, stats.size) == (2, 1, 1)
+
+
+def test_matcher_cache_invalid_size():
+    with pytest.raises(ValueError):
+        MatcherCache(maxsize=0)
@@ -0,0 +1,141 @@
+# tests/test_compression.py
+
+import bz2
+import gzip
+import lzma
+import os
+
+import pytest
+
+from omg.compression import (
+    detect_compression,
+    iter_decompressed,
+    open_decompressed,
+)
+from omg.omg import (
+    PATTERN_IDS_SUFFIX,
+    Compiler,
+    Matcher,
+    MatchResult,
+    ShardedMatcher,
+)
+
+COMPRESSORS = {"gzip": gzip.compress, "bz2": bz2.compress, "xz": lzma.compress}
+
+
+def write_file(path, lines):
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+@pytest.mark.parametrize("compression", sorted(COMPRESSORS))
+def test_detect_and_decompress(tmp_path, compression):
+    data = bytes(range(256)) * 1000
+    path = tmp_path / "data.bin"
+    path.write_bytes(COMPRESSORS[compression](data))
+    assert detect_compression(str(path)) == compression
+    with open_decompressed(str(path)) as f:
+        assert f.read() == data
+    chunks = list(iter_decompressed(str(path), chunk_size=1000, max_pending=1))
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert b"".join(chunks) == data
+
+
+def test_plain_file(tmp_path):
+    path = tmp_path / "plain.txt"
+    path.write_bytes(b"plain text")
+    assert detect_compression(str(path)) is None
+    assert b"".join(iter_decompressed(str(path))) == b"plain text"
+    with pytest.raises(ValueError):
+        open_decompressed(str(path), "lz4")
+    with pytest.raises(ValueError):
+        list(iter_decompressed(str(path), chunk_size=0))
+
+
+def test_iter_decompressed_errors_and_early_close(tmp_path):
+    path = tmp_path / "data.gz"
+    path.write_bytes(gzip.compress(b"x" * 100000)[:-20])
+    with pytest.raises(EOFError):
+        list(iter_decompressed(str(path), chunk_size=1000))
+
+    path.write_bytes(gzip.compress(b"x" * 100000))
+    chunks = iter_decompressed(str(path), chunk_size=10, max_pending=1)
+    assert next(chunks) == b"x" * 10
+    # Stops the decompression thread blocked on the full queue
+    chunks.close()
+
+
+def test_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = tmp_path / "data.zst"
+    path.write_bytes(zstandard.ZstdCompressor().compress(b"foo bar" * 1000))
+    assert detect_compression(str(path)) == "zstd"
+    assert b"".join(iter_decompressed(str(path))) == b"foo bar" * 1000
+
+
+@pytest.mark.parametrize("compression", sorted(COMPRESSORS))
+def test_match_file_decompress(tmp_path, compression):
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, ["foo", "foobar", "bar", "barfoo"])
+    haystack = b"foobarfoo foo bar barfoobar xfoo foox foobar\n" * 50000
+    path = tmp_path / "haystack"
+    path.write_bytes(COMPRESSORS[compression](haystack))
+    with Matcher(str(pat_file)) as m:
+        expected = m.match(haystack)
+        assert m.match_file(str(path), decompress=True) == expected
+        assert m.match_file(str(path), no_overlap=True, decompress=True) == (
+            m.match(haystack, no_overlap=True)
+        )
+        # Counted from the stream, without building the hits
+        assert m.count_file(str(path), decompress=True) == len(expected)
+        assert m.count_file(str(path), no_overlap=True, decompress=True) == (
+            m.count(haystack, no_overlap=True)
+        )
+        # Uncompressed files are mapped as usual
+        plain = tmp_path / "plain.txt"
+        plain.write_bytes(haystack)
+        assert m.match_file(str(plain), decompress=True) == expected
+
+    manifest = tmp_path / "sharded.omg"
+    Compiler.compile_sharded(str(pat_file), str(manifest), shards=2)
+    with ShardedMatcher(str(manifest)) as sm:
+        assert sm.match_file(str(path), decompress=True) == sm.match(haystack)
+        assert sm.count_file(str(path), decompress=True) == sm.count(haystack)
+
+
+def test_match_file_decompress_elided_hit_at_seam(tmp_path):
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, ["foo"])
+    # An elided hit much longer than the pattern, straddling the seam between
+    # the first two decompressed blocks
+    hit = b"f" + b"'" * 10 + b"oo"
+    seam = 1 << 20
+    haystack = b"x" * (seam - 5) + hit + b"x" * 100
+    path = tmp_path / "haystack.gz"
+    path.write_bytes(gzip.compress(haystack))
+    with Matcher(str(pat_file), ignore_punctuation=True) as m:
+        expected = m.match(haystack)
+        assert [(r.offset, r.match) for r in expected] == [(seam - 5, hit)]
+        with pytest.raises(ValueError, match="overlap"):
+            m.match_file(str(path), decompress=True)
+        assert m.match_file(str(path), decompress=True, overlap=16) == expected
+
+    # A compiled file records its normalization, opened with flags or not
+    compiled = str(tmp_path / "compiled.bin")
+    Compiler.compile_from_filename(compiled, str(pat_file), ignore_punctuation=True)
+    with Matcher(compiled) as m:
+        with pytest.raises(ValueError, match="overlap"):
+            m.match_file(str(path), decompress=True)
+        assert m.match_file(str(path), decompress=True, overlap=16) == expected
+    Compiler.compile_from_filename(compiled, str(pat_file))
+    plain = b"x" * (seam - 2) + b"foo"
+    path.write_bytes(gzip.compress(plain))
+    with Matcher(compiled) as m:
+        assert m.match_file(str(path), decompress=True) == m.match(plain)
+        assert m.match_file(str(path), decompress=True) == [
+            MatchResult(seam - 2, b"foo")
+        ]
+    # Without the sidecar (a file from another tool) it is unknown
+    os.remove(compiled + PATTERN_IDS_SUFFIX)
+    with Matcher(compiled) as m:
+        with pytest.raises(ValueError, match="overlap"):
+            m.match_file(str(path), decompress=True)
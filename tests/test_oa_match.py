@@ -0,0 +1,288 @@
+# tests/test_oa_match.py
+
+import base64
+import gzip
+import io
+import json
+import lzma
+import os
+import sys
+import threading
+
+import pytest
+
+from oa_match import (
+    BINARY_COUNT,
+    BINARY_FILE_HEADER,
+    BINARY_RECORD,
+    iter_haystack_paths,
+    iter_view_hits,
+    json_bytes,
+    match_mode,
+    open_output,
+    tsv_escape,
+    write_count,
+    write_hits,
+)
+from omg.omg import Compiler
+
+# Not valid UTF-8, and containing every byte TSV has to escape
+MATCHES = [b"foo", b"\xff\xfe\tx", b"a\\b\nc\r"]
+
+
+def format_hits(output_format, path=None):
+    haystack = b"".join(MATCHES)
+    offsets, lengths, pos = [], [], 0
+    for match in MATCHES:
+        offsets.append(pos)
+        lengths.append(len(match))
+        pos += len(match)
+    out = io.BytesIO()
+    hits = iter_view_hits(memoryview(haystack), offsets, lengths)
+    write_hits(out, output_format, hits, len(offsets), path)
+    return out.getvalue(), list(zip(offsets, lengths, MATCHES))
+
+
+def read_binary_records(data, count):
+    records = []
+    pos = 0
+    for _ in range(count):
+        off, length = BINARY_RECORD.unpack_from(data, pos)
+        pos += BINARY_RECORD.size
+        records.append((off, length, data[pos : pos + length]))
+        pos += length
+    return records, pos
+
+
+def test_binary_round_trip():
+    data, expected = format_hits("binary")
+    records, end = read_binary_records(data, len(expected))
+    assert records == expected
+    assert end == len(data)
+
+    # Tagged with a path: header, path, record count, then the records
+    data, expected = format_hits("binary", b"dir/\xffile")
+    (path_len,) = BINARY_FILE_HEADER.unpack_from(data)
+    pos = BINARY_FILE_HEADER.size
+    assert data[pos : pos + path_len] == b"dir/\xffile"
+    pos += path_len
+    (count,) = BINARY_COUNT.unpack_from(data, pos)
+    assert count == len(expected)
+    records, end = read_binary_records(data[pos + BINARY_COUNT.size :], count)
+    assert records == expected
+    assert pos + BINARY_COUNT.size + end == len(data)
+
+
+def test_jsonl_round_trip():
+    data, expected = format_hits("jsonl", b"hay.txt")
+    lines = data.decode("utf-8").splitlines()
+    assert len(lines) == len(expected)
+    for line, (off, length, match) in zip(lines, expected):
+        record = json.loads(line)
+        assert (record["path"], record["offset"], record["length"]) == (
+            "hay.txt",
+            off,
+            length,
+        )
+        if "match" in record:
+            assert record["match"].encode("utf-8") == match
+        else:
+            assert base64.b64decode(record["match_base64"]) == match
+    # Valid UTF-8 stays readable, anything else is base64-encoded
+    assert json.loads(lines[0])["match"] == "foo"
+    assert "match_base64" in json.loads(lines[1])
+
+
+def test_tsv_escaping():
+    assert tsv_escape(b"a\\b\tc\nd\re") == b"a\\\\b\\tc\\nd\\re"
+    # The escape character is escaped first, so escapes are not doubled
+    assert tsv_escape(b"\\t") == b"\\\\t"
+    data, expected = format_hits("tsv", b"a\tb")
+    lines = data.split(b"\n")
+    assert lines[-1] == b""
+    assert lines[:-1] == [
+        b"a\\tb\t0\t3\tfoo",
+        b"a\\tb\t3\t4\t\xff\xfe\\tx",
+        b"a\\tb\t7\t6\ta\\\\b\\nc\\r",
+    ]
+    # One record per line and four columns, whatever the match contains
+    assert all(line.count(b"\t") == 3 for line in lines[:-1])
+
+
+def test_raw_and_offsets_formats():
+    data, _ = format_hits("raw")
+    assert data == b"0:foo\n3:\xff\xfe\tx\n7:a\\b\nc\r\n"
+    data, _ = format_hits("offsets", b"hay.txt")
+    assert data == b"hay.txt\t0\t3\nhay.txt\t3\t4\nhay.txt\t7\t6\n"
+    with pytest.raises(ValueError):
+        format_hits("xml")
+
+
+def test_json_bytes():
+    record = {}
+    json_bytes(record, "match", "héllo".encode("utf-8"))
+    assert record == {"match": "héllo"}
+    record = {}
+    json_bytes(record, "match", b"\x80")
+    assert record == {"match_base64": "gA=="}
+
+
+@pytest.mark.parametrize(
+    "output_format, path, expected",
+    [
+        ("raw", None, b"3\n"),
+        ("raw", b"a.txt", b"a.txt:3\n"),
+        ("offsets", b"a\tb", b"a\\tb\t3\n"),
+        ("tsv", None, b"3\n"),
+        ("jsonl", b"a.txt", b'{"path": "a.txt", "count": 3}\n'),
+        ("binary", None, BINARY_COUNT.pack(3)),
+        (
+            "binary",
+            b"a.txt",
+            BINARY_FILE_HEADER.pack(5) + b"a.txt" + BINARY_COUNT.pack(3),
+        ),
+    ],
+)
+def test_write_count(output_format, path, expected):
+    out = io.BytesIO()
+    write_count(out, output_format, 3, path)
+    assert out.getvalue() == expected
+
+
+def test_open_output_writes_binary_to_stdout(capfdbinary):
+    with open_output() as out:
+        # No newline translation or decoding on the way out
+        out.write(b"\xff\r\n")
+    assert capfdbinary.readouterr().out == b"\xff\r\n"
+
+
+def run_match(compiled_file, haystack_files, **kwargs):
+    # Defaults for the positional flags: no normalization or overlap options,
+    # native threading and chunking left alone, quiet
+    return match_mode(
+        compiled_file, haystack_files, *([False] * 6), 0, 0, False, **kwargs
+    )
+
+
+@pytest.fixture
+def compiled_file(tmp_path):
+    path = str(tmp_path / "compiled.bin")
+    Compiler.compile_from_buffer(path, b"foo\nbar")
+    return path
+
+
+def test_iter_haystack_paths(tmp_path, monkeypatch):
+    for name in ["b.txt", "a.txt", "sub/c.txt", "sub/deeper/d.log"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+    top = str(tmp_path)
+
+    # Directories are walked recursively, in sorted order
+    assert list(iter_haystack_paths([top])) == [
+        os.path.join(top, "a.txt"),
+        os.path.join(top, "b.txt"),
+        os.path.join(top, "sub", "c.txt"),
+        os.path.join(top, "sub", "deeper", "d.log"),
+    ]
+    assert list(iter_haystack_paths([os.path.join(top, "**", "*.txt")])) == [
+        os.path.join(top, "a.txt"),
+        os.path.join(top, "b.txt"),
+        os.path.join(top, "sub", "c.txt"),
+    ]
+    # A glob naming a directory expands it
+    assert list(iter_haystack_paths([os.path.join(top, "s*")])) == [
+        os.path.join(top, "sub", "c.txt"),
+        os.path.join(top, "sub", "deeper", "d.log"),
+    ]
+    # Missing paths and unmatched globs are passed through to be reported
+    missing = os.path.join(top, "missing.txt")
+    unmatched = os.path.join(top, "*.csv")
+    assert list(iter_haystack_paths([missing, unmatched])) == [missing, unmatched]
+
+    # "-" reads a list of paths from stdin, skipping blank lines
+    monkeypatch.setattr(sys, "stdin", io.StringIO("x.txt\r\n\ny z.txt\n"))
+    assert list(iter_haystack_paths(["a", "-", "b"])) == [
+        "a",
+        "x.txt",
+        "y z.txt",
+        "b",
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_match_mode_reports_bad_paths(tmp_path, compiled_file, capfdbinary, jobs):
+    good = tmp_path / "good.txt"
+    good.write_bytes(b"xx foo yy bar")
+    missing = str(tmp_path / "missing.txt")
+    status = run_match(compiled_file, [missing, str(good)], jobs=jobs)
+    out, err = capfdbinary.readouterr()
+    # The bad path is reported and fails the run, but the others are scanned
+    assert status == 2
+    assert err.startswith(os.fsencode(missing) + b": ")
+    prefix = os.fsencode(str(good))
+    assert out == prefix + b":3:foo\n" + prefix + b":10:bar\n"
+
+    assert run_match(compiled_file, [str(good)]) == 0
+    out, err = capfdbinary.readouterr()
+    # A single file is not tagged with its name
+    assert (out, err) == (b"3:foo\n10:bar\n", b"")
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs named pipes")
+@pytest.mark.parametrize("decompress", [False, True])
+def test_match_mode_pipe(tmp_path, compiled_file, capfdbinary, decompress):
+    fifo = tmp_path / "haystack.fifo"
+    os.mkfifo(fifo)
+
+    def feed():
+        with open(fifo, "wb") as f:
+            f.write(b"xx foo yy bar")
+
+    writer = threading.Thread(target=feed)
+    writer.start()
+    status = run_match(compiled_file, [str(fifo)], decompress=decompress)
+    writer.join()
+    out, err = capfdbinary.readouterr()
+    # Read whole rather than mapped, and untagged like a single file
+    assert (status, out, err) == (0, b"3:foo\n10:bar\n", b"")
+
+
+def test_match_mode_decompress_overlap(tmp_path, compiled_file, capfdbinary):
+    path = tmp_path / "haystack.gz"
+    path.write_bytes(gzip.compress(b"xx foo yy b.ar"))
+    assert run_match(compiled_file, [str(path)], decompress=True) == 0
+    assert capfdbinary.readouterr() == (b"3:foo\n", b"")
+
+    # Ignored punctuation can make hits longer than any pattern, so the
+    # overlap is required
+    Compiler.compile_from_buffer(compiled_file, b"foo\nbar", ignore_punctuation=True)
+    assert run_match(compiled_file, [str(path)], decompress=True) == 2
+    out, err = capfdbinary.readouterr()
+    assert out == b"" and b"overlap" in err
+    status = run_match(compiled_file, [str(path)], decompress=True, overlap=16)
+    out, err = capfdbinary.readouterr()
+    assert (status, out, err) == (0, b"3:foo\n10:b.ar\n", b"")
+
+
+def test_match_mode_reports_corrupt_archives(tmp_path, compiled_file, capfdbinary):
+    good = tmp_path / "good.gz"
+    good.write_bytes(gzip.compress(b"xx foo yy bar" * 1000))
+    truncated = tmp_path / "truncated.gz"
+    truncated.write_bytes(good.read_bytes()[:30])
+    corrupt = tmp_path / "corrupt.xz"
+    corrupt.write_bytes(lzma.compress(b"xx foo")[:12] + b"\x00" * 64)
+    paths = [str(truncated), str(good), str(corrupt)]
+    for count_only in (False, True):
+        status = run_match(
+            compiled_file, paths, decompress=True, count_only=count_only, jobs=1
+        )
+        out, err = capfdbinary.readouterr()
+        # Each bad archive is reported and the good one is still matched
+        assert status == 2
+        assert err.count(b"\n") == 2
+        assert os.fsencode(paths[0]) + b": " in err
+        assert os.fsencode(paths[2]) + b": " in err
+        if count_only:
+            assert out == os.fsencode(paths[1]) + b":2000\n"
+        else:
+            assert out.count(b"\n") == 2000
@@ -1,8 +1,36 @@
 # tests/test_omg.py
 
+import bisect
+import os
+import shutil
+import threading
+from collections import Counter
+
 import pytest
 
-from omg.omg import Compiler, Matcher, MatchStats, PatternStoreStats, get_version
+import omg.omg
+from omg.omg import (
+    PATTERN_IDS_SUFFIX,
+    TUNING_SUFFIX,
+    Compiler,
+    HitCounter,
+    MappedHaystack,
+    MatchArrays,
+    Matcher,
+    MatcherSet,
+    MatchResult,
+    MatchResults,
+    MatchStats,
+    OverlayMatcher,
+    PatternStoreStats,
+    RecordMatch,
+    ShardedMatcher,
+    StreamingMatcher,
+    TaggedMatchResult,
+    TuningResult,
+    get_version,
+    is_shard_manifest,
+)
 
 
 def write_file(path, lines):
@@ -248,3 +276,830 @@ def test_word_suffix_and_boundary(tmp_path):
         # 'foo' in 'foobar' is suffix? no; matches as full word at offsets 7 and 11
         assert offsets == [7, 11, 18]
         assert matches == [b"foo", b"foo", b"foo"]
+
+
+def test_match_buffer_protocol(tmp_path):
+    import mmap
+    from array import array
+
+    patterns = ["foo", "bar"]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    hay = b"xx foobar yy foo zz bar"
+    hay_file = tmp_path / "haystack.txt"
+    hay_file.write_bytes(hay)
+    with Matcher(str(pat_file)) as m:
+        expected = [(r.offset, r.match) for r in m.match(hay)]
+        assert expected == [(3, b"foo"), (6, b"bar"), (13, b"foo"), (20, b"bar")]
+
+        for buf in (bytearray(hay), memoryview(hay), array("B", hay)):
+            assert [(r.offset, r.match) for r in m.match(buf)] == expected
+
+        with open(hay_file, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            assert [(r.offset, r.match) for r in m.match(mm)] == expected
+
+        # Slices of a memoryview are matched in place with relative offsets
+        sub = memoryview(hay)[13:]
+        assert [(r.offset, r.match) for r in m.match(sub)] == [(0, b"foo"), (7, b"bar")]
+        assert m.match(b"") == []
+
+        with pytest.raises(TypeError):
+            m.match("foo bar")
+        with pytest.raises(TypeError):
+            m.match(42)
+        with pytest.raises(ValueError):
+            m.match(memoryview(hay)[::2])
+
+
+def test_match_file_and_mapped_haystack(tmp_path):
+    patterns = ["foo", "bar"]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    hay_file = tmp_path / "haystack.txt"
+    hay_file.write_bytes(b"xx foobar yy foo zz bar")
+    empty_file = tmp_path / "empty.txt"
+    empty_file.write_bytes(b"")
+    with Matcher(str(pat_file)) as m:
+        results = m.match_file(str(hay_file))
+        assert [r.offset for r in results] == [3, 6, 13, 20]
+        assert [r.match for r in results] == [b"foo", b"bar", b"foo", b"bar"]
+        assert m.match_file(hay_file, no_overlap=True, prefetch_sequential=False)
+
+        with MappedHaystack(str(hay_file)) as hay:
+            assert len(hay) == 23
+            assert hay.buffer[3:9] == b"foobar"
+            assert [r.offset for r in m.match(hay)] == [3, 6, 13, 20]
+        assert hay.closed
+        with pytest.raises(ValueError):
+            m.match(hay)
+        hay.close()
+
+        assert m.match_file(str(empty_file)) == []
+        with MappedHaystack(str(empty_file)) as hay:
+            assert len(hay) == 0
+            assert hay.buffer[:] == b""
+
+        with pytest.raises(OSError):
+            m.match_file(str(tmp_path / "missing.txt"))
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs named pipes")
+def test_match_file_pipe(tmp_path):
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, ["foo", "bar"])
+    fifo = tmp_path / "haystack.fifo"
+    os.mkfifo(fifo)
+
+    def feed():
+        with open(fifo, "wb") as f:
+            f.write(b"xx foo yy bar")
+
+    writer = threading.Thread(target=feed)
+    writer.start()
+    with Matcher(str(pat_file)) as m:
+        # A pipe reports a size of 0 but is read, not treated as empty
+        results = m.match_file(str(fifo))
+    writer.join()
+    assert [(r.offset, r.match) for r in results] == [(3, b"foo"), (10, b"bar")]
+
+
+def test_match_arrays(tmp_path):
+    patterns = ["foo", "bar", "bazinga"]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    with Matcher(str(pat_file)) as m:
+        haystack = b"xx foobar yy foo zz bar bazinga"
+        arrays = m.match_arrays(haystack)
+        assert isinstance(arrays, MatchArrays)
+        assert len(arrays) == 5
+        assert arrays.offsets.typecode == "Q"
+        assert arrays.lengths.typecode == "I"
+        assert list(arrays.offsets) == [r.offset for r in m.match(haystack)]
+        assert list(arrays.lengths) == [3, 3, 3, 3, 7]
+        matches = [haystack[o : o + n] for o, n in zip(arrays.offsets, arrays.lengths)]
+        assert matches == [b"foo", b"bar", b"foo", b"bar", b"bazinga"]
+
+        assert len(m.match_arrays(b"nothing here")) == 0
+        assert list(m.match_arrays(haystack, word_boundary=True).offsets) == [
+            13,
+            20,
+            24,
+        ]
+
+
+def test_match_lazy(tmp_path):
+    patterns = ["foo", "bar"]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    hay_file = tmp_path / "haystack.txt"
+    hay_file.write_bytes(b"xx foobar yy foo zz bar")
+    with Matcher(str(pat_file)) as m:
+        haystack = b"xx foobar yy foo zz bar"
+        with m.match_lazy(haystack) as results:
+            assert isinstance(results, MatchResults)
+            assert len(results) == 4
+            assert results[0] == MatchResult(3, b"foo")
+            assert results[-1] == MatchResult(20, b"bar")
+            assert [r.offset for r in results[1:3]] == [6, 13]
+            assert [r.match for r in results] == [b"foo", b"bar", b"foo", b"bar"]
+            assert list(results.to_arrays().offsets) == [3, 6, 13, 20]
+            with pytest.raises(IndexError):
+                results[4]
+        assert results.closed
+        with pytest.raises(ValueError):
+            results[0]
+        results.close()
+
+        empty = m.match_lazy(b"nothing")
+        assert len(empty) == 0
+        assert list(empty) == []
+        assert len(empty.to_arrays()) == 0
+        del empty
+
+        with MappedHaystack(str(hay_file)) as hay:
+            results = m.match_lazy(hay)
+            assert results[1].match == b"bar"
+        with pytest.raises(ValueError):
+            results[1]
+        results.close()
+
+
+@pytest.mark.parametrize(
+    "flags",
+    [
+        {},
+        {"no_overlap": True},
+        {"longest_only": True},
+        {"word_boundary": True},
+        {"word_prefix": True},
+        {"word_suffix": True},
+    ],
+)
+def test_stream_matches_whole_haystack(tmp_path, flags):
+    patterns = ["foo", "foobar", "bar", "barfoo", "oba"]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    haystack = b"foobarfoo foo bar barfoobar xfoo foox foobar" * 7
+    with Matcher(str(pat_file)) as m:
+        expected = m.match(haystack, **flags)
+        assert expected
+        for size in (1, 2, 3, 5, 7, 11, 64, len(haystack)):
+            chunks = [haystack[i : i + size] for i in range(0, len(haystack), size)]
+            assert list(m.stream(chunks, **flags)) == expected, size
+        assert list(m.stream(iter([haystack]), overlap=10, **flags)) == expected
+
+
+def test_streaming_matcher(tmp_path):
+    patterns = ["foo", "bazinga"]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    with Matcher(str(pat_file)) as m:
+        assert m.get_pattern_store_stats().largest_pattern_length == 7
+        streamer = StreamingMatcher(m)
+        assert streamer.overlap == 7
+        hits = []
+        for chunk in (b"xx baz", b"inga ", memoryview(b"yy fo"), b"o" * 20):
+            hits += streamer.feed(chunk)
+        assert streamer.position == 36
+        hits += streamer.finish()
+        assert streamer.finish() == []
+        assert [(h.offset, h.match) for h in hits] == [(3, b"bazinga"), (14, b"foo")]
+        with pytest.raises(ValueError):
+            streamer.feed(b"foo")
+
+        with pytest.raises(ValueError):
+            StreamingMatcher(m, overlap=0)
+
+
+@pytest.mark.parametrize(
+    "flags",
+    [
+        {},
+        {"no_overlap": True},
+        {"longest_only": True},
+        {"word_boundary": True},
+        {"word_suffix": True},
+    ],
+)
+def test_match_many(tmp_path, flags):
+    patterns = ["foo", "foobar", "bar", "barfoo"]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    docs = [b"foobar foo", b"", b"bar", b"foo", bytearray(b"xbarfoo bar"), b"fo"]
+    with Matcher(str(pat_file)) as m:
+        results = m.match_many(docs, **flags)
+        assert len(results) == len(docs)
+        assert results == [m.match(doc, **flags) for doc in docs]
+
+
+def test_match_many_drops_cross_document_hits(tmp_path):
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, ["foo", "oob"])
+    # With whitespace elided the separator disappears, so "fo" + "ob" would
+    # otherwise produce hits spanning both documents
+    with Matcher(str(pat_file), elide_whitespace=True) as m:
+        assert m.match(b"xfo\nobfoo")[0].offset == 1
+        assert m.match_many([]) == []
+        results = m.match_many([b"xfo", b"obfoo"])
+        assert results == [[], [MatchResult(2, b"foo")]]
+
+
+def test_autotune(tmp_path):
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nbar\nbazinga")
+    sample = b"xx foobar yy foo zz bar bazinga " * 256
+    with Matcher(compiled_file) as m:
+        m.match(b"foo")
+        hits_before = m.get_match_stats().total_hits
+        result = m.autotune(
+            sample, threads=[1, 2], chunk_sizes=[1024, 4096], repeat=1, persist=True
+        )
+        assert isinstance(result, TuningResult)
+        assert result.threads in (1, 2)
+        assert result.chunk_size in (1024, 4096)
+        assert result.seconds > 0
+        assert m.get_threads() == result.threads
+        assert m.get_chunk_size() == result.chunk_size
+        assert m.get_small_input_threshold() == result.small_input_threshold
+        # Tuning runs are not counted in the match statistics
+        assert m.get_match_stats().total_hits == hits_before
+
+        # Small inputs run single-threaded without changing the configuration
+        m.set_threads(2)
+        m.set_small_input_threshold(1 << 20)
+        assert [r.offset for r in m.match(b"xx foo")] == [3]
+        assert m.get_threads() == 2
+        with pytest.raises(ValueError):
+            m.set_small_input_threshold(-1)
+        with pytest.raises(ValueError):
+            m.autotune(sample, threads=[])
+
+    tuning_file = tmp_path / ("matcher.omg" + TUNING_SUFFIX)
+    assert tuning_file.is_file()
+    with Matcher(compiled_file) as m:
+        assert m.get_chunk_size() == result.chunk_size
+        assert m.get_small_input_threshold() == result.small_input_threshold
+
+    tuning_file.write_text("not json", encoding="utf-8")
+    with pytest.warns(RuntimeWarning):
+        Matcher(compiled_file).destroy()
+
+
+def test_compiler_add_patterns_bulk(tmp_path, monkeypatch):
+    import mmap
+
+    patterns_buf = b"foo\r\nbar\n\nbazinga\nfoo"
+    expected = (tmp_path / "expected.omg", tmp_path / "patterns.txt")
+    expected[1].write_bytes(patterns_buf)
+    ps_expected = Compiler.compile_from_buffer(str(expected[0]), patterns_buf)
+
+    with Compiler(str(tmp_path / "iterable.omg")) as compiler:
+        compiler.add_pattern(bytearray(b"foo"))
+        assert compiler.add_patterns([b"bar", bytearray(b"bazinga")]) == 2
+        assert compiler.add_patterns(iter([b"foo"])) == 1
+        assert compiler.get_stats() == ps_expected
+        with pytest.raises(TypeError):
+            compiler.add_patterns(["foo"])
+
+    for source in (patterns_buf, memoryview(patterns_buf)):
+        with Compiler(str(tmp_path / "buffer.omg")) as compiler:
+            assert compiler.add_patterns_buffer(source) == 4
+            assert compiler.get_stats() == ps_expected
+
+    with open(expected[1], "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm, Compiler(str(tmp_path / "mmap.omg")) as compiler:
+        assert compiler.add_patterns_buffer(mm) == 4
+        assert compiler.get_stats() == ps_expected
+
+    # Buffers without find() are scanned in blocks; small ones here, so lines
+    # cross block ends and the longest line outgrows a block
+    monkeypatch.setattr(omg.omg, "_LINE_BLOCK_SIZE", 4)
+    with MappedHaystack(str(expected[1])) as mapped:
+        for source in (mapped, memoryview(patterns_buf)):
+            with Compiler(str(tmp_path / "blocks.omg")) as compiler:
+                assert compiler.add_patterns_buffer(source) == 4
+                assert compiler.get_stats() == ps_expected
+    for data in (patterns_buf, b"\n\nfoo\r", b"\r\n", b"x" * 9 + b"\r\nfoo\n\n"):
+        assert list(omg.omg._line_spans(memoryview(data), len(data))) == list(
+            omg.omg._line_spans(data, len(data))
+        )
+    with Compiler(str(tmp_path / "ids.omg"), pattern_ids=True) as compiler:
+        with MappedHaystack(str(expected[1])) as mapped:
+            assert compiler.add_patterns_buffer(mapped) == 4
+        assert compiler._pattern_table.patterns == [b"foo", b"bar", b"bazinga"]
+
+    with Matcher(str(tmp_path / "buffer.omg")) as m:
+        assert [r.match for r in m.match(b"foo bar bazinga")] == [
+            b"foo",
+            b"bar",
+            b"bazinga",
+        ]
+
+    with Compiler(str(tmp_path / "bad.omg")) as compiler:
+        assert compiler.add_patterns_buffer(b"") == 0
+        with pytest.raises(ValueError):
+            compiler.add_patterns_buffer(b"foo\nx\nbar")
+        with pytest.raises(ValueError):
+            compiler.add_patterns([b"x"])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_compile_sharded_matches_serial(tmp_path, workers):
+    patterns = [
+        "foo",
+        "Foo",
+        "bar",
+        "bazinga",
+        "f.oo",
+        "quux",
+        "abc",
+        "abcd",
+        "hello world",
+        "HELLO WORLD",
+        "bar",
+    ]
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, patterns)
+    flags = {"case_insensitive": True, "ignore_punctuation": True}
+
+    serial_file = str(tmp_path / "serial.omg")
+    serial_stats = Compiler.compile_from_filename(serial_file, str(pat_file), **flags)
+    sharded_file = tmp_path / "sharded.omg"
+    sharded_stats = Compiler.compile_sharded(
+        str(pat_file), str(sharded_file), shards=3, workers=workers, **flags
+    )
+    assert sharded_stats == serial_stats
+    assert is_shard_manifest(str(sharded_file))
+    assert not is_shard_manifest(serial_file)
+    # A manifest is not a patterns file
+    with pytest.raises(ValueError, match="ShardedMatcher"):
+        Matcher(str(sharded_file))
+    # Each shard with the sidecar recording its normalization
+    assert len(list(tmp_path.glob("sharded.omg.shard?"))) == 3
+    assert len(list(tmp_path.glob("sharded.omg.shard?.ids"))) == 3
+
+    haystack = b"xx FOO bar f'oo abcd hello world quux bazinga foobar"
+    with Matcher(serial_file) as serial, ShardedMatcher(str(sharded_file)) as sharded:
+        assert sharded.get_pattern_store_stats() == serial_stats
+        for match_flags in (
+            {},
+            {"no_overlap": True},
+            {"longest_only": True},
+            {"word_boundary": True},
+        ):
+            expected = serial.match(haystack, **match_flags)
+            assert sharded.match(haystack, **match_flags) == expected
+            assert sharded.count(haystack, **match_flags) == len(expected)
+            arrays = sharded.match_arrays(haystack, **match_flags)
+            assert list(arrays.offsets) == [r.offset for r in expected]
+        sharded.set_threads(1)
+        sharded.set_chunk_size(1024)
+        hay_file = tmp_path / "haystack.txt"
+        hay_file.write_bytes(haystack)
+        assert sharded.match_file(str(hay_file)) == serial.match(haystack)
+        assert sharded.get_match_stats().total_hits > 0
+        sharded.reset_match_stats()
+        assert sharded.get_match_stats() == MatchStats(0, 0, 0, 0, 0)
+
+
+def test_compile_sharded_errors(tmp_path):
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, ["foo"])
+    with pytest.raises(ValueError):
+        Compiler.compile_sharded(str(pat_file), str(tmp_path / "x.omg"), shards=0)
+    bad_manifest = tmp_path / "bad.json"
+    bad_manifest.write_text('{"format": "other"}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        ShardedMatcher(str(bad_manifest))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_matcher_set(tmp_path, workers):
+    people = str(tmp_path / "people.omg")
+    places = str(tmp_path / "places.omg")
+    Compiler.compile_from_buffer(people, b"alice\nbob")
+    Compiler.compile_from_buffer(places, b"paris\nbob")
+    pat_file = tmp_path / "orgs.txt"
+    write_file(pat_file, ["acme", "initech"])
+    orgs = str(tmp_path / "orgs.omg")
+    Compiler.compile_sharded(str(pat_file), orgs, shards=2)
+
+    haystack = b"alice met bob in paris at acme"
+    with MatcherSet(
+        {"people": people, "places": places, "orgs": orgs}, workers=workers
+    ) as ms:
+        assert ms.names == ["people", "places", "orgs"]
+        assert len(ms) == 3
+        results = ms.match(haystack)
+        assert results == [
+            TaggedMatchResult(0, b"alice", "people"),
+            TaggedMatchResult(10, b"bob", "people"),
+            TaggedMatchResult(10, b"bob", "places"),
+            TaggedMatchResult(17, b"paris", "places"),
+            TaggedMatchResult(26, b"acme", "orgs"),
+        ]
+        arrays = ms.match_arrays(haystack)
+        expected = ms["people"].match(haystack)
+        assert list(arrays["people"].offsets) == [r.offset for r in expected]
+        hay_file = tmp_path / "haystack.txt"
+        hay_file.write_bytes(haystack)
+        ms.reset_match_stats()
+        assert ms.match_file(str(hay_file)) == results
+        assert ms.get_match_stats()["places"].total_hits == 2
+
+
+def test_matcher_set_names_from_paths(tmp_path):
+    first = tmp_path / "first.omg"
+    second = tmp_path / "sub" / "first.omg"
+    second.parent.mkdir()
+    Compiler.compile_from_buffer(str(first), b"foo")
+    Compiler.compile_from_buffer(str(second), b"bar")
+    with MatcherSet([str(first)]) as ms:
+        assert ms.match(b"foo") == [TaggedMatchResult(0, b"foo", "first")]
+    with pytest.raises(ValueError):
+        MatcherSet([str(first), str(second)])
+
+
+def test_pattern_ids_and_payloads(tmp_path):
+    compiled_file = str(tmp_path / "ids.omg")
+    with Compiler(compiled_file, case_insensitive=True, pattern_ids=True) as c:
+        assert c.add_pattern(b"foo", payload=b"entity:1") == 0
+        assert c.add_pattern(bytearray(b"bar")) == 1
+        # A duplicate keeps the ID (and payload) of its first occurrence
+        assert c.add_pattern(b"FOO", payload=b"entity:3") == 0
+        assert c.add_patterns([b"baz", b"bar"]) == 2
+        assert c.add_patterns_buffer(b"qux\r\nquux\n") == 2
+    assert (tmp_path / ("ids.omg" + PATTERN_IDS_SUFFIX)).is_file()
+
+    with Matcher(compiled_file, case_insensitive=True) as m:
+        haystack = b"Foo bar QUUX baz"
+        results = m.match(haystack, with_ids=True)
+        assert [(r.match, r.pattern_id) for r in results] == [
+            (b"Foo", 0),
+            (b"bar", 1),
+            (b"QUUX", 4),
+            (b"baz", 2),
+        ]
+        assert m.match(haystack)[0] == MatchResult(0, b"Foo")
+        arrays = m.match_arrays(haystack, with_ids=True)
+        assert list(arrays.pattern_ids) == [0, 1, 4, 2]
+        assert m.match_arrays(haystack).pattern_ids is None
+        assert m.pattern_id(b"fOO") == 0
+        assert m.pattern(4) == b"quux"
+        assert m.pattern_payload(0) == b"entity:1"
+        assert m.pattern_payload(1) is None
+        with pytest.raises(KeyError):
+            m.pattern_id(b"nope")
+
+    # The normalization is stored with the compiled file, so opening it
+    # without flags looks IDs up the same way
+    with Matcher(compiled_file) as m:
+        assert [r.pattern_id for r in m.match(b"FOO Bar", with_ids=True)] == [0, 1]
+
+
+def test_pattern_ids_from_buffer_and_file(tmp_path):
+    pat_file = tmp_path / "patterns.txt"
+    write_file(pat_file, ["foo", "bar", "foo"])
+    from_file = str(tmp_path / "file.omg")
+    from_buffer = str(tmp_path / "buffer.omg")
+    Compiler.compile_from_filename(from_file, str(pat_file), pattern_ids=True)
+    Compiler.compile_from_buffer(from_buffer, b"bar\nfoo", pattern_ids=True)
+    with Matcher(from_file) as m1, Matcher(from_buffer) as m2:
+        assert [r.pattern_id for r in m1.match(b"foo bar", with_ids=True)] == [0, 1]
+        assert [r.pattern_id for r in m2.match(b"foo bar", with_ids=True)] == [1, 0]
+
+    plain = str(tmp_path / "plain.omg")
+    Compiler.compile_from_buffer(plain, b"foo")
+    with Matcher(plain) as m:
+        with pytest.raises(ValueError):
+            m.match_arrays(b"foo", with_ids=True)
+    with Compiler(plain) as c:
+        assert c.add_pattern(b"foo") is None
+        with pytest.raises(ValueError):
+            c.add_pattern(b"bar", payload=b"x")
+
+    # Recompiling without IDs replaces the sidecar of the old dictionary
+    # with one recording the normalization alone
+    Compiler.compile_from_buffer(from_buffer, b"baz\nqux")
+    Compiler.compile_from_filename(from_file, str(pat_file))
+    for path in (from_buffer, from_file):
+        with open(path + PATTERN_IDS_SUFFIX, "rb") as f:
+            assert len(f.read().splitlines()) == 1
+        with Matcher(path) as m:
+            assert m._normalization == (False, False, False)
+            with pytest.raises(ValueError, match="pattern_ids=True"):
+                m.match(b"baz", with_ids=True)
+
+    # A sidecar that does not belong to the compiled file is rejected
+    Compiler.compile_from_buffer(from_file, b"foo\nbar", pattern_ids=True)
+    sidecar = from_file + PATTERN_IDS_SUFFIX
+    with open(sidecar, "rb") as f:
+        saved = f.read()
+    Compiler.compile_from_buffer(from_file, b"foo\nbar\nbazinga")
+    with open(sidecar, "wb") as f:
+        f.write(saved)
+    with Matcher(from_file) as m:
+        with pytest.raises(ValueError, match="does not belong"):
+            m.match(b"foo", with_ids=True)
+
+    # Even when the compiled file is rebuilt elsewhere at the same size
+    Compiler.compile_from_buffer(from_file, b"foo\nbar", pattern_ids=True)
+    rebuilt = str(tmp_path / "rebuilt.omg")
+    Compiler.compile_from_buffer(rebuilt, b"foo\nbaz")
+    assert os.path.getsize(rebuilt) == os.path.getsize(from_file)
+    st = os.stat(from_file)
+    shutil.copyfile(rebuilt, from_file)
+    os.utime(from_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with Matcher(from_file) as m:
+        with pytest.raises(ValueError, match="does not belong"):
+            m.match(b"foo", with_ids=True)
+
+
+def test_overlay_matcher_and_compact(tmp_path):
+    base = str(tmp_path / "base.omg")
+    with Compiler(base, pattern_ids=True) as c:
+        c.add_pattern(b"foo", payload=b"f")
+        c.add_patterns([b"foobar", b"bar", b"baz"])
+    delta = tmp_path / "delta.txt"
+    write_file(delta, ["qux", "baz"])
+    tombstones = tmp_path / "deleted.txt"
+    write_file(tombstones, ["foo", "baz"])
+
+    haystack = b"foobar baz qux foo"
+    with OverlayMatcher(base, str(delta), str(tombstones)) as overlay:
+        # baz is deleted from the base but re-added by the delta
+        assert overlay.match(haystack) == [
+            MatchResult(0, b"foobar"),
+            MatchResult(3, b"bar"),
+            MatchResult(7, b"baz"),
+            MatchResult(11, b"qux"),
+        ]
+        assert overlay.match(haystack, no_overlap=True) == [
+            MatchResult(0, b"foobar"),
+            MatchResult(7, b"baz"),
+            MatchResult(11, b"qux"),
+        ]
+        arrays = overlay.match_arrays(haystack)
+        assert list(arrays.offsets) == [0, 3, 7, 11]
+        with Matcher(base) as m1, Matcher(str(delta)) as m2:
+            layers = [m1.get_pattern_store_stats(), m2.get_pattern_store_stats()]
+        stats = overlay.get_pattern_store_stats()
+        assert stats.stored_pattern_count == sum(s.stored_pattern_count for s in layers)
+
+        compacted = str(tmp_path / "compacted.omg")
+        Compiler.compact(base, str(delta), compacted, tombstones=str(tombstones))
+        with Matcher(compacted) as m:
+            assert m.match(haystack) == overlay.match(haystack)
+            assert [m.pattern(i) for i in range(4)] == [
+                b"foobar",
+                b"bar",
+                b"qux",
+                b"baz",
+            ]
+
+    # Tombstones alone, as an iterable
+    with OverlayMatcher(base, tombstones=[b"bar"]) as overlay:
+        assert [r.match for r in overlay.match(haystack)] == [
+            b"foobar",
+            b"foo",
+            b"baz",
+            b"foo",
+        ]
+
+
+def test_overlay_tombstones_use_compiled_normalization(tmp_path):
+    base = str(tmp_path / "base.omg")
+    with Compiler(base, case_insensitive=True, pattern_ids=True) as c:
+        c.add_patterns([b"foo", b"bar"])
+    # Opened without flags, tombstones are still folded the way base was
+    with OverlayMatcher(base, tombstones=[b"Foo"]) as overlay:
+        assert [r.match for r in overlay.match(b"FOO bar fOo BAR")] == [
+            b"bar",
+            b"BAR",
+        ]
+
+
+def test_compact_payloads_and_errors(tmp_path):
+    base = str(tmp_path / "base.omg")
+    delta = str(tmp_path / "delta.omg")
+    with Compiler(base, pattern_ids=True) as c:
+        c.add_pattern(b"foo", payload=b"old")
+        c.add_pattern(b"bar", payload=b"kept")
+    with Compiler(delta, pattern_ids=True) as c:
+        c.add_pattern(b"foo", payload=b"new")
+        c.add_pattern(b"bar")
+    out = str(tmp_path / "out.omg")
+    Compiler.compact(base, delta, out)
+    with Matcher(out) as m:
+        assert m.pattern_payload(m.pattern_id(b"foo")) == b"new"
+        assert m.pattern_payload(m.pattern_id(b"bar")) == b"kept"
+
+    plain = str(tmp_path / "plain.omg")
+    Compiler.compile_from_buffer(plain, b"foo")
+    with pytest.raises(ValueError):
+        Compiler.compact(plain, None, out)
+
+
+@pytest.mark.parametrize("window", [None, 16])
+def test_count_contains_and_limit(tmp_path, monkeypatch, window):
+    if window is not None:
+        # Small windows so the haystack below is scanned piecewise
+        monkeypatch.setattr(omg.omg, "_EARLY_EXIT_WINDOW", window)
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nfoobar\nbar\nbazinga")
+    haystack = b"xx foobar yy foo zz bar bazinga " * 4
+    with Matcher(compiled_file) as m:
+        for flags in (
+            {},
+            {"no_overlap": True},
+            {"longest_only": True},
+            {"word_boundary": True},
+        ):
+            expected = m.match(haystack, **flags)
+            assert m.count(haystack, **flags) == len(expected)
+            for limit in (0, 1, 5, len(expected), len(expected) + 1):
+                assert m.match(haystack, limit=limit, **flags) == expected[:limit]
+        assert m.contains(haystack)
+        assert m.contains(b"a" * 100 + b"bazinga")
+        assert not m.contains(b"a" * 100)
+        assert not m.contains(b"a" * 100 + b"xbazinga", word_boundary=True)
+        assert m.count(b"") == 0
+        with pytest.raises(ValueError):
+            m.match(haystack, limit=-1)
+
+
+def test_contains_exits_early_on_compiled_file(tmp_path, monkeypatch):
+    window = 16
+    monkeypatch.setattr(omg.omg, "_EARLY_EXIT_WINDOW", window)
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nbar")
+    haystack = b"foo" + b"x" * (10 * window) + b"bar"
+    with Matcher(compiled_file) as m:
+        # A plain compiled file records its normalization, so it is windowed
+        scanned = []
+        match_buffer = m._match_buffer
+        monkeypatch.setattr(
+            m,
+            "_match_buffer",
+            lambda buf, size, *flags: scanned.append(size)
+            or match_buffer(buf, size, *flags),
+        )
+        assert m.contains(haystack)
+        assert sum(scanned) < len(haystack)
+        scanned.clear()
+        assert m.match(haystack, limit=1) == [MatchResult(0, b"foo")]
+        assert sum(scanned) < len(haystack)
+
+
+@pytest.mark.parametrize("pattern_ids", [False, True])
+def test_contains_and_limit_with_compiled_normalization(
+    tmp_path, monkeypatch, pattern_ids
+):
+    window = 16
+    monkeypatch.setattr(omg.omg, "_EARLY_EXIT_WINDOW", window)
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(
+        compiled_file, b"foo", ignore_punctuation=True, pattern_ids=pattern_ids
+    )
+    # A hit longer than the pattern, straddling the first window seam
+    hit = b"f" + b"'" * 10 + b"oo"
+    haystack = b"x" * (window - 5) + hit + b"x" * (3 * window)
+    # Opened without flags: the compiled normalization still applies
+    with Matcher(compiled_file) as m:
+        assert m.match(haystack) == [MatchResult(window - 5, hit)]
+        assert m.contains(haystack)
+        assert m.match(haystack, limit=1) == [MatchResult(window - 5, hit)]
+
+
+def test_histogram_and_hit_counter(tmp_path):
+    compiled_file = str(tmp_path / "matcher.omg")
+    with Compiler(compiled_file, case_insensitive=True, pattern_ids=True) as c:
+        c.add_patterns([b"foo", b"bar", b"bazinga"])
+    haystack = b"foo FOO bar Foo bazinga"
+    with Matcher(compiled_file, case_insensitive=True) as m:
+        # Surface forms are folded onto the normalized pattern
+        assert m.histogram(haystack) == Counter({b"FOO": 3, b"BAR": 1, b"BAZINGA": 1})
+        assert m.histogram(haystack, by_id=True) == Counter({0: 3, 1: 1, 2: 1})
+        assert m.histogram(b"nothing here") == Counter()
+
+        counter = HitCounter(m, by_id=True)
+        assert counter.update(haystack) == 5
+        assert counter.update(b"bar baR") == 2
+        assert counter.total == 7
+        assert counter.counts() == Counter({0: 3, 1: 3, 2: 1})
+        assert counter.most_common(1)[0][1] == 3
+        counter.clear()
+        assert counter.total == 0
+        assert counter.counts() == Counter()
+
+    # Opened without flags, the compiled normalization still folds the hits
+    with Matcher(compiled_file) as m:
+        assert m.histogram(haystack) == Counter({b"FOO": 3, b"BAR": 1, b"BAZINGA": 1})
+
+        # A mapped file is tallied on its full contents
+        hay_file = tmp_path / "haystack.txt"
+        hay_file.write_bytes(haystack)
+        with MappedHaystack(str(hay_file)) as mapped:
+            assert m.histogram(mapped) == m.histogram(haystack)
+            counter = HitCounter(m)
+            assert counter.update(mapped) == 5
+            assert counter.counts() == m.histogram(haystack)
+
+
+def test_match_records(tmp_path):
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nbar\nfoo;bar\nbar baz")
+    haystack = b"foo bar\nxx foo\nbar\n\nbar baz"
+    with Matcher(compiled_file) as m:
+        assert m.match_records(haystack) == [
+            RecordMatch(0, 0, 3, 0),
+            RecordMatch(0, 4, 3, 4),
+            RecordMatch(1, 3, 3, 11),
+            RecordMatch(2, 0, 3, 15),
+            RecordMatch(4, 0, 7, 20),
+            RecordMatch(4, 0, 3, 20),
+        ]
+        assert m.matching_records(haystack) == [
+            (0, b"foo bar"),
+            (1, b"xx foo"),
+            (2, b"bar"),
+            (4, b"bar baz"),
+        ]
+
+        records = b"a;foo;bar;b"
+        assert [
+            (r.record, r.column, r.length)
+            for r in m.match_records(records, delimiter=b";", no_overlap=True)
+        ] == [(1, 0, 7)]
+        # Without the crossing "foo;bar", the hits it shadowed are kept
+        assert [
+            (r.record, r.column, r.length)
+            for r in m.match_records(
+                records, delimiter=b";", drop_crossing=True, no_overlap=True
+            )
+        ] == [(1, 0, 3), (2, 0, 3)]
+        assert m.matching_records(records, delimiter=b";") == [
+            (1, b"foo"),
+            (2, b"bar"),
+        ]
+        with pytest.raises(ValueError):
+            m.match_records(haystack, delimiter=b"")
+
+
+def test_match_records_located_blockwise(tmp_path, monkeypatch):
+    # Record numbers are counted between hits a few bytes at a time
+    monkeypatch.setattr(omg.omg, "_LINE_BLOCK_SIZE", 4)
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nbar")
+    haystack = b"xxfoo\n\n\nbar\n\nyyyyyyyyyyfoo\n\n\n\nbar"
+    hay_file = tmp_path / "haystack.txt"
+    hay_file.write_bytes(haystack)
+
+    hits = sorted(
+        off
+        for name in (b"foo", b"bar")
+        for off in range(len(haystack))
+        if haystack.startswith(name, off)
+    )
+
+    def expected(delimiter):
+        starts = [0]
+        for text in haystack.split(delimiter)[:-1]:
+            starts.append(starts[-1] + len(text) + len(delimiter))
+        out = []
+        for off in hits:
+            record = bisect.bisect_right(starts, off) - 1
+            out.append((record, off - starts[record], 3, off))
+        return out
+
+    with Matcher(compiled_file) as m, MappedHaystack(str(hay_file)) as hay:
+        # Multi-byte and self-overlapping delimiters straddle the blocks
+        for delimiter in (b"\n", b"\n\n", b"y\n", b"yy"):
+            assert [
+                (r.record, r.column, r.length, r.offset)
+                for r in m.match_records(hay, delimiter=delimiter)
+            ] == expected(delimiter), delimiter
+        assert m.matching_records(hay, delimiter=b"\n\n") == [
+            (0, b"xxfoo"),
+            (1, b"\nbar"),
+            (2, b"yyyyyyyyyyfoo"),
+            (4, b"bar"),
+        ]
+        # Both "foo" hits cross an "o\n" and are dropped
+        assert m.match_records(haystack, delimiter=b"o\n", drop_crossing=True) == [
+            RecordMatch(1, 2, 3, 8),
+            RecordMatch(2, 3, 3, 30),
+        ]
+
+
+def test_match_mixin_requires_overrides():
+    class Partial(omg.omg._MatchMixin):
+        def match(self, haystack, *flags):
+            return []
+
+    # A matcher missing part of the interface cannot be created
+    with pytest.raises(TypeError, match="abstract"):
+        Partial()
@@ -0,0 +1,130 @@
+# tests/test_parallel.py
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import omg.parallel
+from omg.omg import Compiler, MatchArrays, Matcher, MatchResult, MatchStats
+from omg.parallel import ThreadPoolMatcher, scan_corpus
+
+
+def open_bytes(path):
+    return Path(path).read_bytes()
+
+
+def make_corpus(tmp_path, count=6):
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nbar\nbazinga")
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"doc{i}.txt"
+        path.write_bytes(b"xx foobar yy " * i + b"bazinga")
+        paths.append(str(path))
+    return compiled_file, paths
+
+
+def test_scan_corpus(tmp_path):
+    compiled_file, paths = make_corpus(tmp_path)
+    with Matcher(compiled_file) as m:
+        expected = {p: list(m.match_file(p)) for p in paths}
+
+    seen = {}
+    for path, arrays in scan_corpus(compiled_file, paths, workers=2):
+        assert isinstance(arrays, MatchArrays)
+        seen[path] = [
+            MatchResult(o, open_bytes(path)[o : o + n])
+            for o, n in zip(arrays.offsets, arrays.lengths)
+        ]
+    assert seen == expected
+
+
+def test_scan_corpus_reports_bad_paths(tmp_path):
+    compiled_file, paths = make_corpus(tmp_path, count=3)
+    missing = str(tmp_path / "missing.txt")
+    results = list(
+        scan_corpus(compiled_file, [paths[0], missing, paths[1]], ordered=True)
+    )
+    assert [path for path, _ in results] == [paths[0], missing, paths[1]]
+    assert isinstance(results[1][1], FileNotFoundError)
+    assert isinstance(results[0][1], MatchArrays)
+    assert isinstance(results[2][1], MatchArrays)
+
+
+def test_scan_corpus_bad_compiled_file(tmp_path):
+    _, paths = make_corpus(tmp_path, count=2)
+    # Raised in the caller instead of crashing (and respawning) every worker
+    with pytest.raises(RuntimeError):
+        list(scan_corpus(str(tmp_path / "missing.omg"), paths, workers=2))
+    manifest = str(tmp_path / "sharded.omg")
+    Compiler.compile_sharded(str(tmp_path / "doc1.txt"), manifest, shards=2)
+    with pytest.raises(ValueError, match="ShardedMatcher"):
+        list(scan_corpus(manifest, paths, workers=2))
+
+
+def test_scan_corpus_worker_load_error(tmp_path, monkeypatch):
+    _, paths = make_corpus(tmp_path, count=2)
+    # Restored afterwards, as this runs the worker functions in-process
+    for name in ["_matcher", "_match_flags", "_load_error"]:
+        monkeypatch.setattr(omg.parallel, name, getattr(omg.parallel, name))
+    # A worker that fails to load reports the failure for each of its paths
+    # instead of raising from the pool initializer
+    omg.parallel._init_worker(str(tmp_path / "missing.omg"), *[False] * 3, 1, 0, ())
+    path, error = omg.parallel._scan_file(paths[0])
+    assert path == paths[0]
+    assert isinstance(error, RuntimeError)
+
+
+def test_scan_corpus_ordered_with_flags(tmp_path):
+    compiled_file, paths = make_corpus(tmp_path)
+    results = list(
+        scan_corpus(compiled_file, paths, workers=2, ordered=True, word_boundary=True)
+    )
+    assert [path for path, _ in results] == paths
+    # "foobar" is not a whole-word hit for "foo" or "bar"
+    assert [len(arrays) for _, arrays in results] == [1] * len(paths)
+
+
+def test_thread_pool_matcher(tmp_path):
+    compiled_file, paths = make_corpus(tmp_path, count=12)
+    haystacks = [open_bytes(p) for p in paths]
+    with Matcher(compiled_file) as m:
+        expected = [m.match(h, word_boundary=True) for h in haystacks]
+        expected_hits = sum(len(r) for r in expected)
+
+    with ThreadPoolMatcher(compiled_file, workers=4) as pool:
+        assert pool.map(iter(haystacks), word_boundary=True) == expected
+        assert pool.submit(haystacks[3], word_boundary=True).result() == expected[3]
+        # One dictionary handle for all workers, with racy statistics
+        assert len(pool._matchers) == 1
+        with pytest.warns(RuntimeWarning, match="shared=False"):
+            pool.get_match_stats()
+
+    # A matcher per worker thread, for exact statistics
+    with ThreadPoolMatcher(compiled_file, workers=4, shared=False) as pool:
+        assert pool.map(haystacks, word_boundary=True) == expected
+        assert pool.submit(haystacks[3], word_boundary=True).result() == expected[3]
+        assert pool.get_match_stats().total_hits == expected_hits + len(expected[3])
+        pool.reset_match_stats()
+        assert pool.get_match_stats() == MatchStats(0, 0, 0, 0, 0)
+
+
+def test_matcher_shared_between_threads(tmp_path):
+    compiled_file, paths = make_corpus(tmp_path, count=8)
+    haystacks = [open_bytes(p) for p in paths] * 8
+    m = Matcher(compiled_file)
+    expected = [m.match(h) for h in haystacks]
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(m.match, haystacks)) == expected
+    m.destroy()
+    with pytest.raises(RuntimeError):
+        m.match(haystacks[0])
+    with pytest.raises(RuntimeError):
+        m.get_threads()
+    m.destroy()
+
+
+def test_match_stats_add():
+    a = MatchStats(1, 2, 3, 4, 5)
+    assert a + a == MatchStats(2, 4, 6, 8, 10)
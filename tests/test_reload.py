@@ -0,0 +1,119 @@
+# tests/test_reload.py
+
+import gc
+import os
+import threading
+import time
+
+import pytest
+
+import omg.reload
+from omg.omg import Compiler
+from omg.reload import ReloadableMatcher
+
+
+def compile_patterns(path, patterns):
+    # Compiled next to the target and renamed over it, as a deployment would
+    tmp = str(path) + ".tmp"
+    Compiler.compile_from_buffer(tmp, b"\n".join(patterns))
+    os.replace(tmp, path)
+
+
+def bump_mtime(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_reload_swaps_after_in_flight_calls(tmp_path):
+    path = tmp_path / "dict.omg"
+    compile_patterns(path, [b"foo"])
+    with ReloadableMatcher(str(path), poll_interval=None) as rm:
+        rm.set_threads(1)
+        assert [r.match for r in rm.match(b"foo bar")] == [b"foo"]
+        assert not rm.reload()
+
+        with rm.pinned() as old:
+            compile_patterns(path, [b"bar"])
+            bump_mtime(path)
+            assert rm.reload()
+            assert rm.reloads == 1
+            # The old handle stays usable until the pinned call finishes
+            assert [r.match for r in old.match(b"foo bar")] == [b"foo"]
+            assert [r.match for r in rm.match(b"foo bar")] == [b"bar"]
+        with pytest.raises(RuntimeError):
+            old.match(b"foo")
+        with rm.pinned() as current:
+            assert current.get_threads() == 1
+        assert rm.get_match_stats().total_hits == 1
+        rm.reset_match_stats()
+        assert rm.get_match_stats().total_hits == 0
+    with pytest.raises(RuntimeError):
+        rm.match(b"foo")
+
+
+def test_reload_keeps_matcher_on_bad_file(tmp_path, monkeypatch):
+    path = tmp_path / "dict.omg"
+    compile_patterns(path, [b"foo"])
+    with ReloadableMatcher(str(path), poll_interval=None) as rm:
+        bump_mtime(path)
+
+        def fail(*args):
+            raise RuntimeError("Failed to create matcher")
+
+        monkeypatch.setattr(omg.reload, "Matcher", fail)
+        with pytest.warns(RuntimeWarning):
+            assert not rm.reload()
+        # A failed version is not retried until the file changes again
+        assert not rm.reload()
+        assert [r.match for r in rm.match(b"foo")] == [b"foo"]
+
+
+def test_reload_polling_under_load(tmp_path):
+    path = tmp_path / "dict.omg"
+    compile_patterns(path, [b"foo"])
+    errors = []
+    stop = threading.Event()
+
+    def worker(rm):
+        while not stop.is_set():
+            try:
+                assert len(rm.match_arrays(b"foo bar")) == 1
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+
+    with ReloadableMatcher(str(path), poll_interval=0.01) as rm:
+        threads = [threading.Thread(target=worker, args=(rm,)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        compile_patterns(path, [b"bar"])
+        bump_mtime(path)
+        deadline = time.monotonic() + 5
+        while rm.reloads == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stop.set()
+        for t in threads:
+            t.join()
+        assert rm.reloads == 1
+        assert [r.match for r in rm.match(b"foo bar")] == [b"bar"]
+    assert errors == []
+
+
+def test_reload_unclosed_matcher_is_collected(tmp_path):
+    compiled_file = tmp_path / "matcher.omg"
+    compile_patterns(compiled_file, [b"foo"])
+    rm = ReloadableMatcher(str(compiled_file), poll_interval=0.01)
+    thread = rm._thread
+    matcher = rm._current.matcher
+    time.sleep(0.05)
+    # The polling thread does not keep the instance alive
+    del rm
+    gc.collect()
+    thread.join(5)
+    assert not thread.is_alive()
+    with pytest.raises(RuntimeError):
+        matcher.match(b"foo")
+
+
+def test_reload_invalid_interval(tmp_path):
+    with pytest.raises(ValueError):
+        ReloadableMatcher(str(tmp_path / "missing.omg"), poll_interval=0)
@@ -0,0 +1,89 @@
+# tests/test_server.py
+
+import socket
+import struct
+import threading
+
+import pytest
+
+from omg.omg import Compiler, Matcher
+from omg.server import (
+    REQUEST_HEADER,
+    RESPONSE_HEADER,
+    STATUS_ERROR,
+    MatchClient,
+    MatchServer,
+    encode_flags,
+)
+
+
+@pytest.fixture
+def matcher(tmp_path):
+    compiled_file = str(tmp_path / "matcher.omg")
+    Compiler.compile_from_buffer(compiled_file, b"foo\nfoobar\nbar\nbazinga")
+    with Matcher(compiled_file) as m:
+        yield m
+
+
+def addresses(tmp_path):
+    yield ("127.0.0.1", 0)
+    if hasattr(socket, "AF_UNIX"):
+        yield str(tmp_path / "omg.sock")
+
+
+def test_server_round_trip(matcher, tmp_path):
+    haystack = b"xx foobar yy foo zz bar bazinga"
+    for address in addresses(tmp_path):
+        with MatchServer(matcher, address, workers=2, max_pending=4) as server:
+            server.start()
+            with MatchClient(server.server_address, timeout=10) as client:
+                for flags in ({}, {"no_overlap": True}, {"word_boundary": True}):
+                    expected = matcher.match_arrays(haystack, **flags)
+                    assert client.match(haystack, **flags) == expected
+                assert len(client.match(b"")) == 0
+                docs = [haystack[i:] for i in range(20)]
+                assert client.match_many(docs, window=4) == [
+                    matcher.match_arrays(doc) for doc in docs
+                ]
+
+
+def test_server_concurrent_clients(matcher, tmp_path):
+    haystack = b"foo bar " * 1000
+    expected = matcher.match_arrays(haystack)
+    errors = []
+
+    with MatchServer(matcher, ("127.0.0.1", 0), workers=4) as server:
+        server.start()
+
+        def run():
+            try:
+                with MatchClient(server.server_address, timeout=10) as client:
+                    for arrays in client.match_many([haystack] * 10):
+                        assert arrays == expected
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert errors == []
+
+
+def test_server_rejects_oversized_request(matcher):
+    with MatchServer(matcher, ("127.0.0.1", 0), max_request_size=8) as server:
+        server.start()
+        with socket.create_connection(server.server_address, timeout=10) as sock:
+            sock.sendall(REQUEST_HEADER.pack(100, encode_flags(no_overlap=True)))
+            status, size = RESPONSE_HEADER.unpack(sock.recv(RESPONSE_HEADER.size))
+            assert status == STATUS_ERROR
+            assert b"too large" in sock.recv(size)
+
+
+def test_encode_flags():
+    assert encode_flags() == 0
+    assert encode_flags(no_overlap=True, word_suffix=True) == 0x11
+    assert struct.calcsize("<QB") == REQUEST_HEADER.size == 9
+    with pytest.raises(ValueError):
+        MatchServer(None, ("127.0.0.1", 0), max_pending=0)